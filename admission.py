@@ -0,0 +1,181 @@
+"""
+Admission control for chat and SQL work, shared by the FastAPI endpoints and
+the Gradio handlers (both run on the same event loop).
+
+Two checks, in order:
+  - a token bucket per user (user_name, else session_id) and action kind,
+    so one person hammering Run/Send gets turned away before queueing.
+    Requests with neither (plain /e2e API clients) have nobody to charge
+    and skip it; one shared bucket would have them throttle each other;
+  - a concurrency cap per resource class ("db", "llm") with a bounded FIFO
+    wait queue. A full queue, or a wait longer than ADMIT_QUEUE_TIMEOUT,
+    is rejected at once instead of piling onto the pool / upstream API.
+
+Rejections raise Rejected; callers turn it into HTTP 429 or a "busy" notice.
+
+    async with admit("sql", user_name, session_id):
+        ...
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from deployment import per_worker, pg_pool_sizes
+
+# requests per second per user (0 disables) and bucket size. Enforced by each
+# worker as configured: one user's requests aren't split evenly across
+# workers (they may all land on one), so dividing by SERVER_WORKERS would
+# leave them a fraction of the rate. Spread over N workers a user can get
+# up to N times the rate, the lesser evil for a fairness limit.
+CHAT_RATE = float(os.getenv("ADMIT_CHAT_RATE", "0.5"))
+CHAT_BURST = float(os.getenv("ADMIT_CHAT_BURST", "5"))
+SQL_RATE = float(os.getenv("ADMIT_SQL_RATE", "2"))
+SQL_BURST = float(os.getenv("ADMIT_SQL_BURST", "10"))
+# concurrent requests per resource class: the LLM cap and the queue length
+# are deployment-wide totals and each worker gets its share. The DB cap is
+# per process and defaults to the async pool size (already split per worker
+# by pg_pool_sizes).
+DB_CONCURRENCY = int(os.getenv("ADMIT_DB_CONCURRENCY", "0")) or pg_pool_sizes()[0]
+LLM_CONCURRENCY = per_worker(int(os.getenv("ADMIT_LLM_CONCURRENCY", "32")))
+QUEUE_MAX = per_worker(int(os.getenv("ADMIT_QUEUE_MAX", "64")))   # waiters per class
+QUEUE_TIMEOUT = float(os.getenv("ADMIT_QUEUE_TIMEOUT", "5"))     # max seconds in the queue
+MAX_TRACKED_USERS = int(os.getenv("ADMIT_MAX_USERS", "10000"))
+
+
+class Rejected(Exception):
+    """reason: "rate" (per-user limit) or "busy" (resource saturated)."""
+
+    def __init__(self, message: str, reason: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per key, `rate` tokens/s up to `burst`; least recently seen keys are forgotten."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = MAX_TRACKED_USERS):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()  # key -> [tokens, last_refill]
+
+    def take(self, key) -> float:
+        """Spends one token. Returns 0 when admitted, else seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = [self.burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+            b[1] = now
+        if b[0] >= 1.0:
+            b[0] -= 1.0
+            return 0.0
+        return (1.0 - b[0]) / self.rate
+
+
+class Gate:
+    """Like asyncio.Semaphore, but with a bounded FIFO queue and a wait timeout."""
+
+    def __init__(self, name: str, limit: int, queue_max: int = QUEUE_MAX, timeout: float = QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self._in_use = 0
+        self._waiters: deque = deque()  # futures; result True = slot handed over, False = timed out
+        self._stats = dict(admitted=0, shed_queue_full=0, shed_timeout=0,
+                           wait_seconds_total=0.0, wait_seconds_max=0.0)
+
+    async def acquire(self):
+        if self._in_use < self.limit and not self._waiters:
+            self._in_use += 1
+            self._stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.queue_max:
+            self._stats["shed_queue_full"] += 1
+            raise Rejected(f"Error: the {self.name} is busy, please try again.", "busy", self.timeout)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._waiters.append(fut)
+        timer = loop.call_later(self.timeout, lambda: fut.done() or fut.set_result(False))
+        started = time.monotonic()
+        try:
+            granted = await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.result():
+                self.release()  # handed a slot just as we were cancelled
+            raise
+        finally:
+            timer.cancel()
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+        waited = time.monotonic() - started
+        if not granted:
+            self._stats["shed_timeout"] += 1
+            raise Rejected(f"Error: the {self.name} is busy, please try again.", "busy", self.timeout)
+        s = self._stats
+        s["admitted"] += 1
+        s["wait_seconds_total"] += waited
+        s["wait_seconds_max"] = max(s["wait_seconds_max"], waited)
+
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(True)  # the slot moves to the waiter, _in_use unchanged
+                return
+        self._in_use -= 1
+
+    def stats(self) -> dict:
+        return dict(self._stats, limit=self.limit, in_use=self._in_use, waiting=len(self._waiters))
+
+
+# action kind -> (rate limiter, resource gate)
+_gates = {
+    "db": Gate("database", DB_CONCURRENCY),
+    "llm": Gate("assistant", LLM_CONCURRENCY),
+}
+_kinds = {
+    "sql": (RateLimiter(SQL_RATE, SQL_BURST), _gates["db"]),
+    "chat": (RateLimiter(CHAT_RATE, CHAT_BURST), _gates["llm"]),
+}
+_shed_rate = {kind: 0 for kind in _kinds}
+
+
+@asynccontextmanager
+async def admit(kind: str, user_name: str | None = None, session_id: str | None = None):
+    """
+    Rate check, then holds one "db" (kind="sql") or "llm" (kind="chat") slot
+    for the block. Raises Rejected.
+    """
+    limiter, gate = _kinds[kind]
+    identity = user_name or session_id
+    wait = limiter.take(identity) if identity else 0.0
+    if wait:
+        _shed_rate[kind] += 1
+        raise Rejected(f"Too many requests, please wait {math.ceil(wait)}s and try again.", "rate", wait)
+    await gate.acquire()
+    try:
+        yield
+    finally:
+        gate.release()
+
+
+def admission_stats() -> dict:
+    """Per resource class: in_use, waiting, admitted, shed counts and queue wait; plus per-kind rate sheds."""
+    out = {name: gate.stats() for name, gate in _gates.items()}
+    out["shed_rate"] = dict(_shed_rate)
+    return out
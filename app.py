@@ -1,80 +1,152 @@
 import os
 import gradio as gr
-from openai import AsyncOpenAI
 import pandas as pd
-import uuid, asyncio
+import uuid, time
 
-from sql_tab import run_sql
+from sql_tab import fetch_page_async, query_plan_markdown
 from logger import log_event
-from chat_helpers import build_input_from_history, get_db_sys_prompt
-
-oclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from chat_helpers import build_input_from_history, get_db_sys_prompt, coalesce_deltas
+from llm_cache import response_cache, request_key
+from admission import admit, Rejected
+from conversation_store import conversations, CHAT_STORE
+import metrics
+
+MOCK_OPENAI = os.getenv("MOCK_OPENAI", "").lower() in {"1", "true", "yes"}
+_oclient = None
 max_rows = 100
 
-async def respond_once(message, history):
-
-    text_input = build_input_from_history(message, history)
-    kwargs = dict(
+def get_client():
+    """The AsyncOpenAI client, built on first use: importing openai takes about half a second."""
+    global _oclient
+    if _oclient is None:
+        if MOCK_OPENAI:
+            # MOCK mode to isolate app/DB without burning tokens (see mock_openai.py)
+            from mock_openai import make_client
+            _oclient = make_client()
+        else:
+            from openai import AsyncOpenAI
+            _oclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _oclient
+
+def _request_kwargs(message, history, conversation=None):
+    return dict(
         model="gpt-4.1",
-        input=text_input,
+        input=conversation.build_input(message) if conversation is not None else build_input_from_history(message, history),
         temperature=0,
         instructions=get_db_sys_prompt(),
         tools=[{"type": "web_search"}],
         tool_choice="auto",
         parallel_tool_calls=True,
     )
-    # MOCK mode to isolate app/DB without burning tokens
-    if os.getenv("MOCK_OPENAI", "").lower() in {"1", "true", "yes"}:
-        import random, asyncio
-        await asyncio.sleep(random.uniform(0.05, 0.25))
-        return "MOCK: Here’s a fabricated answer for load testing."
 
-    resp = await oclient.responses.create(**kwargs)
-    return getattr(resp, "output_text", "")
+async def respond_once(message, history, conversation=None):
+    """Whole answer in one call; with `conversation` (conversation_store) `history` is ignored."""
+    kwargs = _request_kwargs(message, history, conversation)
+
+    async def upstream():
+        with metrics.timed("llm_request_seconds"):
+            resp = await get_client().responses.create(**kwargs)
+        return getattr(resp, "output_text", "")
+
+    return await response_cache.once(request_key(kwargs), upstream)
+
+def stream_reply(message, history, conversation=None):
+    """
+    Async iterator of (replace, text) deltas for the answer, coalesced (see
+    chat_helpers.coalesce_deltas). The request is built right away, so the
+    caller may change `history` (or `conversation`) afterwards.
+    """
+    kwargs = _request_kwargs(message, history, conversation)
+
+    async def upstream():
+        # (replace, text) items; see llm_cache._Flight
+        buffer = []
+        started = time.perf_counter()
+        async with get_client().responses.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if not buffer:
+                        metrics.observe("llm_first_token_seconds", time.perf_counter() - started)
+                    buffer.append(event.delta)
+                    yield False, event.delta
+
+            final = await stream.get_final_response()
+            metrics.observe("llm_stream_seconds", time.perf_counter() - started)
+            final_text = getattr(final, "output_text", None)
+            if final_text and (not buffer or final_text != "".join(buffer)):
+                yield True, final_text
+
+    # Identical in-flight requests share one upstream stream; repeats replay from cache
+    return coalesce_deltas(response_cache.stream(request_key(kwargs), upstream))
 
 async def respond(message, history):
-    text_input = build_input_from_history(message, history)
-    kwargs = dict(
-        model="gpt-4.1",
-        input=text_input,
-        temperature=0,
-        instructions=get_db_sys_prompt(),
-        tools=[{"type": "web_search"}],
-        tool_choice="auto",
-        parallel_tool_calls=True,
-    )
-
-    buffer = []
-    async with oclient.responses.stream(**kwargs) as stream:
-        async for event in stream:
-            if event.type == "response.output_text.delta":
-                buffer.append(event.delta)
-                yield "".join(buffer)
-
-        final = await stream.get_final_response()
-        final_text = getattr(final, "output_text", None)
-        if final_text and (not buffer or final_text != "".join(buffer)):
-            yield final_text
-
-async def chat_driver(user_message, messages_history, _user_name, _session_id):
-    messages_history = messages_history or []
-    base = messages_history + [{"role": "user", "content": user_message}]
-    assistant_text = ""
-
-    asyncio.create_task(log_event(_user_name, _session_id, "chat_user", {"text": user_message}))
-
-    async for chunk in respond(user_message, messages_history):
-        assistant_text = chunk
+    """Cumulative answer text, one value per coalesced chunk."""
+    text = ""
+    async for replace, delta in stream_reply(message, history):
+        text = delta if replace else text + delta
+        yield text
+
+async def chat_turn(user_message, messages_history, _user_name, _session_id, conversation=None):
+    # Gradio hands us a fresh list per event, so the turn is appended to it in
+    # place and only the assistant message is updated as chunks arrive, rather
+    # than copying the whole conversation for every chunk. With a server-side
+    # `conversation` the history comes from there and the turn is added to it
+    # once the answer is complete.
+    if conversation is not None:
+        history = conversation.display()
+    else:
+        history = messages_history if messages_history is not None else []
+    # the HTTP request's trace ID under /e2e/chat/stream; Gradio events get their own
+    trace_id = metrics.current_trace_id() or metrics.new_trace_id()
+    replies = stream_reply(user_message, history, conversation)
+    assistant = {"role": "assistant", "content": ""}
+    history.append({"role": "user", "content": user_message})
+    history.append(assistant)
+
+    await log_event(_user_name, _session_id, "chat_user", {"text": user_message}, trace_id)
+
+    async for replace, delta in replies:
+        assistant["content"] = delta if replace else assistant["content"] + delta
         # stream to UI
-        yield base + [{"role": "assistant", "content": assistant_text}], ""
+        yield history, ""
 
+    if conversation is not None:
+        conversation.add_turn(user_message, assistant["content"])
     # after stream finished, log the final assistant text
-    asyncio.create_task(log_event(_user_name, _session_id, "chat_assistant", {"text": assistant_text}))
+    await log_event(_user_name, _session_id, "chat_assistant", {"text": assistant["content"]}, trace_id)
+
+async def chat_driver(user_message, messages_history, _user_name, _session_id):
+    """chat_turn under admission control (see admission.py)."""
+    messages_history = messages_history if messages_history is not None else []
+    try:
+        async with admit("chat", _user_name, _session_id):
+            async for out in chat_turn(user_message, messages_history, _user_name, _session_id):
+                yield out
+    except Rejected as e:
+        # a toast rather than a chat message, so the notice never reaches the model
+        gr.Warning(str(e))
+        yield messages_history, ""
+
+async def session_chat_driver(user_message, _user_name, _session_id):
+    """chat_driver with the history kept server-side (CHAT_STORE), so the browser only sends the message."""
+    conversation = await conversations.get(_session_id)
+    try:
+        async with admit("chat", _user_name, _session_id):
+            async for out in chat_turn(user_message, None, _user_name, _session_id, conversation):
+                yield out
+    except Rejected as e:
+        gr.Warning(str(e))
+        yield conversation.display(), ""
 
 async def post_completion_code(_user_name, _session_id):
     code = "9C1F4B2E"
     msg = f"the completion code is {code}"
-    updated = [{"role": "assistant", "content": msg}]
+    if CHAT_STORE:
+        conversation = await conversations.get(_session_id)
+        conversation.add("assistant", msg)
+        updated = conversation.display()
+    else:
+        updated = [{"role": "assistant", "content": msg}]
 
     await log_event(_user_name, _session_id, "completion_code", {"code": code})
     return updated
@@ -152,10 +224,15 @@ with gr.Blocks(title="Movie Database", theme="soft") as demo:
                 def _clear_input():
                     return ""
 
-                ev = send_btn.click(chat_driver, [chat_input, chatbot, user_name, session_id], [chatbot, chat_input])
+                # with CHAT_STORE the chatbot's value stays in the browser: only the message goes up
+                if CHAT_STORE:
+                    driver, chat_inputs = session_chat_driver, [chat_input, user_name, session_id]
+                else:
+                    driver, chat_inputs = chat_driver, [chat_input, chatbot, user_name, session_id]
+                ev = send_btn.click(driver, chat_inputs, [chatbot, chat_input])
                 ev.then(_clear_input, None, [chat_input])
 
-                ev2 = chat_input.submit(chat_driver, [chat_input, chatbot, user_name, session_id], [chatbot, chat_input])
+                ev2 = chat_input.submit(driver, chat_inputs, [chatbot, chat_input])
                 ev2.then(_clear_input, None, [chat_input])
 
                 code_btn.click(
@@ -175,6 +252,12 @@ with gr.Blocks(title="Movie Database", theme="soft") as demo:
                     with gr.Row():
                         run_btn = gr.Button("Run", variant="primary")
                         clear_btn = gr.Button("Clear")
+                        prev_btn = gr.Button("◀ Prev page")
+                        next_btn = gr.Button("Next page ▶")
+                    # pagination tokens for the query currently shown in `results`
+                    shown_query = gr.State("")
+                    prev_token = gr.State(None)
+                    next_token = gr.State(None)
 
                     results = gr.Dataframe(
                         label="Results",
@@ -184,25 +267,39 @@ with gr.Blocks(title="Movie Database", theme="soft") as demo:
                     meta = gr.Markdown("")
                     plan = gr.Markdown("", label="Explain/Plan") 
 
-            async def on_run(q, _user_name, _session_id):
-                df, meta_msg, _ = await asyncio.to_thread(run_sql, q, max_rows, False)
+            async def on_run(q, _user_name, _session_id, page_token=None):
+                try:
+                    async with admit("sql", _user_name, _session_id):
+                        result, meta_msg, _, prev_tok, next_tok = await fetch_page_async(q, max_rows, page_token)
+                except Rejected as e:
+                    # leave the current results and paging state as they are
+                    return gr.update(), f"⚠️ {e}", gr.update(), gr.update(), gr.update(), gr.update()
 
                 await log_event(
                     _user_name, _session_id, "sql",
                     {
                         "query": q,
                         "row_limit": max_rows,
-                        "row_count": int(getattr(df, "shape", [0])[0]),
+                        "row_count": len(result),
                         "meta": meta_msg,
                     },
+                    metrics.current_trace_id() or metrics.new_trace_id(),
                 )
-                return df, meta_msg, ""
+                return result.to_df(), meta_msg, query_plan_markdown(q, max_rows), q, prev_tok, next_tok
+
+            async def on_page(q, token, _user_name, _session_id):
+                if not token:
+                    return gr.update(), gr.update(), gr.update(), q, gr.update(), gr.update()
+                return await on_run(q, _user_name, _session_id, token)
 
             def on_clear():
-                return "", pd.DataFrame(), "Cleared.", ""
+                return "", pd.DataFrame(), "Cleared.", "", "", None, None
 
-            run_btn.click(on_run, [sql_input, user_name, session_id], [results, meta, plan])
-            clear_btn.click(on_clear, inputs=None, outputs=[sql_input, results, meta, plan])
+            page_outputs = [results, meta, plan, shown_query, prev_token, next_token]
+            run_btn.click(on_run, [sql_input, user_name, session_id], page_outputs)
+            prev_btn.click(on_page, [shown_query, prev_token, user_name, session_id], page_outputs)
+            next_btn.click(on_page, [shown_query, next_token, user_name, session_id], page_outputs)
+            clear_btn.click(on_clear, inputs=None, outputs=[sql_input, results, meta, plan, shown_query, prev_token, next_token])
 
  
         
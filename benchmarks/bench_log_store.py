@@ -0,0 +1,100 @@
+"""
+Per-user JSONL files vs. log_store.SegmentedLogStore.
+
+    python benchmarks/bench_log_store.py [--events 200000] [--users 500]
+
+Writes the same synthetic events to both layouts, then times two lookups:
+"all sql events in the last hour" and "all events for one session".
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import pathlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_store import SegmentedLogStore
+
+KINDS = ["login", "chat_user", "chat_assistant", "sql", "sql", "sql"]
+
+def make_events(n_events, n_users, hours=24, seed=7):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2025, 3, 1, 8, 0, 0)
+    sessions = {u: [f"{u}-s{i}" for i in range(3)] for u in range(n_users)}
+    events = []
+    for i in range(n_events):
+        u = rnd.randrange(n_users)
+        ts = start + datetime.timedelta(seconds=hours * 3600 * i / n_events)
+        events.append({
+            "ts": ts.replace(microsecond=0).isoformat() + "Z",
+            "user": f"student{u}",
+            "session_id": rnd.choice(sessions[u]),
+            "kind": rnd.choice(KINDS),
+            "query": "SELECT genre, COUNT(*) FROM sales GROUP BY genre",
+        })
+    return events
+
+def write_jsonl(root, events):
+    files = {}
+    for e in events:
+        files.setdefault(e["user"], []).append(json.dumps(e))
+    for user, lines in files.items():
+        with open(root / f"{user}.jsonl", "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+def scan_jsonl(root, pred):
+    out = []
+    for path in root.glob("*.jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line)
+                if pred(rec):
+                    out.append(rec)
+    return out
+
+def timed(fn):
+    t0 = time.perf_counter()
+    res = fn()
+    return time.perf_counter() - t0, res
+
+def run(n_events=200_000, n_users=500, compress=False):
+    events = make_events(n_events, n_users)
+    last = datetime.datetime.fromisoformat(events[-1]["ts"].rstrip("Z"))
+    since = (last - datetime.timedelta(hours=1)).isoformat() + "Z"
+    session = events[len(events) // 2]["session_id"]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        (tmp / "jsonl").mkdir()
+        t_write_jsonl, _ = timed(lambda: write_jsonl(tmp / "jsonl", events))
+        store = SegmentedLogStore(tmp / "store", compress=compress)
+        items = [(e, json.dumps(e)) for e in events]
+        t_write_store, _ = timed(lambda: [store.write_batch(items[i:i + 256]) for i in range(0, len(items), 256)])
+        if compress:
+            store.seal()
+
+        res = {"events": n_events, "users": n_users,
+               "write_jsonl_s": t_write_jsonl, "write_store_s": t_write_store}
+        t, a = timed(lambda: scan_jsonl(tmp / "jsonl", lambda r: r["kind"] == "sql" and r["ts"] >= since))
+        t2, b = timed(lambda: list(store.query(kind="sql", since=since)))
+        assert len(a) == len(b)
+        res.update(last_hour_sql_jsonl_s=t, last_hour_sql_store_s=t2, last_hour_sql_n=len(b))
+        t, a = timed(lambda: scan_jsonl(tmp / "jsonl", lambda r: r["session_id"] == session))
+        t2, b = timed(lambda: list(store.query(session_id=session)))
+        assert len(a) == len(b)
+        res.update(session_jsonl_s=t, session_store_s=t2, session_n=len(b))
+        store.close()
+    return res
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=200_000)
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--compress", action="store_true")
+    args = ap.parse_args()
+    for k, v in run(args.events, args.users, args.compress).items():
+        print(f"{k}: {v:.4f}" if isinstance(v, float) else f"{k}: {v}")
@@ -0,0 +1,74 @@
+"""
+Prepared-statement reuse vs. plain SQL on the async execution path.
+
+    python benchmarks/bench_plan_cache.py [--n 2000] [--concurrency 8] [--rounds 3]
+
+Runs a mix of student-style queries with varying literals with plan_cache
+disabled and enabled (alternating rounds, best round kept), with the result cache off so every
+call reaches Postgres. Reports queries/s, mean latency and the plan-cache
+stats. Needs the usual PG* environment.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sql_tab
+from plan_cache import PlanCache
+
+QUERIES = [
+    lambda r: f"SELECT title, runtime FROM sales WHERE runtime > {r.randint(90, 180)} ORDER BY runtime DESC",
+    lambda r: f"SELECT genre, COUNT(*) AS n FROM sales WHERE genre = '{r.choice(['Drama', 'Comedy', 'Action'])}' GROUP BY genre",
+    lambda r: f"SELECT s.title, m.studio FROM sales s JOIN metadata m ON s.title = m.title WHERE s.title LIKE '{r.choice('ABCDEFGHST')}%' LIMIT 50",
+    lambda r: f"SELECT AVG(metascore) FROM metadata WHERE metascore >= {r.randint(10, 90)}",
+]
+
+
+async def run(n, concurrency, seed=7):
+    rnd = random.Random(seed)
+    queries = [rnd.choice(QUERIES)(rnd) for _ in range(n)]
+    sem = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one(q):
+        nonlocal errors
+        async with sem:
+            _, meta, _ = await sql_tab.execute_async(q, 200, False)
+            errors += meta.startswith("Error")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in queries))
+    took = time.perf_counter() - started
+    return {"qps": n / took, "mean_ms": 1000 * took * concurrency / n, "errors": errors}
+
+
+async def main(args):
+    sql_tab.CACHE_ENABLED = False
+    best = {}
+    # alternate the two modes and keep each one's best round, to damp noise
+    for _ in range(args.rounds):
+        for label, enabled in (("plain", False), ("prepared", True)):
+            sql_tab.plan_cache = PlanCache(enabled=enabled)
+            await sql_tab.close_async_pool()  # fresh connections, nothing prepared yet
+            await run(min(200, args.n), args.concurrency, seed=1)  # warm-up
+            row = await run(args.n, args.concurrency)
+            row["plan_cache"] = sql_tab.plan_cache_stats()
+            if label not in best or row["qps"] > best[label]["qps"]:
+                best[label] = row
+    await sql_tab.close_async_pool()
+    for label, row in best.items():
+        stats = row.pop("plan_cache")
+        print(f"{label}: " + " | ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items())
+              + f" | hit_rate={stats['hit_rate']:.2f} prepares={stats['prepares']} failures={stats['failures']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rounds", type=int, default=3)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,114 @@
+"""
+Micro-benchmark: per-query classification cost.
+
+    python benchmarks/bench_sql_analysis.py [--repeat 5]
+
+"legacy" is the regex checks the previous sql_tab.execute ran for one
+query (is_write_query three times, enforce_limit, normalize_sql twice,
+referenced_tables); "cold" is one sql_analysis._analyze pass plus
+with_limit; "memo" is the same through analyze() on text it has seen.
+Times are microseconds per query over a mix of student-style statements.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sql_analysis
+
+QUERIES = [
+    "SELECT * FROM sales",
+    "SELECT title, runtime FROM sales WHERE runtime > 150 ORDER BY runtime DESC LIMIT 20;",
+    "SELECT genre, COUNT(*) AS n FROM sales WHERE genre = 'Drama' GROUP BY genre",
+    "SELECT s.title, m.studio FROM sales s JOIN metadata m ON s.title = m.title WHERE s.title LIKE 'A%'",
+    "WITH top AS (SELECT title, metascore FROM metadata WHERE metascore >= 80)\n"
+    "SELECT t.title, s.runtime FROM top t, sales s WHERE t.title = s.title ORDER BY 2 DESC",
+    "SELECT EXTRACT(year FROM release_date) AS y, AVG(metascore) FROM metadata GROUP BY 1 -- per year",
+    "SELECT title FROM sales WHERE title = 'It''s; complicated' /* not a second statement */",
+    "INSERT INTO sales (title, genre, runtime) VALUES ('New', 'Drama', 120)",
+    "UPDATE metadata SET metascore = metascore + 1 WHERE title = 'X'",
+    "SELECT * FROM (SELECT title FROM sales ORDER BY runtime DESC LIMIT 10) t",
+]
+
+_quoted_re = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_ws_re = re.compile(r"\s+")
+_tables_re = re.compile(
+    r"\b(?:FROM|JOIN|INTO|UPDATE|TABLE|TRUNCATE)\s+(?:ONLY\s+)?(?:IF\s+(?:NOT\s+)?EXISTS\s+)?"
+    r"((?:\"[^\"]+\"|[A-Za-z_][\w$]*)(?:\.(?:\"[^\"]+\"|[A-Za-z_][\w$]*))?)",
+    flags=re.IGNORECASE,
+)
+
+
+def legacy_is_write(sql):
+    first_stmt = re.split(r";\s*", sql.strip(), maxsplit=1)[0]
+    if re.match(r"^\s*WITH\b", first_stmt, flags=re.IGNORECASE):
+        return bool(re.search(r"\)\s*(INSERT|UPDATE|DELETE|MERGE)\b", first_stmt, flags=re.IGNORECASE))
+    m = re.match(r"^\s*([A-Za-z]+)", first_stmt)
+    return (m.group(1).upper() if m else "") in sql_analysis.WRITE_FIRST_KEYWORDS
+
+
+def legacy_enforce_limit(sql, limit):
+    first = sql.strip().strip(";")
+    if re.match(r"^(SELECT|WITH)\b", first, flags=re.IGNORECASE) and not re.search(r"\bLIMIT\b", first, flags=re.IGNORECASE):
+        return f"{first} LIMIT {int(limit)}"
+    return first
+
+
+def legacy_normalize(sql):
+    parts = _quoted_re.split(sql.strip().rstrip(";").strip())
+    return "".join(p if i % 2 else _ws_re.sub(" ", p).lower() for i, p in enumerate(parts)).strip()
+
+
+def legacy_tables(sql):
+    text = _quoted_re.sub(lambda m: m.group(0) if m.group(0).startswith('"') else "''", sql)
+    return {m.group(1).lower() for m in _tables_re.finditer(text)}
+
+
+def legacy(sql, limit=100):
+    # the calls the old sql_tab.execute made for one query (cache miss)
+    if ";" in sql.strip().rstrip(";") or legacy_is_write(sql):   # _check_query
+        return
+    sql_to_run = legacy_enforce_limit(sql, limit)
+    legacy_is_write(sql)                                         # _from_cache
+    legacy_normalize(sql_to_run)
+    legacy_is_write(sql)                                         # _after_run
+    return legacy_normalize(sql_to_run), legacy_tables(sql)
+
+
+def analyzed(sql, limit=100):
+    pq = sql_analysis._analyze(sql)
+    return pq.statement_count, pq.is_write, pq.with_limit(limit), pq.normalized, pq.tables
+
+
+def memo(sql, limit=100):
+    pq = sql_analysis.analyze(sql)
+    return pq.statement_count, pq.is_write, pq.with_limit(limit), pq.normalized, pq.tables
+
+
+def timeit(fn, repeat, loops=2000):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            for q in QUERIES:
+                fn(q)
+        best = min(best, time.perf_counter() - t0)
+    return best / (loops * len(QUERIES)) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    for q in QUERIES:
+        memo(q)  # warm the memo
+    for name, fn in (("legacy", legacy), ("cold", analyzed), ("memo", memo)):
+        print(f"{name:>6}: {timeit(fn, args.repeat):7.2f} us/query")
+    print(f"memo: {sql_analysis.analyze.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
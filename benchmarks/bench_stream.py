@@ -0,0 +1,97 @@
+"""
+Per-turn server CPU of the streaming chat path, against the local mock LLM.
+
+    python benchmarks/bench_stream.py [--tokens 2000] [--turns 0 20 100] [--tps 400]
+
+"legacy" is the previous pipeline: respond re-joined the whole answer on every
+delta and chat_driver copied the full history for every chunk. "coalesced" is
+app.chat_driver as it is now. Each yielded value is serialized once with
+json.dumps, roughly what Gradio does per update, and CPU time is measured
+with time.process_time (the mock's pacing sleeps don't count). Both
+columns include the in-process mock and the SDK's SSE parsing, which cost
+the same either way.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tokens", type=int, default=2000)
+    ap.add_argument("--turns", type=int, nargs="*", default=[0, 20, 100])
+    ap.add_argument("--tps", type=float, default=400, help="mock tokens/second")
+    ap.add_argument("--repeat", type=int, default=3)
+    return ap.parse_args()
+
+
+def make_history(turns, words_per_turn=80):
+    msgs = []
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "assistant"
+        body = " ".join(f"word{(i * 7 + j) % 997}" for j in range(words_per_turn))
+        msgs.append({"role": role, "content": f"turn {i}: {body}"})
+    return msgs
+
+
+def legacy_chat_driver(app):
+    from chat_helpers import build_input_from_history, get_db_sys_prompt
+
+    async def respond(message, history):
+        kwargs = dict(model="gpt-4.1", input=build_input_from_history(message, history), temperature=0,
+                      instructions=get_db_sys_prompt(), tools=[{"type": "web_search"}],
+                      tool_choice="auto", parallel_tool_calls=True)
+        buffer = []
+        async with app.get_client().responses.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    buffer.append(event.delta)
+                    yield "".join(buffer)
+
+    async def chat_driver(user_message, messages_history, _user_name, _session_id):
+        messages_history = messages_history or []
+        base = messages_history + [{"role": "user", "content": user_message}]
+        async for chunk in respond(user_message, messages_history):
+            yield base + [{"role": "assistant", "content": chunk}], ""
+
+    return chat_driver
+
+
+async def one_turn(driver, history):
+    updates = sent = 0
+    cpu = time.process_time()
+    async for value, _ in driver("top grossing genre?", list(history), "bench", "bench"):
+        sent += len(json.dumps(value))
+        updates += 1
+    return time.process_time() - cpu, updates, sent
+
+
+async def run(args):
+    import app
+    drivers = {"legacy": legacy_chat_driver(app), "coalesced": app.chat_driver}
+    rows = []
+    for turns in args.turns:
+        history = make_history(turns)
+        row = {"turns": turns}
+        for name, driver in drivers.items():
+            await one_turn(driver, history)  # warm-up
+            best = min([await one_turn(driver, history) for _ in range(args.repeat)])
+            row[f"{name}_cpu_s"], row[f"{name}_updates"], row[f"{name}_bytes"] = best
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ.update(MOCK_OPENAI="1", MOCK_OPENAI_TTFT="0", MOCK_OPENAI_TPS=str(args.tps),
+                      MOCK_OPENAI_TOKENS=str(args.tokens), MOCK_OPENAI_ERROR_RATE="0",
+                      LLM_CACHE="0")
+    os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="bench_stream_"))
+    for row in asyncio.run(run(args)):
+        print(" | ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
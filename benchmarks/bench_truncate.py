@@ -0,0 +1,62 @@
+"""
+Micro-benchmark: history truncation at 10/100/1000 turns.
+
+    python benchmarks/bench_truncate.py [--repeat 5]
+
+"legacy" is the previous implementation (re-encode every message on every
+loop pass, pop(1) per dropped turn); "linear" is chat_helpers.truncate_history.
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import chat_helpers as ch
+
+
+def legacy_truncate(messages, max_tokens=ch.MAX_TOKENS, model="gpt-4.1"):
+    enc = ch.get_encoding(model)
+    def count(msgs):
+        return sum(len(enc.encode(m["content"])) for m in msgs)
+    while count(messages) > max_tokens and len(messages) > 2:
+        messages.pop(1)
+    return messages
+
+def make_history(turns: int, words_per_turn: int = 120):
+    msgs = [{"role": "system", "content": ch.get_db_sys_prompt()}]
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "assistant"
+        body = " ".join(f"word{(i * 7 + j) % 997}" for j in range(words_per_turn))
+        msgs.append({"role": role, "content": f"turn {i}: {body}"})
+    return msgs
+
+def timeit(fn, history, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        msgs = copy.copy(history)
+        t0 = time.perf_counter()
+        fn(msgs)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def run(turn_counts=(10, 100, 1000), repeat=5, policies=("drop_oldest", "pairs", "summarize")):
+    results = []
+    for turns in turn_counts:
+        history = make_history(turns)
+        row = {"turns": turns, "legacy_s": timeit(legacy_truncate, history, repeat)}
+        for policy in policies:
+            # first call warms the token cache, like a long-running session would
+            row[f"{policy}_s"] = timeit(lambda m: ch.truncate_history(m, policy=policy), history, repeat)
+        results.append(row)
+    return results
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--turns", type=int, nargs="*", default=[10, 100, 1000])
+    args = ap.parse_args()
+    for row in run(args.turns, args.repeat):
+        print(" | ".join(f"{k}={v:.6f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
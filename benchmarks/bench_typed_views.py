@@ -0,0 +1,92 @@
+"""
+Query latency before and after db_bootstrap's views and indexes.
+
+    python benchmarks/bench_typed_views.py [--repeat 30]
+
+"before" drops everything db_bootstrap creates, "after" builds it; the
+database is left as it was found. Each query runs the way /e2e/sql runs it
+(row cap 200) on one connection, and the median is reported.
+  - SIMPLE_SQL (read from locustfile.py) is timed unchanged both times, so
+    it only gains from the base-table indexes;
+  - REVENUE pairs are the usual cast-and-clean student query on the raw
+    tables ("before") and the same question asked of the views ("after").
+Needs the usual PG* environment and write access to the schema.
+"""
+import argparse
+import ast
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import db_bootstrap
+from sql_analysis import analyze
+
+_NUM = "'^[0-9]+$'"
+REVENUE = [
+    ("top genres by revenue",
+     f"SELECT genre, SUM(CASE WHEN worldwide_box_office ~ {_NUM} THEN worldwide_box_office::bigint END) AS revenue "
+     "FROM sales GROUP BY genre ORDER BY revenue DESC NULLS LAST LIMIT 5",
+     "SELECT genre, total_worldwide AS revenue FROM genre_revenue ORDER BY revenue DESC NULLS LAST LIMIT 5"),
+    ("top ROI",
+     "SELECT title, worldwide_box_office::numeric / NULLIF(production_budget::numeric, 0) AS roi FROM sales "
+     f"WHERE worldwide_box_office ~ {_NUM} AND production_budget ~ {_NUM} ORDER BY roi DESC LIMIT 10",
+     "SELECT title, roi FROM sales_typed ORDER BY roi DESC NULLS LAST LIMIT 10"),
+    ("avg runtime by studio",
+     "SELECT studio, AVG(runtime) AS avg_runtime FROM metadata GROUP BY studio ORDER BY avg_runtime DESC",
+     "SELECT studio, avg_runtime FROM studio_stats ORDER BY avg_runtime DESC"),
+    ("userscore for one title",
+     "SELECT s.title, CASE WHEN m.userscore ~ '^[0-9.]+$' THEN m.userscore::real END AS userscore "
+     "FROM sales s JOIN metadata m ON s.title = m.title WHERE s.title = 'Movie 42'",
+     "SELECT title, userscore FROM metadata_typed WHERE title = 'Movie 42'"),
+]
+
+
+def simple_sql():
+    tree = ast.parse(open(os.path.join(ROOT, "locustfile.py")).read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SIMPLE_SQL" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise RuntimeError("SIMPLE_SQL not found in locustfile.py")
+
+
+def median_ms(conn, sql, repeat):
+    sql = analyze(sql).with_limit(200)
+    conn.execute(sql).fetchall()  # warm
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        conn.execute(sql).fetchall()
+        times.append(time.perf_counter() - t0)
+    return 1000 * statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=30)
+    args = ap.parse_args()
+    quiet = lambda *a: None
+    simple = simple_sql()
+
+    with db_bootstrap.connect() as conn:
+        had_views = any(rows is not None for _, rows, _ in db_bootstrap.status(conn))
+        db_bootstrap.drop(conn, quiet)
+        before = [median_ms(conn, q, args.repeat) for q in simple]
+        before += [median_ms(conn, raw, args.repeat) for _, raw, _ in REVENUE]
+        db_bootstrap.build(conn, log=quiet)
+        after = [median_ms(conn, q, args.repeat) for q in simple]
+        after += [median_ms(conn, typed, args.repeat) for _, _, typed in REVENUE]
+        if not had_views:
+            db_bootstrap.drop(conn, quiet)
+
+    labels = [f"SIMPLE_SQL[{i}]" for i in range(len(simple))] + [name for name, _, _ in REVENUE]
+    for label, b, a in zip(labels, before, after):
+        print(f"{label:>24}: before={b:7.2f}ms after={a:7.2f}ms speedup={b / a if a else 0:5.1f}x")
+    print(f"{'total':>24}: before={sum(before):7.2f}ms after={sum(after):7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Throughput scaling with the number of server worker processes.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --users 200 --duration 60s
+
+For each worker count it starts `python server.py` with SERVER_WORKERS=n
+against the in-process mock LLM (MOCK_OPENAI=1), runs the locustfile's
+ScalingUser headless, and prints requests/s, p50/p95 and the speedup over
+the first row. Per-user rate limits are off (ADMIT_*_RATE=0) and the LLM
+and SQL result caches are disabled, so every chat request streams and
+every query reaches Postgres. PG_CONN_BUDGET stays fixed across runs, so
+more workers means smaller pools per worker.
+"""
+import argparse
+import csv
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def wait_ready(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as r:
+                if r.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"server not ready after {timeout}s: {url}")
+
+
+def aggregated(stats_csv):
+    with open(stats_csv, newline="") as f:
+        for row in csv.DictReader(f):
+            if row["Name"] == "Aggregated":
+                return row
+    raise RuntimeError(f"no Aggregated row in {stats_csv}")
+
+
+def run_one(workers, args, out_dir):
+    env = dict(os.environ, SERVER_WORKERS=str(workers), SERVER_PORT=str(args.port),
+               PG_CONN_BUDGET=str(args.conn_budget), MOCK_OPENAI="1", LLM_CACHE="0", SQL_CACHE="0",
+               ADMIT_CHAT_RATE="0", ADMIT_SQL_RATE="0")
+    host = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, "server.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)
+    try:
+        wait_ready(host + "/healthz")
+        time.sleep(args.settle)  # /healthz answers once the first worker is up, not all of them
+        prefix = os.path.join(out_dir, f"w{workers}")
+        subprocess.run(
+            ["locust", "-f", "locustfile.py", "--headless", "-u", str(args.users),
+             "-r", str(args.spawn_rate), "-t", args.duration, "--host", host,
+             "--csv", prefix, "--only-summary", "ScalingUser"],
+            cwd=ROOT, check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        return aggregated(prefix + "_stats.csv")
+    finally:
+        os.killpg(server.pid, signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(server.pid, signal.SIGKILL)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4])
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--spawn-rate", type=int, default=50)
+    ap.add_argument("--duration", default="60s")
+    ap.add_argument("--port", type=int, default=7861)
+    ap.add_argument("--conn-budget", type=int, default=40)
+    ap.add_argument("--settle", type=float, default=10.0, help="seconds to wait for the other workers")
+    args = ap.parse_args()
+
+    out_dir = tempfile.mkdtemp(prefix="bench_workers_")
+    base = None
+    for n in args.workers:
+        row = run_one(n, args, out_dir)
+        rps = float(row["Requests/s"])
+        base = base or rps
+        print(f"workers={n} | rps={rps:.1f} | speedup={rps / base if base else 0:.2f}x"
+              f" | p50_ms={row['50%']} | p95_ms={row['95%']}"
+              f" | requests={row['Request Count']} | failures={row['Failure Count']}")
+    print(f"locust CSVs in {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
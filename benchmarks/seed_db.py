@@ -0,0 +1,160 @@
+"""
+Synthetic course database for the benchmarks: the four tables from
+DB_SYS_PROMPT.txt, filled with deterministic rows of the same shape (text
+money columns with 'n/a' and 'null' mixed in, urls shared between the
+tables, ~95 double precision columns per review).
+
+    python benchmarks/seed_db.py [--movies 3000] [--user-reviews 5] [--expert-reviews 2] [--reset]
+
+Tables that are missing are created; empty ones are filled; tables that
+already have rows are left alone unless --reset, which drops and recreates
+all four (CASCADE: rerun `db_bootstrap.py build` afterwards if you use its
+views). Needs the usual PG* environment (or the DB_* variables sql_tab reads).
+rows() is also what suite.py builds its offline frames from.
+"""
+import argparse
+import datetime
+import os
+import random
+import re
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+TABLES = ("sales", "metadata", "user_reviews", "expert_reviews")
+GENRES = ["Drama", "Comedy", "Action", "Adventure", "Horror", "Thriller", "Romantic Comedy", "Documentary", "Musical"]
+CREATIVE = ["Contemporary Fiction", "Fantasy", "Science Fiction", "Historical Fiction", "Kids Fiction", "Factual"]
+RATINGS = ["G", "PG", "PG-13", "R", "Not Rated", None]
+WORDS = ("the of a night last man love city dark world return story house secret war king girl day "
+         "life road home star dead game time summer blue fire moon river").split()
+MISSING = ["n/a", "null", None]
+
+
+def schema() -> dict:
+    """{table: [(column, type), ...]} parsed from the CREATE TABLEs in DB_SYS_PROMPT.txt."""
+    text = open(os.path.join(ROOT, "DB_SYS_PROMPT.txt"), encoding="utf-8").read()
+    out = {}
+    for table, body in re.findall(r"CREATE TABLE public\.(\w+)\s*\((.*?)\);", text, flags=re.S):
+        cols = []
+        for line in body.splitlines():
+            m = re.match(r"\s*(\w+)\s+([a-z][a-z ]*?)\s*,?\s*$", line)
+            if m:
+                cols.append((m.group(1).lower(), m.group(2)))
+        out[table] = cols
+    return out
+
+
+def _money(rnd, lo, hi):
+    return str(rnd.randint(lo, hi)) if rnd.random() < 0.8 else rnd.choice(MISSING)
+
+
+def _words(rnd, n):
+    return " ".join(rnd.choice(WORDS) for _ in range(n))
+
+
+def _date(rnd):
+    return datetime.date(1990, 1, 1) + datetime.timedelta(days=rnd.randint(0, 34 * 365))
+
+
+# (table, column) -> fn(rnd, movie index); everything else is generated from the column type
+_COLUMNS = {
+    ("sales", "year"): lambda r, i: 1990 + i % 35,
+    ("sales", "release_date"): lambda r, i: _date(r).isoformat(),
+    ("sales", "international_box_office"): lambda r, i: _money(r, 0, 2_000_000_000),
+    ("sales", "domestic_box_office"): lambda r, i: _money(r, 0, 900_000_000),
+    ("sales", "worldwide_box_office"): lambda r, i: _money(r, 10_000, 2_800_000_000),
+    ("sales", "production_budget"): lambda r, i: _money(r, 100_000, 350_000_000),
+    ("sales", "opening_weekend"): lambda r, i: _money(r, 1_000, 350_000_000),
+    ("sales", "theatre_count"): lambda r, i: r.randint(1, 4500),
+    ("sales", "avg_run_per_theatre"): lambda r, i: f"{r.uniform(1, 20):.1f}" if r.random() < 0.7 else r.choice(MISSING),
+    ("sales", "keywords"): lambda r, i: ", ".join(r.sample(WORDS, 3)),
+    ("sales", "creative_type"): lambda r, i: r.choice(CREATIVE),
+    ("metadata", "studio"): lambda r, i: f"Studio {r.randint(0, 60)}",
+    ("metadata", "rating"): lambda r, i: r.choice(RATINGS),
+    ("metadata", "casting"): lambda r, i: ", ".join(f"Actor {r.randint(0, 4000)}" for _ in range(4)),
+    ("metadata", "director"): lambda r, i: f"Director {r.randint(0, 900)}",
+    ("metadata", "summary"): lambda r, i: _words(r, 40).capitalize() + ".",
+    ("metadata", "awards"): lambda r, i: f"{r.randint(1, 12)} wins" if r.random() < 0.3 else None,
+    ("metadata", "metascore"): lambda r, i: r.randint(10, 100),
+    ("metadata", "userscore"): lambda r, i: f"{r.uniform(1, 10):.1f}" if r.random() < 0.85 else "tbd",
+    ("metadata", "reldate"): lambda r, i: _date(r).strftime("%b %d, %Y"),
+}
+
+
+def _value(rnd, table, column, typ, i):
+    fn = _COLUMNS.get((table, column))
+    if fn is not None:
+        return fn(rnd, i)
+    if column == "url":
+        return f"/m/{i}"
+    if column == "title":
+        return f"Movie {i}"
+    if column == "genre":
+        return GENRES[i % len(GENRES)]
+    if column == "runtime":
+        return rnd.randint(75, 190)
+    if column == "reviewer":
+        return f"{'critic' if table == 'expert_reviews' else 'user'}{rnd.randint(0, 20000)}"
+    if column == "idvscore":
+        return rnd.randint(0, 100) if table == "expert_reviews" else rnd.randint(0, 10)
+    if typ == "double precision":
+        return round(rnd.random() * 100, 2)
+    if typ in ("integer", "smallint"):
+        return rnd.randint(0, 5000 if typ == "integer" else 100)
+    if typ == "date":
+        return _date(rnd)
+    return _words(rnd, 3)
+
+
+def rows(table: str, n_movies: int, per_movie: int = 1, seed: int = 7):
+    """Yields tuples for `table` in schema() column order: one per movie, or per_movie for the review tables."""
+    cols = schema()[table]
+    rnd = random.Random(f"{seed}:{table}")
+    count = n_movies if table in ("sales", "metadata") else n_movies * per_movie
+    for k in range(count):
+        i = k if table in ("sales", "metadata") else rnd.randrange(n_movies)
+        yield tuple(_value(rnd, table, c, t, i) for c, t in cols)
+
+
+def connect():
+    import psycopg
+    from sql_tab import DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_PORT
+    return psycopg.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+                           host=DB_HOST, port=DB_PORT, autocommit=True)
+
+
+def seed(conn, n_movies=3000, user_reviews=5, expert_reviews=2, reset=False, log=print):
+    per_movie = {"user_reviews": user_reviews, "expert_reviews": expert_reviews}
+    tables = schema()
+    for table in TABLES:
+        cols = tables[table]
+        if reset:
+            conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{c} {t}' for c, t in cols)})")
+        if conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]:
+            log(f"{table}: has rows, left alone (--reset to replace)")
+            continue
+        n = 0
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY {table} ({', '.join(c for c, _ in cols)}) FROM STDIN") as copy:
+                for row in rows(table, n_movies, per_movie.get(table, 1)):
+                    copy.write_row(row)
+                    n += 1
+        conn.execute(f"ANALYZE {table}")
+        log(f"{table}: {n} rows")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--movies", type=int, default=3000)
+    ap.add_argument("--user-reviews", type=int, default=5, help="per movie")
+    ap.add_argument("--expert-reviews", type=int, default=2, help="per movie")
+    ap.add_argument("--reset", action="store_true", help="drop and recreate the four tables")
+    args = ap.parse_args()
+    with connect() as conn:
+        seed(conn, args.movies, args.user_reviews, args.expert_reviews, args.reset)
+
+
+if __name__ == "__main__":
+    main()
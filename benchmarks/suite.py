@@ -0,0 +1,267 @@
+"""
+Offline benchmark suite for the hot paths, with a stored baseline.
+
+    python benchmarks/seed_db.py                     # once, for the run_sql cases
+    python benchmarks/suite.py --save-baseline       # before a change
+    python benchmarks/suite.py --compare             # after it; exit 1 on regressions
+    python benchmarks/suite.py --only prompt --no-db
+
+Cases (microseconds per operation, median of --rounds timed rounds):
+  run_sql/...          sql_tab.run_sql end to end (psycopg2 pool, pandas),
+                       result cache off; skipped when Postgres is unreachable
+  df_json_safe/...     server.df_json_safe on a user_reviews-shaped frame
+  rows_to_records/...  sql_json.rows_to_records, the /e2e/sql equivalent
+  prompt/...           build_input_from_history and truncate_history
+  log_event/...        log_event throughput into a temp dir, flush included
+
+Frames and histories come from seed_db.rows() and fixed text, so every run
+sees the same data. Results go to benchmarks/results/latest.json;
+--save-baseline also writes the baseline, and --compare flags cases whose
+median moved by more than --threshold (default 15%). Timings only compare
+on the same machine, so the baseline is not checked in: save one on yours.
+No OpenAI or running server needed.
+"""
+import argparse
+import asyncio
+import fnmatch
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+# uncached numbers, and logs away from ./user_data; set before the app modules read them
+os.environ["SQL_CACHE"] = "0"
+os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="bench_suite_"))
+
+import seed_db
+
+RESULTS_DIR = os.path.join(HERE, "results")
+LATEST = os.path.join(RESULTS_DIR, "latest.json")
+BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+
+# Postgres type OIDs for the seed_db column types
+_OIDS = {"text": 25, "integer": 23, "smallint": 21, "double precision": 701, "date": 1082}
+
+CASES = []  # (name, needs_db, factory); factory() -> (fn, operations per call)
+
+
+def case(name, needs_db=False):
+    def register(factory):
+        CASES.append((name, needs_db, factory))
+        return factory
+    return register
+
+
+class Skip(Exception):
+    pass
+
+
+def review_rows(n=200):
+    cols = seed_db.schema()["user_reviews"]
+    return [c for c, _ in cols], [_OIDS[t] for _, t in cols], list(itertools.islice(seed_db.rows("user_reviews", 3000), n))
+
+
+def history(turns):
+    out = []
+    for i in range(turns):
+        out.append({"role": "user", "content": f"Question {i}: which genre had the highest worldwide box office in {1990 + i % 35}? " * 3})
+        out.append({"role": "assistant", "content": f"SELECT genre, SUM(worldwide_box_office::bigint) FROM sales WHERE year = {1990 + i % 35} "
+                                                     "GROUP BY genre ORDER BY 2 DESC LIMIT 1; Drama, by a wide margin. " * 4})
+    return out
+
+
+# --- SQL, end to end ---
+
+def _run_sql_case(sql, max_rows):
+    def factory():
+        import sql_tab
+        try:
+            sql_tab._return_conn(sql_tab._borrow_conn())
+        except Exception as e:
+            raise Skip(f"no database ({type(e).__name__})")
+        _, meta, _ = sql_tab.run_sql(sql, max_rows, False)
+        if meta.startswith("Error"):
+            raise Skip(meta)
+        return (lambda: sql_tab.run_sql(sql, max_rows, False)), 1
+    return factory
+
+for _n in (10, 200, 2000):
+    case(f"run_sql/sales/{_n}", needs_db=True)(_run_sql_case("SELECT * FROM sales", _n))
+case("run_sql/user_reviews/200", needs_db=True)(_run_sql_case("SELECT * FROM user_reviews", 200))
+
+
+# --- serialization ---
+
+@case("df_json_safe/user_reviews/200x99")
+def _df_json_safe():
+    try:
+        from server import df_json_safe
+    except Exception as e:
+        raise Skip(f"server.py doesn't import here ({type(e).__name__}: {e})")
+    from sql_tab import QueryResult
+    cols, oids, rows = review_rows()
+    df = QueryResult(cols, oids, rows).to_df()
+    return (lambda: df_json_safe(df)), 1
+
+@case("rows_to_records/user_reviews/200x99")
+def _rows_to_records():
+    from sql_json import rows_to_records
+    cols, oids, rows = review_rows()
+    return (lambda: rows_to_records(cols, oids, rows)), 1
+
+
+# --- prompt ---
+
+def _build_case(turns):
+    def factory():
+        from chat_helpers import build_input_from_history
+        h = history(turns)
+        return (lambda: build_input_from_history("And the lowest?", h)), 1
+    return factory
+
+for _n in (20, 200):
+    case(f"prompt/build_input_from_history/{_n}turns")(_build_case(_n))
+
+@case("prompt/truncate_history/1000turns")
+def _truncate():
+    import chat_helpers as ch
+    msgs = [{"role": "system", "content": ch.get_db_sys_prompt()}] + history(1000)
+    return (lambda: ch.truncate_history(list(msgs), ch.MAX_TOKENS)), 1
+
+
+# --- logging ---
+
+@case("log_event/jsonl/2000")
+def _log_event():
+    import logger
+    n = 2000
+
+    async def burst():
+        await logger.start_log_writer()
+        for i in range(n):
+            await logger.log_event(f"user{i % 50}", f"s{i % 50}", "sql",
+                                   {"query": "SELECT * FROM sales", "row_limit": 200, "row_count": i, "meta": "Rows: 200"})
+        await logger.stop_log_writer()
+
+    return (lambda: asyncio.run(burst())), n
+
+
+# --- runner ---
+
+def measure(fn, ops, rounds, min_round=0.1):
+    """Median and min microseconds per operation; loops per round are sized to take >= min_round seconds."""
+    fn()  # warm
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        took = time.perf_counter() - t0
+        if took >= min_round or loops >= 1 << 20:
+            break
+        loops *= 2 if took * 4 >= min_round else 8
+    per_op = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_op.append((time.perf_counter() - t0) / (loops * ops) * 1e6)
+    return dict(median_us=statistics.median(per_op), min_us=min(per_op), loops=loops, rounds=rounds)
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(patterns, rounds, no_db, log=print):
+    results, skipped = {}, {}
+    for name, needs_db, factory in CASES:
+        if patterns and not any(fnmatch.fnmatch(name, p) or name.startswith(p) for p in patterns):
+            continue
+        if needs_db and no_db:
+            skipped[name] = "--no-db"
+            continue
+        try:
+            fn, ops = factory()
+        except Skip as e:
+            skipped[name] = str(e)
+            log(f"{name:48} skipped: {e}")
+            continue
+        results[name] = r = measure(fn, ops, rounds)
+        log(f"{name:48} {r['median_us']:12.1f} us  (min {r['min_us']:.1f})")
+    meta = dict(time=time.strftime("%Y-%m-%dT%H:%M:%S"), git=_git_rev(), python=platform.python_version(),
+                machine=platform.machine(), cpus=os.cpu_count(), rounds=rounds)
+    return dict(meta=meta, results=results, skipped=skipped)
+
+
+def compare(current, baseline, threshold):
+    """[(name, base_us, now_us, change)] for cases in both runs, and the names that regressed."""
+    rows, regressed = [], []
+    for name, r in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        change = r["median_us"] / base["median_us"] - 1
+        rows.append((name, base["median_us"], r["median_us"], change))
+        if change > threshold:
+            regressed.append(name)
+    return rows, regressed
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--only", nargs="*", default=[], help="case names, prefixes or globs")
+    ap.add_argument("--rounds", type=int, default=7)
+    ap.add_argument("--no-db", action="store_true", help="skip the cases that need Postgres")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--compare", action="store_true", help="compare with --baseline; exit 1 on regressions")
+    ap.add_argument("--threshold", type=float, default=0.15, help="relative slowdown that counts as a regression")
+    args = ap.parse_args()
+
+    current = run(args.only, args.rounds, args.no_db)
+    _write(LATEST, current)
+    if args.save_baseline:
+        _write(args.baseline, current)
+        print(f"baseline saved to {args.baseline}")
+    if not args.compare:
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline first", file=sys.stderr)
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows, regressed = compare(current, baseline, args.threshold)
+    print(f"\nvs baseline {baseline['meta'].get('git')} ({baseline['meta'].get('time')}), threshold {args.threshold:.0%}")
+    for name, base, now, change in rows:
+        flag = "REGRESSION" if name in regressed else ("faster" if change < -args.threshold else "")
+        print(f"{name:48} {base:12.1f} -> {now:12.1f} us  {change:+7.1%}  {flag}")
+    if regressed:
+        print(f"\n{len(regressed)} regression(s) beyond {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,24 @@
-import tiktoken
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import metrics
 
 MAX_TOKENS = 16000
+DB_SYS_PROMPT_PATH = os.getenv("DB_SYS_PROMPT_PATH", "DB_SYS_PROMPT.txt")
+# advertise the views built by db_bootstrap.py; only set once they exist
+DB_PROMPT_VIEWS = os.getenv("DB_PROMPT_VIEWS", "").lower() in {"1", "true", "yes"}
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "8192"))
+# "drop_oldest" (default), "pairs" or "summarize"; see truncate_history
+HISTORY_POLICY = os.getenv("HISTORY_POLICY", "drop_oldest")
+SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+# streamed answers reach the UI at most every STREAM_FLUSH_MS, or sooner
+# once STREAM_FLUSH_CHUNKS deltas are pending; see coalesce_deltas
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "50"))
+STREAM_FLUSH_CHUNKS = int(os.getenv("STREAM_FLUSH_CHUNKS", "32"))
 
 SQL_SYSTEM_PROMPT = (
     "You are a helpful assistant that answers questions about PostgreSQL databases. "
@@ -8,11 +26,80 @@ SQL_SYSTEM_PROMPT = (
     "Use markdowns to separate the code and the text in your output. "
 )
 
+
+class PromptRegistry:
+    """
+    Prompt files read once and kept in memory. The file's mtime is checked at
+    most every `check_interval` seconds, so edits are picked up without a restart.
+    """
+
+    def __init__(self, check_interval: float = 2.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> [text, mtime, last_checked]
+
+    def get(self, path: str) -> str:
+        now = time.monotonic()
+        entry = self._entries.get(path)
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[0]
+        with self._lock:
+            entry = self._entries.get(path)
+            mtime = os.stat(path).st_mtime_ns
+            if entry is None or entry[1] != mtime:
+                with open(path, "r") as f:
+                    entry = [f.read(), mtime, now]
+                self._entries[path] = entry
+            else:
+                entry[2] = now
+            return entry[0]
+
+
+prompts = PromptRegistry()
+
 def get_db_sys_prompt():
-    with open("DB_SYS_PROMPT.txt", "r") as f:
-        return f.read()
+    text = prompts.get(DB_SYS_PROMPT_PATH)
+    return _with_views(text) if DB_PROMPT_VIEWS else text
+
+@lru_cache(maxsize=4)
+def _with_views(text):
+    # keyed on the file text, so the combined string (and its token count) is built once per edit
+    from db_bootstrap import prompt_section
+    return text + "\n" + prompt_section()
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-4.1"):
+    import tiktoken  # imported and loaded on first use; server.py does it during warm-up
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+_token_cache: OrderedDict = OrderedDict()  # (model, text) -> n tokens
+_token_lock = threading.Lock()
+
+def text_tokens(text, model="gpt-4.1") -> int:
+    """Token count of one message body, memoized (LRU) so the system prompt and
+    earlier turns are only encoded once."""
+    key = (model, text)
+    with _token_lock:
+        n = _token_cache.get(key)
+        if n is not None:
+            _token_cache.move_to_end(key)
+            return n
+    n = len(get_encoding(model).encode(text))
+    with _token_lock:
+        _token_cache[key] = n
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return n
+
+def preload(model="gpt-4.1"):
+    """Loads the tokenizer's BPE tables and counts the system prompt, so the first chat turn pays neither."""
+    text_tokens(get_db_sys_prompt(), model)
 
 def build_input_from_history(message, history):
+    started = time.perf_counter()
     parts = []
     parts.append({"role": "system", "content": get_db_sys_prompt()})
     # prior turns
@@ -23,22 +110,160 @@ def build_input_from_history(message, history):
             parts.append({"role": "assistant", "content": msg["content"]})
     parts.append({"role": "user", "content": message})
 
+    truncating = time.perf_counter()
     parts = truncate_history(parts, MAX_TOKENS)
 
+    done = time.perf_counter()
+    metrics.observe("prompt_truncate_seconds", done - truncating)
+    metrics.observe("prompt_build_seconds", done - started, source="history")
     return parts
 
 def count_tokens(messages, model="gpt-4.1"):
     """Count tokens in a list of messages using tiktoken."""
+    return sum(text_tokens(msg["content"], model) for msg in messages)
+
+def _drop_until(counts, start, total, max_tokens, keep_last=1):
+    """Index of the first kept message after dropping counts[start:] oldest-first."""
+    i, last = start, len(counts) - keep_last
+    while total > max_tokens and i < last:
+        total -= counts[i]
+        i += 1
+    return i, total
+
+_summary_cache: OrderedDict = OrderedDict()  # tuple of dropped texts -> summary text
+
+def summarize_turns(turns, max_tokens=SUMMARY_MAX_TOKENS, model="gpt-4.1") -> str:
+    """
+    Compact, deterministic digest of dropped turns (one clipped line each, newest
+    kept first when over budget). No LLM call; memoized on the dropped contents.
+    """
+    key = (model, max_tokens, tuple((m["role"], m["content"]) for m in turns))
+    with _token_lock:
+        hit = _summary_cache.get(key)
+        if hit is not None:
+            _summary_cache.move_to_end(key)
+            return hit
+    header = "Summary of earlier conversation (older turns were dropped):"
+    lines, used = [], text_tokens(header, model)
+    for m in reversed(turns):
+        first = str(m["content"]).strip().splitlines()[0] if str(m["content"]).strip() else ""
+        line = f"- {m['role']}: {first[:120]}{'...' if len(first) > 120 else ''}"
+        n = text_tokens(line, model)
+        if used + n > max_tokens:
+            break
+        lines.append(line)
+        used += n
+    summary = "\n".join([header] + lines[::-1])
+    with _token_lock:
+        _summary_cache[key] = summary
+        if len(_summary_cache) > 256:
+            _summary_cache.popitem(last=False)
+    return summary
+
+def truncate_history(messages, max_tokens=MAX_TOKENS, model="gpt-4.1", policy=None):
+    """
+    Drops the oldest turns (never the system message at 0 or the newest
+    message) until the token total fits `max_tokens`. Each message is
+    tokenized once (and usually comes from the text_tokens cache), then
+    turns are dropped from a running total: O(n) instead of re-counting the
+    whole list per dropped turn. Edits `messages` in place and returns it.
+
+    policy:
+      - "drop_oldest": one message at a time (the original behaviour)
+      - "pairs": never leave an assistant reply whose question was dropped
+      - "summarize": like "pairs", plus a short cached summary of what was
+        dropped, inserted as a system message after the main prompt
+    """
+    policy = policy or HISTORY_POLICY
+    if len(messages) <= 2:
+        return messages
+    counts = [text_tokens(m["content"], model) for m in messages]
+    total = sum(counts)
+    if total <= max_tokens:
+        return messages
+
+    if policy == "summarize":
+        budget = max(0, max_tokens - SUMMARY_MAX_TOKENS)
+        cut, _ = _drop_until(counts, 1, total, budget)
+    else:
+        cut, _ = _drop_until(counts, 1, total, max_tokens)
+    if policy in ("pairs", "summarize"):
+        while cut < len(messages) - 1 and messages[cut]["role"] == "assistant":
+            cut += 1
+
+    dropped = messages[1:cut]
+    if policy == "summarize" and dropped:
+        messages[1:cut] = [{"role": "system", "content": summarize_turns(dropped, model=model)}]
+    else:
+        messages[1:cut] = []
+    return messages
+
+
+async def coalesce_deltas(items, interval=STREAM_FLUSH_MS / 1000, max_chunks=STREAM_FLUSH_CHUNKS):
+    """
+    Merges a stream of (replace, text) deltas (see llm_cache.fold) into fewer,
+    larger ones. The first delta goes out right away; after that pending text
+    is flushed once `interval` seconds have passed since the previous flush or
+    `max_chunks` deltas have piled up, whichever comes first. A stall upstream
+    still flushes on time.
+
+    `items` is drained by a helper task, so a slow consumer just gets bigger
+    chunks; waking the consumer costs one future per flush, not per delta.
+    """
+    loop = asyncio.get_running_loop()
+    pending, replace = [], False
+    done, error = False, None
+    next_flush = loop.time()
+    waiter = None
+
+    def wake():
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def pump():
+        nonlocal replace, done, error
+        try:
+            async for item_replace, text in items:
+                if item_replace:
+                    pending[:] = [text]
+                    replace = True
+                else:
+                    pending.append(text)
+                if len(pending) == 1 or len(pending) >= max_chunks or loop.time() >= next_flush:
+                    wake()
+        except BaseException as e:
+            error = e
+        finally:
+            done = True
+            wake()
+            aclose = getattr(items, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    task = loop.create_task(pump())
     try:
-        enc = tiktoken.encoding_for_model(model)
-    except KeyError:
-        enc = tiktoken.get_encoding("cl100k_base")
-    num_tokens = 0
-    for msg in messages:
-        num_tokens += len(enc.encode(msg["content"]))
-    return num_tokens
-
-def truncate_history(messages, max_tokens=MAX_TOKENS, model="gpt-4.1"):
-    while count_tokens(messages, model=model) > max_tokens and len(messages) > 2:
-        messages.pop(1)
-    return messages
\ No newline at end of file
+        while True:
+            if not done and (not pending or (len(pending) < max_chunks and loop.time() < next_flush)):
+                waiter = loop.create_future()
+                timer = loop.call_at(next_flush, wake) if pending else None
+                try:
+                    await waiter
+                finally:
+                    waiter = None
+                    if timer is not None:
+                        timer.cancel()
+                continue
+            if pending:
+                chunk, chunk_replace = "".join(pending), replace
+                pending.clear()
+                replace = False
+                next_flush = loop.time() + interval
+                yield chunk_replace, chunk
+                continue
+            break
+        if error is not None:
+            raise error
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.wait((task,))
@@ -0,0 +1,222 @@
+"""
+Server-side chat history, keyed by session_id (the one do_login hands out).
+
+With it a client sends only the new message: the conversation keeps every
+message with its token count and the start of the current truncation
+window, so a turn costs tokenizing the new message and moving the window
+forward, not re-shipping, re-parsing and re-counting the whole history.
+The prompt it builds is the one truncate_history would build from the
+same messages (same HISTORY_POLICY).
+
+Conversations live in memory, LRU-bounded by CHAT_STORE_MAX_SESSIONS and
+dropped after CHAT_STORE_IDLE seconds unused. With CHAT_STORE_DIR set,
+dropped conversations are written there as JSON and read back on the
+session's next turn, which also lets a restarted server pick them up.
+Without it a dropped conversation starts over.
+
+Single worker only: the store is per process, and with SERVER_WORKERS > 1
+consecutive turns of a session land on whichever worker accepts the
+connection (see deployment.py), which would not have the earlier turns.
+A shared CHAT_STORE_DIR doesn't fix that, as each worker keeps serving its
+own in-memory copy. So with several workers CHAT_STORE is off and clients
+send `history` with each request.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import pathlib
+import time
+from collections import OrderedDict
+
+import metrics
+from chat_helpers import (MAX_TOKENS, HISTORY_POLICY, SUMMARY_MAX_TOKENS, get_db_sys_prompt,
+                          text_tokens, summarize_turns)
+from deployment import WORKERS
+
+CHAT_STORE_REQUESTED = os.getenv("CHAT_STORE", "1").lower() not in {"0", "false", "no"}
+CHAT_STORE = CHAT_STORE_REQUESTED and WORKERS == 1  # see the module docstring
+CHAT_STORE_MAX_SESSIONS = int(os.getenv("CHAT_STORE_MAX_SESSIONS", "2048"))
+CHAT_STORE_IDLE = float(os.getenv("CHAT_STORE_IDLE", "7200"))
+CHAT_STORE_MAX_MESSAGES = int(os.getenv("CHAT_STORE_MAX_MESSAGES", "1000"))  # per conversation, oldest go first
+CHAT_STORE_DIR = os.getenv("CHAT_STORE_DIR", "")
+
+
+class Conversation:
+    """
+    Messages of one session plus their token counts. `start` is the first
+    message that fits the token budget next to the system prompt and a new
+    message; `window_tokens` is the sum from there on.
+    """
+
+    __slots__ = ("session_id", "messages", "tokens", "start", "window_tokens", "last_used", "model")
+
+    def __init__(self, session_id: str, messages=(), tokens=None, model="gpt-4.1"):
+        self.session_id = session_id
+        self.model = model
+        self.messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+        self.tokens = list(tokens) if tokens and len(tokens) == len(self.messages) else \
+            [text_tokens(m["content"], model) for m in self.messages]
+        self.start = 0
+        self.window_tokens = sum(self.tokens)
+        self.last_used = time.monotonic()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def display(self) -> list[dict]:
+        """A fresh list for the UI (the dicts are shared, don't edit them)."""
+        return list(self.messages)
+
+    def add(self, role: str, content: str):
+        self.messages.append({"role": role, "content": content})
+        n = text_tokens(content, self.model)
+        self.tokens.append(n)
+        self.window_tokens += n
+        extra = len(self.messages) - CHAT_STORE_MAX_MESSAGES
+        if extra > 0:
+            del self.messages[:extra], self.tokens[:extra]
+            if self.start >= extra:
+                self.start -= extra
+            else:
+                self.start = 0
+                self.window_tokens = sum(self.tokens)
+
+    def add_turn(self, user_text: str, assistant_text: str):
+        self.add("user", user_text)
+        self.add("assistant", assistant_text)
+
+    def _fit(self, budget: int):
+        # The window only moves forward as turns are added; it moves back if
+        # the budget grew (a shorter system prompt after an edit).
+        while self.window_tokens > budget and self.start < len(self.messages):
+            self.window_tokens -= self.tokens[self.start]
+            self.start += 1
+        while self.start > 0 and self.window_tokens + self.tokens[self.start - 1] <= budget:
+            self.start -= 1
+            self.window_tokens += self.tokens[self.start]
+
+    def build_input(self, message: str, max_tokens: int = MAX_TOKENS, policy: str | None = None) -> list[dict]:
+        """build_input_from_history(message, self.messages), without re-reading the history."""
+        started = time.perf_counter()
+        policy = policy or HISTORY_POLICY
+        self.last_used = time.monotonic()
+        system = get_db_sys_prompt()
+        fixed = text_tokens(system, self.model) + text_tokens(message, self.model)
+        self._fit(max_tokens - fixed)
+        cut = self.start
+        if cut and policy == "summarize":
+            # truncate_history's summarize policy drops down to a smaller budget
+            total = self.window_tokens
+            budget = max(0, max_tokens - SUMMARY_MAX_TOKENS) - fixed
+            while total > budget and cut < len(self.messages):
+                total -= self.tokens[cut]
+                cut += 1
+        if cut and policy in ("pairs", "summarize"):
+            while cut < len(self.messages) and self.messages[cut]["role"] == "assistant":
+                cut += 1
+
+        parts = [{"role": "system", "content": system}]
+        if cut and policy == "summarize":
+            parts.append({"role": "system", "content": summarize_turns(self.messages[:cut], model=self.model)})
+        parts += self.messages[cut:]
+        parts.append({"role": "user", "content": message})
+        metrics.observe("prompt_build_seconds", time.perf_counter() - started, source="store")
+        return parts
+
+    def to_json(self) -> dict:
+        return {"session_id": self.session_id, "model": self.model, "messages": self.messages, "tokens": self.tokens}
+
+
+class ConversationStore:
+    """LRU of Conversations, used from the event loop only; disk spill runs in a thread."""
+
+    def __init__(self, max_sessions: int = CHAT_STORE_MAX_SESSIONS, idle: float = CHAT_STORE_IDLE,
+                 spill_dir: str = CHAT_STORE_DIR):
+        self.max_sessions = max_sessions
+        self.idle = idle
+        self.spill_dir = pathlib.Path(spill_dir) if spill_dir else None
+        self._items: OrderedDict = OrderedDict()  # session_id -> Conversation
+        self._stats = dict(hits=0, created=0, evicted=0, expired=0, spilled=0, loaded=0, spill_errors=0)
+
+    def _path(self, session_id: str) -> pathlib.Path:
+        return self.spill_dir / (hashlib.sha1(session_id.encode()).hexdigest() + ".json")
+
+    def _load(self, session_id: str) -> Conversation | None:
+        path = self._path(session_id)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        if data.get("session_id") != session_id:
+            return None
+        return Conversation(session_id, data.get("messages", ()), data.get("tokens"), data.get("model", "gpt-4.1"))
+
+    def _spill(self, convs):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        for conv in convs:
+            path = self._path(conv.session_id)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(conv.to_json(), ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+
+    async def get(self, session_id: str) -> Conversation:
+        """The session's conversation, from memory, the spill dir, or new."""
+        await self._evict()
+        conv = self._items.get(session_id)
+        if conv is not None:
+            self._items.move_to_end(session_id)
+            self._stats["hits"] += 1
+        else:
+            if self.spill_dir is not None:
+                try:
+                    conv = await asyncio.to_thread(self._load, session_id)
+                except Exception:
+                    self._stats["spill_errors"] += 1
+                if conv is not None:
+                    self._stats["loaded"] += 1
+            if conv is None:
+                conv = Conversation(session_id)
+                self._stats["created"] += 1
+            # another turn of the same session may have loaded it meanwhile
+            conv = self._items.setdefault(session_id, conv)
+        conv.last_used = time.monotonic()
+        return conv
+
+    def drop(self, session_id: str):
+        self._items.pop(session_id, None)
+
+    async def _evict(self):
+        out = []
+        now = time.monotonic()
+        while self._items:
+            sid, conv = next(iter(self._items.items()))
+            if now - conv.last_used > self.idle:
+                self._stats["expired"] += 1
+            elif len(self._items) >= self.max_sessions:
+                self._stats["evicted"] += 1
+            else:
+                break
+            del self._items[sid]
+            if conv.messages:
+                out.append(conv)
+        if out and self.spill_dir is not None:
+            await self._spill_async(out)
+
+    async def _spill_async(self, convs):
+        try:
+            await asyncio.to_thread(self._spill, convs)
+            self._stats["spilled"] += len(convs)
+        except Exception:
+            self._stats["spill_errors"] += 1
+
+    async def close(self):
+        """Writes every conversation to the spill dir (if there is one), e.g. on shutdown."""
+        if self.spill_dir is not None and self._items:
+            await self._spill_async([c for c in self._items.values() if c.messages])
+
+    def stats(self) -> dict:
+        return dict(self._stats, sessions=len(self._items))
+
+
+conversations = ConversationStore()
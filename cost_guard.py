@@ -0,0 +1,141 @@
+"""
+Pre-flight EXPLAIN for read queries, so a runaway plan (a forgotten join
+condition, a sort over a cross join) is caught before it holds a pool
+connection and a core until statement_timeout.
+
+sql_tab runs `EXPLAIN (FORMAT JSON)` on the statement it is about to send
+(row cap included) and keeps the estimate per normalized query; writes to a
+table drop the estimates that read it. Optional, as it costs an extra
+round trip per uncached read: SQL_COST_GUARD is "off" by default (no
+EXPLAIN). Set it to pick what happens when the estimated total cost or
+returned rows exceed the thresholds: "warn" runs the query and says so,
+"reject" refuses it. Either way the UI then shows summary_markdown().
+
+Planner costs are in arbitrary units; on the course database 200k is
+about a second of work.
+"""
+import json
+import os
+from dataclasses import dataclass
+
+from result_cache import ResultCache
+
+COST_GUARD_MODE = os.getenv("SQL_COST_GUARD", "off").lower()    # off | warn | reject
+MAX_PLAN_COST = float(os.getenv("SQL_MAX_PLAN_COST", "200000"))
+MAX_PLAN_ROWS = float(os.getenv("SQL_MAX_PLAN_ROWS", "1000000"))
+PLAN_TTL = float(os.getenv("SQL_PLAN_TTL", "600"))             # seconds an estimate is reused
+SUMMARY_NODES = 12                                              # plan lines shown in the UI
+
+
+def explain_sql(sql: str) -> str:
+    return f"EXPLAIN (FORMAT JSON) {sql}"
+
+
+def _fmt(n: float) -> str:
+    for div, unit in ((1e9, "G"), (1e6, "M"), (1e3, "k")):
+        if n >= div:
+            return f"{n / div:.1f}{unit}"
+    return f"{n:.0f}"
+
+
+@dataclass(frozen=True)
+class PlanEstimate:
+    cost: float         # top node's total cost
+    rows: float         # rows the statement returns
+    nodes: tuple        # (depth, label, rows, cost) in plan order
+    cross_join: bool    # a Nested Loop with no join condition at all
+
+    @classmethod
+    def from_explain(cls, doc):
+        """From the single value EXPLAIN (FORMAT JSON) returns (parsed or text)."""
+        if isinstance(doc, str):
+            doc = json.loads(doc)
+        top = doc[0]["Plan"]
+        nodes, cross = [], False
+        stack = [(0, top)]
+        while stack:
+            depth, node = stack.pop()
+            label = node["Node Type"]
+            if node.get("Relation Name"):
+                label += f" on {node['Relation Name']}"
+                if node.get("Alias") and node["Alias"] != node["Relation Name"]:
+                    label += f" {node['Alias']}"
+            if label == "Nested Loop" and not node.get("Join Filter") and not any(
+                    "Index Cond" in child or "Recheck Cond" in child or "Filter" in child
+                    for child in node.get("Plans", ())[1:]):
+                cross = True
+            nodes.append((depth, label, float(node.get("Plan Rows", 0)), float(node.get("Total Cost", 0))))
+            stack.extend((depth + 1, child) for child in reversed(node.get("Plans", ())))
+        return cls(float(top.get("Total Cost", 0)), float(top.get("Plan Rows", 0)), tuple(nodes), cross)
+
+    def problems(self, max_cost: float = MAX_PLAN_COST, max_rows: float = MAX_PLAN_ROWS) -> list[str]:
+        out = []
+        if max_cost and self.cost > max_cost:
+            out.append(f"estimated cost {_fmt(self.cost)} > {_fmt(max_cost)}")
+        if max_rows and self.rows > max_rows:
+            out.append(f"estimated rows {_fmt(self.rows)} > {_fmt(max_rows)}")
+        return out
+
+    def summary_markdown(self, max_nodes: int = SUMMARY_NODES) -> str:
+        lines = [f"**Plan** · est. cost {_fmt(self.cost)} · est. rows {_fmt(self.rows)}", ""]
+        for depth, label, rows, cost in self.nodes[:max_nodes]:
+            lines.append(f"{'  ' * depth}- {label} · rows≈{_fmt(rows)} · cost {_fmt(cost)}")
+        if len(self.nodes) > max_nodes:
+            lines.append(f"- … {len(self.nodes) - max_nodes} more nodes")
+        if self.cross_join:
+            lines += ["", "A Nested Loop joins without any condition: is a join condition (ON ...) missing?"]
+        return "\n".join(lines)
+
+
+class CostGuard:
+    """Estimate cache plus the warn/reject decision. Thread-safe (the cache is)."""
+
+    def __init__(self, mode: str = COST_GUARD_MODE, max_cost: float = MAX_PLAN_COST,
+                 max_rows: float = MAX_PLAN_ROWS, ttl: float = PLAN_TTL):
+        self.mode = mode if mode in ("off", "warn", "reject") else "warn"
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self._plans = ResultCache(max_entries=1024, ttl=ttl, max_bytes=16 << 20)
+        self._stats = dict(explains=0, explain_errors=0, warned=0, rejected=0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def lookup(self, key) -> PlanEstimate | None:
+        return self._plans.get(key)
+
+    def store(self, key, doc, tables) -> PlanEstimate | None:
+        """Parses an EXPLAIN result and caches it; None if it can't be read."""
+        self._stats["explains"] += 1
+        try:
+            est = PlanEstimate.from_explain(doc)
+        except Exception:
+            self._stats["explain_errors"] += 1
+            return None
+        self._plans.put(key, est, 256 + 64 * len(est.nodes), tables)
+        return est
+
+    def explain_failed(self):
+        self._stats["explain_errors"] += 1
+
+    def verdict(self, est: PlanEstimate | None) -> tuple[str, str]:
+        """("ok" | "warn" | "reject", message for the user)."""
+        problems = est.problems(self.max_cost, self.max_rows) if est else []
+        if not problems:
+            return "ok", ""
+        if self.mode == "reject":
+            self._stats["rejected"] += 1
+            return "reject", f"Error: query rejected, {' and '.join(problems)}. See the plan for where the work goes."
+        self._stats["warned"] += 1
+        return "warn", f"⚠️ expensive query: {' and '.join(problems)}"
+
+    def invalidate_tables(self, tables):
+        self._plans.invalidate_tables(tables)
+
+    def stats(self) -> dict:
+        cache = self._plans.stats()
+        return dict(self._stats, mode=self.mode, cached_plans=cache["entries"], plan_hit_rate=cache["hit_rate"])
+
+
+cost_guard = CostGuard()
@@ -0,0 +1,216 @@
+"""
+Typed materialized views, precomputed aggregates and indexes for the course
+database.
+
+The money columns of sales (and metadata.userscore) are text, with missing
+values spelled 'n/a', 'null', 'tbd' and so on, so every revenue or ROI
+query casts and cleans them per row and no index helps. This builds:
+
+  clean_numeric(text)   numeric or NULL, for anyone casting by hand
+  sales_typed           sales with bigint money columns and an roi column
+  metadata_typed        metadata with a real userscore
+  genre_revenue, studio_stats, year_revenue   small precomputed aggregates
+  indexes on title / url / genre / studio, for the base tables and the views
+
+    python db_bootstrap.py build [--replace]    # create what's missing (--replace: drop first)
+    python db_bootstrap.py refresh              # re-read the base tables after a data load
+    python db_bootstrap.py status
+    python db_bootstrap.py drop
+
+Running servers are told through the result-cache channel (see
+sql_tab.start_cache_listener), so they stop serving stale results. With
+DB_PROMPT_VIEWS=1 the assistant's system prompt lists the views (prompt_section()).
+"""
+import argparse
+import sys
+
+FUNCTIONS = {
+    "clean_numeric": r"""
+CREATE OR REPLACE FUNCTION clean_numeric(v text) RETURNS numeric
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE WHEN btrim(v) ~ '^\$?-?[0-9][0-9,]*(\.[0-9]+)?$'
+                THEN replace(replace(btrim(v), '$', ''), ',', '')::numeric END
+$$""",
+}
+
+# (name, definition, one-line description for the prompt), in dependency order
+VIEWS = [
+    ("sales_typed", """
+SELECT year, release_date, title, genre,
+       clean_numeric(international_box_office)::bigint AS international_box_office,
+       clean_numeric(domestic_box_office)::bigint      AS domestic_box_office,
+       clean_numeric(worldwide_box_office)::bigint     AS worldwide_box_office,
+       clean_numeric(production_budget)::bigint        AS production_budget,
+       clean_numeric(opening_weekend)::bigint          AS opening_weekend,
+       theatre_count,
+       clean_numeric(avg_run_per_theatre)              AS avg_run_per_theatre,
+       runtime, keywords, creative_type, url,
+       round(clean_numeric(worldwide_box_office) / NULLIF(clean_numeric(production_budget), 0), 4) AS roi
+FROM sales""",
+     "sales_typed: the columns of sales, but the box office, budget and opening_weekend columns are bigint "
+     "and avg_run_per_theatre numeric ('n/a', 'null' etc. become NULL), plus roi = worldwide_box_office / production_budget."),
+    ("metadata_typed", """
+SELECT url, title, studio, rating, runtime, casting, director, genre, summary, awards,
+       metascore, clean_numeric(userscore)::real AS userscore, reldate
+FROM metadata""",
+     "metadata_typed: the columns of metadata, with userscore as real (NULL when it was 'tbd' or similar)."),
+    ("genre_revenue", """
+SELECT genre,
+       count(*)                           AS movies,
+       count(worldwide_box_office)        AS movies_with_revenue,
+       sum(worldwide_box_office)          AS total_worldwide,
+       round(avg(worldwide_box_office))   AS avg_worldwide,
+       round(avg(production_budget))      AS avg_budget,
+       round(avg(roi), 4)                 AS avg_roi
+FROM sales_typed GROUP BY genre""",
+     "genre_revenue(genre, movies, movies_with_revenue, total_worldwide, avg_worldwide, avg_budget, avg_roi), one row per sales.genre."),
+    ("studio_stats", """
+SELECT studio,
+       count(*)                      AS movies,
+       round(avg(runtime), 1)        AS avg_runtime,
+       round(avg(metascore), 1)      AS avg_metascore,
+       round(avg(userscore)::numeric, 2) AS avg_userscore
+FROM metadata_typed GROUP BY studio""",
+     "studio_stats(studio, movies, avg_runtime, avg_metascore, avg_userscore), one row per metadata.studio."),
+    ("year_revenue", """
+SELECT year,
+       count(*)                           AS movies,
+       sum(worldwide_box_office)          AS total_worldwide,
+       round(avg(production_budget))      AS avg_budget,
+       round(avg(roi), 4)                 AS avg_roi
+FROM sales_typed GROUP BY year""",
+     "year_revenue(year, movies, total_worldwide, avg_budget, avg_roi), one row per sales.year."),
+]
+
+# (table, column); the base tables get them too, for students who query those
+INDEXES = [
+    ("sales", "title"), ("sales", "url"), ("sales", "genre"),
+    ("metadata", "title"), ("metadata", "url"), ("metadata", "genre"), ("metadata", "studio"),
+    ("user_reviews", "url"), ("expert_reviews", "url"),
+    ("sales_typed", "title"), ("sales_typed", "url"), ("sales_typed", "genre"),
+    ("metadata_typed", "title"), ("metadata_typed", "url"), ("metadata_typed", "genre"),
+    ("metadata_typed", "studio"),
+]
+
+
+def prompt_section() -> str:
+    """What the assistant's system prompt says about the views (DB_PROMPT_VIEWS=1)."""
+    lines = [
+        "",
+        "Precomputed materialized views are also available; prefer them for revenue, budget, ROI, "
+        "userscore and per-genre/studio/year questions, since they need no casting:",
+    ]
+    lines += [f"- {desc}" for _, _, desc in VIEWS]
+    lines.append("- clean_numeric(text) returns numeric, or NULL for 'n/a', 'null' and other non-numbers.")
+    return "\n".join(lines)
+
+
+def connect():
+    import psycopg
+    from sql_tab import DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_PORT
+    return psycopg.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+                           host=DB_HOST, port=DB_PORT, autocommit=True)
+
+
+def _existing_views(conn) -> set:
+    rows = conn.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = current_schema()").fetchall()
+    return {r[0] for r in rows}
+
+
+def _existing_tables(conn) -> set:
+    rows = conn.execute(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema()"
+        " UNION SELECT matviewname FROM pg_matviews WHERE schemaname = current_schema()").fetchall()
+    return {r[0] for r in rows}
+
+
+def _notify(conn, names):
+    # same payload as sql_tab._invalidation_notice; pid 0 is no server's own
+    from sql_tab import CACHE_CHANNEL
+    conn.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, "0:" + ",".join(sorted(names))))
+
+
+def build(conn, replace: bool = False, log=print):
+    if replace:
+        drop(conn, log)
+    with conn.transaction():
+        for name, ddl in FUNCTIONS.items():
+            conn.execute(ddl)
+        have = _existing_views(conn)
+        for name, body, _ in VIEWS:
+            if name not in have:
+                log(f"creating {name}")
+                conn.execute(f"CREATE MATERIALIZED VIEW {name} AS {body}")
+        tables = _existing_tables(conn)
+        for table, column in INDEXES:
+            if table in tables:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column}_idx ON {table} ({column})")
+    for name, _, _ in VIEWS:
+        conn.execute(f"ANALYZE {name}")
+    _notify(conn, [name for name, _, _ in VIEWS])
+
+
+def refresh(conn, log=print):
+    """Recomputes every view from the base tables, in dependency order, in one transaction."""
+    with conn.transaction():
+        for name, _, _ in VIEWS:
+            log(f"refreshing {name}")
+            conn.execute(f"REFRESH MATERIALIZED VIEW {name}")
+    for name, _, _ in VIEWS:
+        conn.execute(f"ANALYZE {name}")
+    _notify(conn, [name for name, _, _ in VIEWS])
+
+
+def drop(conn, log=print):
+    """Views and their indexes, the function and the base-table indexes."""
+    with conn.transaction():
+        for name, _, _ in reversed(VIEWS):
+            conn.execute(f"DROP MATERIALIZED VIEW IF EXISTS {name} CASCADE")
+        for table, column in INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {table}_{column}_idx")
+        for name in FUNCTIONS:
+            conn.execute(f"DROP FUNCTION IF EXISTS {name}(text)")
+    log("dropped")
+    _notify(conn, [name for name, _, _ in VIEWS])
+
+
+def status(conn) -> list[tuple]:
+    """(view, rows, size) for the views that exist."""
+    have = _existing_views(conn)
+    out = []
+    for name, _, _ in VIEWS:
+        if name in have:
+            rows, size = conn.execute(
+                f"SELECT count(*), pg_size_pretty(pg_total_relation_size('{name}')) FROM {name}").fetchone()
+            out.append((name, rows, size))
+        else:
+            out.append((name, None, None))
+    return out
+
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build")
+    b.add_argument("--replace", action="store_true", help="drop and recreate everything")
+    sub.add_parser("refresh")
+    sub.add_parser("status")
+    sub.add_parser("drop")
+    sub.add_parser("prompt", help="print what DB_PROMPT_VIEWS=1 adds to the system prompt")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "prompt":
+        print(prompt_section())
+        return
+    with connect() as conn:
+        if args.cmd == "build":
+            build(conn, args.replace)
+        elif args.cmd == "refresh":
+            refresh(conn)
+        elif args.cmd == "drop":
+            drop(conn)
+        for name, rows, size in status(conn):
+            print(f"{name:16} " + (f"{rows} rows, {size}" if rows is not None else "missing"), file=sys.stderr)
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,228 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+# Puts a returned connection's session back the way connect() left it:
+# DISCARD ALL minus DEALLOCATE ALL / DISCARD PLANS, so plan_cache's prepared
+# statements survive. RESET ALL alone keeps SET ROLE, LISTENs and locks.
+# Options passed at connect time (statement_timeout) are the RESET defaults.
+SESSION_RESET_SQL = (
+    "CLOSE ALL; SET SESSION AUTHORIZATION DEFAULT; RESET ALL; UNLISTEN *; "
+    "SELECT pg_advisory_unlock_all(); DISCARD TEMP; DISCARD SEQUENCES"
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free before the borrow deadline."""
+
+
+class _Slot:
+    __slots__ = ("conn", "created", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created = now
+        self.last_used = now
+
+
+class BoundedPool:
+    """
+    Thread-safe psycopg2 pool with at most `maxconn` physical connections.
+
+    - getconn() waits (FIFO) up to `timeout` seconds when every connection is
+      in use, instead of raising immediately like SimpleConnectionPool.
+    - `minconn` connections are opened up front and replaced when discarded.
+    - Connections idle for more than `check_idle` seconds are pinged before
+      being handed out; ones older than `max_lifetime` are recycled.
+    - Session settings go through `connect_kwargs` (e.g. options="-c ..."),
+      so they are applied once per physical connection, not per borrow.
+      putconn() runs SESSION_RESET_SQL, so whatever a query SET on the
+      session is gone before the next borrower gets the connection.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 5.0,
+                 check_idle: float = 30.0, max_lifetime: float = 1800.0,
+                 **connect_kwargs):
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_lifetime = max_lifetime
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle: deque[_Slot] = deque()
+        self._slots: dict[int, _Slot] = {}  # id(conn) -> slot, for every open conn
+        self._size = 0          # open + being opened
+        self._waiting = 0
+        self._closed = False
+
+        self._stats = dict(
+            borrows=0, borrow_failures=0, timeouts=0,
+            connections_opened=0, connections_discarded=0,
+            wait_seconds_total=0.0, wait_seconds_max=0.0,
+        )
+        self._ensure_min()
+
+    # --- public API ---
+
+    def getconn(self, timeout: float | None = None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        try:
+            while True:
+                slot, reserved = self._acquire(deadline)
+                if reserved:
+                    slot = self._open_slot()
+                elif not self._usable(slot):
+                    self._discard(slot)
+                    continue
+                self._record_wait(time.monotonic() - started)
+                return slot.conn
+        except Exception:
+            with self._cond:
+                self._stats["borrow_failures"] += 1
+            raise
+
+    def putconn(self, conn, close: bool = False):
+        slot = self._slots.get(id(conn))
+        if slot is None or slot.conn is not conn:
+            conn.close()
+            return
+        if close or self._closed or not self._reset(conn):
+            self._discard(slot)
+            return
+        slot.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(slot)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for slot in idle:
+            self._discard(slot)
+
+    def stats(self) -> dict:
+        with self._cond:
+            out = dict(self._stats)
+            out.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                waiting=self._waiting,
+                max=self.maxconn,
+            )
+        return out
+
+    # --- internals ---
+
+    def _acquire(self, deadline):
+        """Returns (slot, False) for an idle conn or (None, True) when a new one may be opened."""
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("connection pool is closed")
+                    if self._idle:
+                        return self._idle.pop(), False   # LIFO keeps hot conns hot
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        return None, True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"no database connection available within {self.timeout:.1f}s"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def _open_slot(self) -> _Slot:
+        try:
+            conn = psycopg2.connect(**self._connect_kwargs)
+            conn.autocommit = True
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        slot = _Slot(conn)
+        with self._cond:
+            self._slots[id(conn)] = slot
+            self._stats["connections_opened"] += 1
+        return slot
+
+    def _usable(self, slot: _Slot) -> bool:
+        conn = slot.conn
+        now = time.monotonic()
+        if conn.closed or now - slot.created > self.max_lifetime:
+            return False
+        if now - slot.last_used > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    def _reset(conn) -> bool:
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute(SESSION_RESET_SQL)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, slot: _Slot):
+        with self._cond:
+            if self._slots.pop(id(slot.conn), None) is not None:
+                self._size -= 1
+                self._stats["connections_discarded"] += 1
+            self._cond.notify()
+        try:
+            slot.conn.close()
+        except Exception:
+            pass
+        self._ensure_min()
+
+    def _ensure_min(self):
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                slot = self._open_slot()
+            except Exception:
+                return  # DB unreachable; the next borrow will retry
+            slot.last_used = time.monotonic()
+            with self._cond:
+                self._idle.appendleft(slot)
+                self._cond.notify()
+
+    def _record_wait(self, waited: float):
+        with self._cond:
+            s = self._stats
+            s["borrows"] += 1
+            s["wait_seconds_total"] += waited
+            if waited > s["wait_seconds_max"]:
+                s["wait_seconds_max"] = waited
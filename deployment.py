@@ -0,0 +1,64 @@
+"""
+Multi-process settings. server.py starts SERVER_WORKERS uvicorn workers
+(default 1) and every worker builds its own app, pools, caches and log
+writer from the same environment, so per-process limits are derived here
+from the deployment-wide ones.
+
+The workers share one listening socket, so consecutive requests from a
+client can land on different workers and no proxy in front can pin them.
+The Gradio UI needs its requests on one process, so server.py only mounts
+it with a single worker; multi-worker mode serves the /e2e API.
+
+Shared-nothing: nothing is shared between workers except Postgres and the
+log directory.
+  - DB pools: PG_CONN_BUDGET (total server connections for the whole
+    deployment) is split evenly across workers, see pg_pool_sizes().
+    Without it every worker holds at most PG_POOL_MAX connections.
+  - SQL result cache: per worker; writes are broadcast with NOTIFY so the
+    other workers drop the affected tables too (sql_tab.start_cache_listener).
+  - LLM response cache / single-flight: per worker (cold cache per worker).
+  - Chat history: the conversation store is per process, so it is turned
+    off with more than one worker and /e2e/chat clients send the history
+    (conversation_store.py).
+  - Concurrency caps (LLM, queue length): each worker enforces
+    1/SERVER_WORKERS of the configured totals. Per-user rate limits are
+    per worker, at the configured rate (admission.py).
+  - Logs: JSONL appends are flock'ed; segmented store files are per pid.
+"""
+import os
+
+WORKERS = max(1, int(os.getenv("SERVER_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+PG_CONN_BUDGET = int(os.getenv("PG_CONN_BUDGET", "0"))  # 0: each worker gets PG_POOL_MAX
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))        # per worker, when there is no budget
+# part of a worker's share of the budget that goes to the psycopg2 pool
+# (only /e2e/sql/sync and run_sql use it); the rest is the async pool's
+PG_SYNC_POOL_SHARE = float(os.getenv("PG_SYNC_POOL_SHARE", "0.25"))
+# writes are NOTIFYed to the other workers' SQL result caches; the listener
+# (sql_tab.start_cache_listener) holds a connection of its own
+CACHE_BROADCAST = os.getenv("SQL_CACHE_BROADCAST", "1" if WORKERS > 1 else "0").lower() in {"1", "true", "yes"}
+
+
+def per_worker(total: float, minimum: float = 1):
+    """This worker's share of a deployment-wide total."""
+    share = total / WORKERS
+    if isinstance(total, int):
+        share = int(share)
+    return max(minimum, share)
+
+
+def pg_pool_sizes() -> tuple[int, int]:
+    """
+    (async_max, sync_max) for this process. Its connections, budget //
+    workers with PG_CONN_BUDGET and PG_POOL_MAX without, minus one for the
+    cache-invalidation listener when CACHE_BROADCAST is on, are split
+    between the two pools, so together they never exceed that.
+    """
+    listener = 1 if CACHE_BROADCAST else 0
+    share = (PG_CONN_BUDGET // WORKERS if PG_CONN_BUDGET > 0 else PG_POOL_MAX) - listener
+    if share < 2:
+        setting = f"PG_CONN_BUDGET={PG_CONN_BUDGET} is" if PG_CONN_BUDGET > 0 else f"PG_POOL_MAX={PG_POOL_MAX} is"
+        raise ValueError(
+            f"{setting} too small for {WORKERS} worker(s) "
+            f"(each needs at least {2 + listener} connections)")
+    sync_max = max(1, int(share * PG_SYNC_POOL_SHARE))
+    return max(1, share - sync_max), sync_max
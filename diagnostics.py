@@ -0,0 +1,96 @@
+"""
+Debug previews of SQL results for server.py, cheap enough to leave on.
+
+Nothing is formatted unless it is going to be logged: previews are objects
+whose __str__ renders a bounded slice (DIAG_PREVIEW_ROWS x DIAG_PREVIEW_COLS,
+cells cut at DIAG_PREVIEW_COLWIDTH, at most DIAG_PREVIEW_CHARS), and they
+are only handed to the logger when the request is picked:
+
+  error           always, at ERROR (the traceback is logged by the caller)
+  slow            elapsed >= DIAG_SLOW_MS, at WARNING
+  sampled         every DIAG_SAMPLE_EVERY-th request, at DEBUG (0: never)
+
+The logger is "uvicorn.error.diagnostics", so records go wherever uvicorn's
+do; DIAG_LEVEL (default INFO) is its threshold, so sampled previews need
+DIAG_LEVEL=DEBUG. Each record carries the request's trace ID.
+"""
+import itertools
+import logging
+import os
+
+import metrics
+
+DIAG_LEVEL = os.getenv("DIAG_LEVEL", "INFO").upper()
+DIAG_SAMPLE_EVERY = int(os.getenv("DIAG_SAMPLE_EVERY", "100"))
+DIAG_SLOW_MS = float(os.getenv("DIAG_SLOW_MS", "1000"))
+DIAG_PREVIEW_ROWS = int(os.getenv("DIAG_PREVIEW_ROWS", "10"))
+DIAG_PREVIEW_COLS = int(os.getenv("DIAG_PREVIEW_COLS", "12"))
+DIAG_PREVIEW_COLWIDTH = int(os.getenv("DIAG_PREVIEW_COLWIDTH", "40"))
+DIAG_PREVIEW_CHARS = int(os.getenv("DIAG_PREVIEW_CHARS", "4000"))
+
+log = logging.getLogger("uvicorn.error.diagnostics")
+log.setLevel(DIAG_LEVEL)
+
+
+class Preview:
+    """A result (DataFrame, or columns plus tuple rows) that renders a bounded table when printed."""
+
+    __slots__ = ("columns", "rows", "df")
+
+    def __init__(self, df=None, columns=None, rows=None):
+        self.df = df
+        self.columns = columns
+        self.rows = rows
+
+    def _shape(self):
+        if self.df is not None:
+            return self.df.shape
+        return len(self.rows or ()), len(self.columns or ())
+
+    def __str__(self):
+        import pandas as pd
+        n_rows, n_cols = self._shape()
+        if self.df is not None:
+            df = self.df.iloc[:DIAG_PREVIEW_ROWS, :DIAG_PREVIEW_COLS]
+        else:
+            cols = list(self.columns or ())[:DIAG_PREVIEW_COLS]
+            rows = [tuple(r)[:DIAG_PREVIEW_COLS] for r in (self.rows or ())[:DIAG_PREVIEW_ROWS]]
+            df = pd.DataFrame.from_records(rows, columns=cols)
+        text = df.to_string(max_colwidth=DIAG_PREVIEW_COLWIDTH)
+        if len(text) > DIAG_PREVIEW_CHARS:
+            text = text[:DIAG_PREVIEW_CHARS] + " …"
+        shown = f"{min(n_rows, DIAG_PREVIEW_ROWS)}/{n_rows} rows, {min(n_cols, DIAG_PREVIEW_COLS)}/{n_cols} cols"
+        return f"[{shown}]\n{text}"
+
+
+class Diagnostics:
+    """Decides which requests get a preview logged; the stats counters are best-effort across threads."""
+
+    def __init__(self, sample_every: int = DIAG_SAMPLE_EVERY, slow_ms: float = DIAG_SLOW_MS):
+        self.sample_every = sample_every
+        self.slow_ms = slow_ms
+        self._requests = itertools.count(1)
+        self.stats = dict(sampled=0, slow=0, errors=0)
+
+    def result(self, what: str, elapsed, preview: Preview):
+        """Call once per successful request; logs `preview` if the request is slow or sampled."""
+        n = next(self._requests)
+        if elapsed is not None and elapsed * 1000 >= self.slow_ms:
+            level, why = logging.WARNING, "slow"
+        elif self.sample_every > 0 and n % self.sample_every == 0:
+            level, why = logging.DEBUG, "sampled"
+        else:
+            return
+        if log.isEnabledFor(level):
+            self.stats[why] += 1
+            log.log(level, "%s %s (%.3fs, trace %s) %s", what, why, elapsed or 0.0,
+                    metrics.current_trace_id() or "-", preview)
+
+    def error(self, what: str, preview: Preview | None):
+        """The result a failed request was working on; call next to the traceback."""
+        self.stats["errors"] += 1
+        if preview is not None and log.isEnabledFor(logging.ERROR):
+            log.error("%s failed (trace %s) on %s", what, metrics.current_trace_id() or "-", preview)
+
+
+diagnostics = Diagnostics()
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").lower() not in {"0", "false", "no"}
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600"))
+LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX", "512"))
+
+
+def request_key(kwargs: dict) -> str:
+    """Hash of everything sent upstream (model, instructions, truncated input, tools, ...)."""
+    raw = json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fold(items) -> str:
+    """Final answer text from a list of (replace, text) items."""
+    text = ""
+    for replace, part in items:
+        text = part if replace else text + part
+    return text
+
+
+class _Flight:
+    """
+    One upstream streaming call and everything it has produced so far.
+    Items are (replace, text): append `text`, or replace the whole answer
+    with it when `replace` is True (the final response differed from the deltas).
+    """
+
+    def __init__(self):
+        self.items: list[tuple[bool, str]] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.cond = asyncio.Condition()
+        self.task: asyncio.Task | None = None  # the upstream call, owned by no request
+        self.followers = 0
+
+    async def publish(self, item):
+        async with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    async def finish(self, error=None):
+        async with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    async def follow(self):
+        i = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: i < len(self.items) or self.done)
+                new, i = self.items[i:], len(self.items)
+                done, error = self.done, self.error
+            for item in new:
+                yield item
+            if done and i >= len(self.items):
+                if error is not None:
+                    raise error
+                return
+
+
+class ResponseCache:
+    """
+    TTL/LRU cache of chat completions plus single-flight: concurrent identical
+    requests share one upstream call. Lives on one event loop, no locking needed.
+
+    The shared call runs in a task of its own, so a request that goes away
+    (client disconnect) doesn't take the answer from the others; it is
+    cancelled only once nobody is waiting for it any more.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX, ttl: float = LLM_CACHE_TTL,
+                 enabled: bool = LLM_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._data: OrderedDict = OrderedDict()  # key -> (expires, items)
+        self._flights: dict[str, _Flight] = {}
+        self._once: dict[str, list] = {}  # key -> [task, waiters]
+        self._tasks: set[asyncio.Task] = set()  # strong refs to running upstream tasks
+        self._stats = dict(hits=0, misses=0, coalesced=0, stores=0, evictions=0, errors=0)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return item[1]
+
+    def put(self, key, items):
+        self._data[key] = (time.monotonic() + self.ttl, items)
+        self._data.move_to_end(key)
+        self._stats["stores"] += 1
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        out = dict(self._stats, entries=len(self._data), in_flight=len(self._flights) + len(self._once))
+        lookups = out["hits"] + out["misses"] + out["coalesced"]
+        out["hit_rate"] = (out["hits"] + out["coalesced"]) / lookups if lookups else 0.0
+        return out
+
+    async def stream(self, key: str, upstream):
+        """
+        Yields (replace, text) items for `key`. `upstream()` must return an
+        async iterator of such items; it's only called on a miss with no
+        identical request in flight. Hits replay the stored items one by one.
+        """
+        if not self.enabled:
+            async for item in upstream():
+                yield item
+            return
+
+        cached = self.get(key)
+        if cached is not None:
+            self._stats["hits"] += 1
+            for item in cached:
+                yield item
+                await asyncio.sleep(0)  # let the UI render chunk by chunk
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self._stats["misses"] += 1
+            flight = self._flights[key] = _Flight()
+            flight.task = self._start(self._drive(key, flight, upstream))
+        else:
+            self._stats["coalesced"] += 1
+        flight.followers += 1
+        try:
+            async for item in flight.follow():
+                yield item
+        finally:
+            flight.followers -= 1
+            if not flight.followers and not flight.task.done():
+                # the last follower left (disconnect): stop paying for the answer
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def _start(self, coro) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _drive(self, key, flight, upstream):
+        try:
+            async for item in upstream():
+                await flight.publish(item)
+        except Exception as e:
+            self._stats["errors"] += 1
+            await flight.finish(e)
+        except BaseException as e:
+            # cancelled (nobody left, or shutdown): followers hear it, the task stays cancelled
+            await flight.finish(e)
+            raise
+        else:
+            self.put(key, list(flight.items))
+            await flight.finish()
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def once(self, key: str, upstream):
+        """
+        Non-streaming variant: `await upstream()` -> text, cached and coalesced.
+        Shares entries with stream(), so either call can answer the other.
+        """
+        if not self.enabled:
+            return await upstream()
+        cached = self.get(key)
+        if cached is not None:
+            self._stats["hits"] += 1
+            return fold(cached)
+        call = self._once.get(key)
+        if call is None:
+            self._stats["misses"] += 1
+            call = self._once[key] = [self._start(self._call(key, upstream)), 0]
+        else:
+            self._stats["coalesced"] += 1
+        task = call[0]
+        call[1] += 1
+        try:
+            # shield: cancelling this request leaves the shared call running
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if not call[1] and not task.done():
+                if self._once.get(key) is call:
+                    del self._once[key]
+                task.cancel()
+
+    async def _call(self, key, upstream):
+        try:
+            text = await upstream()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            call = self._once.get(key)
+            if call is not None and call[0] is asyncio.current_task():
+                del self._once[key]
+        self.put(key, [(True, text)])
+        return text
+
+
+response_cache = ResponseCache()
@@ -3,7 +3,9 @@ import json, random, string, time
 from locust import HttpUser, task, between
 
 CHAT_PATH = "/e2e/chat"
+CHAT_STREAM_PATH = "/e2e/chat/stream"
 SQL_PATH = "/e2e/sql"
+SQL_SYNC_PATH = "/e2e/sql/sync"
 
 SIMPLE_SQL = [
     "SELECT * FROM sales",
@@ -13,28 +15,44 @@ SIMPLE_SQL = [
     "SELECT s.title, m.studio FROM sales s JOIN metadata m ON s.title=m.title LIMIT 200",
 ]
 
+CHAT_PROMPTS = [
+    "Which table has the highest number of rows and why?",
+    "Write a SQL to list top-5 genres by revenue.",
+    "Explain how to compute ROI = worldwide_box_office / production_budget.",
+    "What's the average runtime by studio?",
+]
+
+CHAT_HISTORY = [
+    {"role": "user", "content": "Hi"},
+    {"role": "assistant", "content": "Hello!"},
+]
+
+def unique_prompt():
+    """A CHAT_PROMPTS question with a random suffix: never an LLM cache hit or a coalesced request."""
+    return f"{random.choice(CHAT_PROMPTS)} (ref {random.getrandbits(48):012x})"
+
 def rnd_name():
     import string, random
     return "U-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
-class GradioDBUser(HttpUser):
+class StudentUser(HttpUser):
+    """One simulated student: a stable user_name/session_id, which is what the
+    server's per-user rate limits key on (see admission.py). For raw
+    throughput runs, disable those with ADMIT_CHAT_RATE=0 ADMIT_SQL_RATE=0."""
+    abstract = True
+
+    def on_start(self):
+        self.user_name = rnd_name()
+        self.session_id = "locust-" + self.user_name
+
+class GradioDBUser(StudentUser):
     wait_time = between(0.05, 0.25)
 
     @task(3)
     def chat(self):
-        msg = random.choice([
-            "Which table has the highest number of rows and why?",
-            "Write a SQL to list top-5 genres by revenue.",
-            "Explain how to compute ROI = worldwide_box_office / production_budget.",
-            "What's the average runtime by studio?",
-        ])
-        payload = {
-            "message": msg,
-            "history": [
-                {"role": "user", "content": "Hi"},
-                {"role": "assistant", "content": "Hello!"},
-            ],
-        }
+        msg = random.choice(CHAT_PROMPTS)
+        payload = {"message": msg, "history": CHAT_HISTORY,
+                   "user_name": self.user_name, "session_id": self.session_id}
 
         t0 = time.perf_counter()
         with self.client.post(
@@ -57,25 +75,124 @@ class GradioDBUser(HttpUser):
 
     @task(2)
     def sql(self):
-        payload = {"query": random.choice(SIMPLE_SQL), "limit": 200, "allow_writes": False}
-        t0 = time.perf_counter()
-        with self.client.post(
-            SQL_PATH,
-            data=json.dumps(payload),
-            headers={"Content-Type": "application/json"},
-            name="sql",
-            catch_response=True,
-        ) as r:
-            dt_ms = (time.perf_counter() - t0) * 1000
-            if r.status_code != 200:
-                r.failure(f"HTTP {r.status_code}: {r.text[:200]}")
-            else:
-                try:
-                    j = r.json()
-                    # Optional sanity checks so bad responses are marked failures
-                    if "rows" in j and isinstance(j["rows"], list):
-                        r.success()
-                    else:
-                        r.failure(f"Unexpected JSON shape after {dt_ms:.1f}ms: {j}")
-                except Exception as e:
-                    r.failure(f"Bad JSON after {dt_ms:.1f}ms: {e}")
+        post_sql(self, SQL_PATH, "sql")
+
+
+def post_sql(user, path, name):
+    payload = {"query": random.choice(SIMPLE_SQL), "limit": 200, "allow_writes": False,
+               "user_name": user.user_name, "session_id": user.session_id}
+    t0 = time.perf_counter()
+    with user.client.post(
+        path,
+        data=json.dumps(payload),
+        headers={"Content-Type": "application/json"},
+        name=name,
+        catch_response=True,
+    ) as r:
+        dt_ms = (time.perf_counter() - t0) * 1000
+        if r.status_code != 200:
+            r.failure(f"HTTP {r.status_code}: {r.text[:200]}")
+        else:
+            try:
+                j = r.json()
+                # Optional sanity checks so bad responses are marked failures
+                if "rows" in j and isinstance(j["rows"], list):
+                    r.success()
+                else:
+                    r.failure(f"Unexpected JSON shape after {dt_ms:.1f}ms: {j}")
+            except Exception as e:
+                r.failure(f"Bad JSON after {dt_ms:.1f}ms: {e}")
+
+
+# Async vs sync SQL engine comparison. SIMPLE_SQL is a handful of queries, so
+# with the result cache on this mostly measures cache hits: start the server
+# with SQL_CACHE=0 to compare the DB paths. These users send ~6 req/s each,
+# above the per-user ADMIT_SQL_RATE, and /e2e/sql/sync has no admission
+# control, so turn the rate limits off too or the async side measures 429s.
+# Run one class at a time so they don't compete for the same pool, e.g.
+#   SQL_CACHE=0 ADMIT_CHAT_RATE=0 ADMIT_SQL_RATE=0 python server.py
+#   locust -f locustfile.py --headless -u 200 -r 50 -t 2m SqlAsyncUser
+#   locust -f locustfile.py --headless -u 200 -r 50 -t 2m SqlSyncUser
+class SqlAsyncUser(StudentUser):
+    wait_time = between(0.05, 0.25)
+
+    @task
+    def sql(self):
+        post_sql(self, SQL_PATH, "sql_async")
+
+class SqlSyncUser(StudentUser):
+    wait_time = between(0.05, 0.25)
+
+    @task
+    def sql(self):
+        post_sql(self, SQL_SYNC_PATH, "sql_sync")
+
+
+# Streaming chat path (chat_driver -> respond -> responses.stream), as used by
+# the Gradio UI. Meant to run against the in-process mock, e.g.
+#   MOCK_OPENAI=1 MOCK_OPENAI_TTFT=0.4 MOCK_OPENAI_TPS=50 python server.py
+#   locust -f locustfile.py --headless -u 200 -r 50 -t 2m StreamingChatUser
+# Reports "chat_stream" (full answer) and "chat_stream_ttfb" (first chunk).
+# Every message is unique (unique_prompt), so the LLM cache (llm_cache.py)
+# never answers for the upstream stream; with fixed prompts nearly every
+# request would be a cache replay after the first few.
+class StreamingChatUser(StudentUser):
+    wait_time = between(0.05, 0.25)
+
+    @task
+    def chat_stream(self):
+        post_chat_stream(self)
+
+
+def post_chat_stream(user):
+    payload = {
+        "message": unique_prompt(),
+        "history": CHAT_HISTORY,
+        "user_name": user.user_name,
+        "session_id": user.session_id,
+    }
+    t0 = time.perf_counter()
+    with user.client.post(
+        CHAT_STREAM_PATH,
+        data=json.dumps(payload),
+        headers={"Content-Type": "application/json"},
+        name="chat_stream",
+        stream=True,
+        catch_response=True,
+    ) as r:
+        if r.status_code != 200:
+            r.failure(f"HTTP {r.status_code}: {r.text[:200]}")
+            return
+        first, n_bytes, n_chunks = None, 0, 0
+        try:
+            for chunk in r.iter_content(chunk_size=None):
+                if first is None:
+                    first = (time.perf_counter() - t0) * 1000
+                n_bytes += len(chunk)
+                n_chunks += 1
+        except Exception as e:
+            r.failure(f"Stream broke after {n_chunks} chunks: {e}")
+            return
+        if not n_bytes:
+            r.failure("Empty stream")
+            return
+        r.success()
+        user.environment.events.request.fire(
+            request_type="POST", name="chat_stream_ttfb", response_time=first,
+            response_length=0, exception=None, context={},
+        )
+
+
+# Throughput vs. number of server worker processes (SERVER_WORKERS); SQL
+# plus mock-LLM streaming, so both the DB pool and CPU-bound work scale.
+# benchmarks/bench_workers.py runs this class against 1..N workers.
+class ScalingUser(StudentUser):
+    wait_time = between(0.05, 0.25)
+
+    @task(3)
+    def sql(self):
+        post_sql(self, SQL_PATH, "sql")
+
+    @task(1)
+    def chat_stream(self):
+        post_chat_stream(self)
@@ -0,0 +1,273 @@
+"""
+Append-only segmented event store, an alternative backend for logger.log_event
+(LOG_BACKEND=segmented).
+
+Records go to time-rotated segment files (one JSON line each); sealed
+segments can be gzip-compressed. A SQLite index maps
+(ts, user, session_id, kind) -> (segment, offset, length), so session and
+time-range lookups read only the matching lines instead of every file.
+
+    python log_store.py migrate --src ./user_data        # import per-user JSONL files
+    python log_store.py query --session <id>             # print matching records
+    python log_store.py query --kind sql --since 2025-01-01T10:00:00Z --out sql.jsonl
+    python log_store.py compress                         # gzip sealed segments
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT NOT NULL UNIQUE,
+    started     REAL NOT NULL,
+    sealed      INTEGER NOT NULL DEFAULT 0,
+    compressed  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS events (
+    ts          TEXT NOT NULL,
+    user        TEXT,
+    session_id  TEXT,
+    kind        TEXT,
+    segment_id  INTEGER NOT NULL,
+    offset      INTEGER NOT NULL,
+    length      INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_user_ts ON events (user, ts);
+CREATE INDEX IF NOT EXISTS events_session ON events (session_id, ts);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+"""
+
+
+class SegmentedLogStore:
+    """
+    One writer per process (the logger's writer thread), any number of
+    readers. Several server workers can share a root: segment names carry the
+    pid and SQLite serializes the index writes.
+    write_batch() takes a list of (record, json_line) pairs.
+    """
+
+    def __init__(self, root, rotate_seconds: float = 3600.0, compress: bool = False):
+        self.root = pathlib.Path(root)
+        self.seg_dir = self.root / "segments"
+        self.seg_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.sqlite"
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        self._db.executescript(_SCHEMA)
+        self._seg = None  # (id, name, started, file)
+
+    def _connect(self):
+        db = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- writing ---
+
+    def write_batch(self, items):
+        with self._lock:
+            seg_id, f = self._current_segment()
+            rows, chunks = [], []
+            offset = f.tell()
+            for record, line in items:
+                data = (line + "\n").encode("utf-8")
+                rows.append((record.get("ts"), record.get("user"), record.get("session_id"),
+                             record.get("kind"), seg_id, offset, len(data) - 1))
+                chunks.append(data)
+                offset += len(data)
+            f.write(b"".join(chunks))
+            f.flush()
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO events (ts, user, session_id, kind, segment_id, offset, length) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _current_segment(self):
+        now = time.time()
+        if self._seg is not None and now - self._seg[2] >= self.rotate_seconds:
+            self._seal_current()
+        if self._seg is None:
+            stamp = datetime.datetime.utcfromtimestamp(now).strftime("%Y%m%dT%H%M%S")
+            name = f"seg-{stamp}-{os.getpid()}.jsonl"
+            with self._db:
+                cur = self._db.execute("INSERT OR IGNORE INTO segments (name, started) VALUES (?, ?)", (name, now))
+                seg_id = cur.lastrowid if cur.rowcount else self._db.execute(
+                    "SELECT id FROM segments WHERE name = ?", (name,)).fetchone()[0]
+            self._seg = (seg_id, name, now, open(self.seg_dir / name, "ab"))
+        return self._seg[0], self._seg[3]
+
+    def _seal_current(self):
+        seg_id, name, _, f = self._seg
+        self._seg = None
+        f.close()
+        with self._db:
+            self._db.execute("UPDATE segments SET sealed = 1 WHERE id = ?", (seg_id,))
+        if self.compress:
+            self._compress(seg_id, name)
+
+    def _compress(self, seg_id, name):
+        src = self.seg_dir / name
+        dst = self.seg_dir / (name + ".gz")
+        with open(src, "rb") as fin, gzip.open(dst, "wb", compresslevel=6) as fout:
+            while chunk := fin.read(1 << 20):
+                fout.write(chunk)
+        with self._db:
+            self._db.execute("UPDATE segments SET compressed = 1 WHERE id = ?", (seg_id,))
+        src.unlink()
+
+    def compress_sealed(self) -> int:
+        """gzip every sealed, not yet compressed segment (e.g. from a cron job)."""
+        with self._lock:
+            todo = self._db.execute("SELECT id, name FROM segments WHERE sealed = 1 AND compressed = 0").fetchall()
+            for seg_id, name in todo:
+                self._compress(seg_id, name)
+        return len(todo)
+
+    def seal(self):
+        with self._lock:
+            if self._seg is not None:
+                self._seal_current()
+
+    def close(self):
+        with self._lock:
+            if self._seg is not None:
+                self._seal_current()
+            self._db.close()
+
+    # --- reading ---
+
+    def query(self, user=None, session_id=None, kind=None, since=None, until=None, limit=None):
+        """
+        Yields records (dicts) in timestamp order. `since`/`until` are ISO
+        strings in the logger's format ("2025-01-01T10:00:00Z"), inclusive/exclusive.
+        """
+        where, args = [], []
+        for col, val in (("user", user), ("session_id", session_id), ("kind", kind)):
+            if val is not None:
+                where.append(f"e.{col} = ?")
+                args.append(val)
+        if since is not None:
+            where.append("e.ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("e.ts < ?")
+            args.append(until)
+        sql = ("SELECT s.name, s.compressed, e.offset, e.length FROM events e "
+               "JOIN segments s ON s.id = e.segment_id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY e.ts, e.rowid"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        db = self._connect()  # own connection: safe to call from any thread
+        try:
+            locs = db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+        opened = {}
+        try:
+            for name, compressed, offset, length in locs:
+                src = opened.get(name)
+                if src is None:
+                    src = opened[name] = self._open_segment(name, compressed)
+                if isinstance(src, bytes):
+                    data = src[offset:offset + length]
+                else:
+                    src.seek(offset)
+                    data = src.read(length)
+                yield json.loads(data)
+        finally:
+            for src in opened.values():
+                if not isinstance(src, bytes):
+                    src.close()
+
+    def _open_segment(self, name, compressed):
+        if not compressed:
+            try:
+                return open(self.seg_dir / name, "rb")
+            except FileNotFoundError:
+                pass  # compressed since we read the index
+        with gzip.open(self.seg_dir / (name + ".gz"), "rb") as g:
+            return g.read()
+
+    def export(self, out, **filters) -> int:
+        """Writes matching records as JSONL to a path or text file object."""
+        close = False
+        if isinstance(out, (str, pathlib.Path)):
+            out, close = open(out, "w", encoding="utf-8"), True
+        n = 0
+        try:
+            for record in self.query(**filters):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                n += 1
+        finally:
+            if close:
+                out.close()
+        return n
+
+    def migrate_jsonl(self, src_dir, batch_size: int = 5000) -> int:
+        """Imports the legacy one-file-per-user JSONL layout (files are left in place)."""
+        n, batch = 0, []
+        for path in sorted(pathlib.Path(src_dir).glob("*.jsonl")):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    batch.append((record, line))
+                    if len(batch) >= batch_size:
+                        self.write_batch(batch)
+                        n += len(batch)
+                        batch = []
+        if batch:
+            self.write_batch(batch)
+            n += len(batch)
+        return n
+
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--root", default=os.getenv("LOG_STORE_DIR", os.path.join(os.getenv("APP_DATA_DIR", "./user_data"), "store")))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate")
+    m.add_argument("--src", default=os.getenv("APP_DATA_DIR", "./user_data"))
+    q = sub.add_parser("query")
+    for opt in ("user", "session", "kind", "since", "until", "out"):
+        q.add_argument(f"--{opt}")
+    q.add_argument("--limit", type=int)
+    sub.add_parser("compress")
+    args = ap.parse_args(argv)
+
+    store = SegmentedLogStore(args.root)
+    try:
+        if args.cmd == "migrate":
+            print(f"migrated {store.migrate_jsonl(args.src)} records into {args.root}")
+        elif args.cmd == "query":
+            filters = dict(user=args.user, session_id=args.session, kind=args.kind,
+                           since=args.since, until=args.until, limit=args.limit)
+            n = store.export(args.out or sys.stdout, **filters)
+            print(f"{n} records", file=sys.stderr)
+        elif args.cmd == "compress":
+            print(f"compressed {store.compress_sealed()} segments")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    _main()
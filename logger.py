@@ -1,9 +1,27 @@
 import os
-import json, uuid, pathlib, asyncio, datetime, re
+import json, uuid, pathlib, asyncio, datetime, re, time
+from collections import OrderedDict
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process only
+    fcntl = None
 
 DATA_DIR = pathlib.Path(os.getenv("APP_DATA_DIR", "./user_data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))          # flush after this many records...
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.2"))  # ...or this many seconds
+LOG_MAX_OPEN_FILES = int(os.getenv("LOG_MAX_OPEN_FILES", "64"))
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+# "jsonl": one file per user in DATA_DIR (default); "segmented": log_store.SegmentedLogStore
+LOG_BACKEND = os.getenv("LOG_BACKEND", "jsonl")
+LOG_STORE_DIR = pathlib.Path(os.getenv("LOG_STORE_DIR", str(DATA_DIR / "store")))
+LOG_ROTATE_SECONDS = float(os.getenv("LOG_ROTATE_SECONDS", "3600"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "").lower() in {"1", "true", "yes"}
+
 _name_re = re.compile(r"[^A-Za-z0-9._-]+")
 
 def _slugify(name: str) -> str:
@@ -18,20 +36,203 @@ def _utc_now():
     # ISO 8601 with 'Z'
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
-async def _append_jsonl(path: pathlib.Path, obj: dict):
+class _JsonlBackend:
+    """
+    The original layout: DATA_DIR/<slug>.jsonl, with an LRU of open handles.
+    Each append holds an exclusive flock, so several server workers can share
+    DATA_DIR without interleaving partial lines.
+    """
+
+    def __init__(self):
+        self._files: OrderedDict = OrderedDict()  # path -> open handle
+
+    def _handle(self, path: pathlib.Path):
+        f = self._files.get(path)
+        if f is not None:
+            self._files.move_to_end(path)
+            return f
+        f = path.open("a", encoding="utf-8")
+        self._files[path] = f
+        while len(self._files) > LOG_MAX_OPEN_FILES:
+            _, old = self._files.popitem(last=False)
+            old.close()
+        return f
+
+    def write_batch(self, items):
+        groups: dict = {}
+        for record, line in items:
+            groups.setdefault(_user_log_path(record.get("user")), []).append(line)
+        for path, lines in groups.items():
+            f = self._handle(path)
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def open_files(self) -> int:
+        return len(self._files)
+
+    def close(self):
+        while self._files:
+            _, f = self._files.popitem()
+            try:
+                f.close()
+            except Exception:
+                pass
+
+def _make_backend():
+    if LOG_BACKEND == "segmented":
+        from log_store import SegmentedLogStore
+        return SegmentedLogStore(LOG_STORE_DIR, rotate_seconds=LOG_ROTATE_SECONDS, compress=LOG_COMPRESS)
+    return _JsonlBackend()
+
+
+_TIMEOUT = object()
+
+
+class _LogWriter:
     """
-    Append 1 line of JSON to the user's file without blocking the event loop.
+    One background task per event loop drains a queue of (record, line) and
+    hands them to the storage backend in batches, each costing a single
+    thread hop.
     """
-    line = json.dumps(obj, ensure_ascii=False)
-    def _write():
-        with path.open("a", encoding="utf-8") as f:
-            f.write(line + "\n")
-    await asyncio.to_thread(_write)
 
-async def log_event(user_name: str, session_id: str, kind: str, payload: dict):
+    def __init__(self):
+        self._loop = None
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._backend = None  # only touched from the writer's thread hops
+        self._stats = dict(records=0, batches=0, flush_seconds_total=0.0,
+                           flush_seconds_max=0.0, last_flush_seconds=0.0, write_errors=0)
+
+    def running_here(self) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return self._task is not None and not self._task.done() and self._loop is loop
+
+    def start(self):
+        """Starts the writer on the running loop (no-op if it already runs there)."""
+        if self.running_here():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=LOG_QUEUE_MAX)
+        self._task = self._loop.create_task(self._run(), name="log-writer")
+
+    async def put(self, record: dict, line: str):
+        # Waits only when the queue is full, which is the backpressure we want
+        await self._queue.put((record, line))
+
+    async def stop(self):
+        """Flushes everything queued so far, then closes the backend."""
+        if self._task is None:
+            return
+        if not self._task.done() and self._loop is asyncio.get_running_loop():
+            await self._queue.put(None)
+            await self._task
+        else:
+            self._task.cancel()
+        self._task = None
+        if self._backend is not None:
+            backend, self._backend = self._backend, None
+            await asyncio.to_thread(backend.close)
+
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+        out["open_files"] = self._backend.open_files() if isinstance(self._backend, _JsonlBackend) else 0
+        out["flush_seconds_avg"] = out["flush_seconds_total"] / out["batches"] if out["batches"] else 0.0
+        return out
+
+    async def _run(self):
+        q = self._queue
+        stopping = False
+        while not stopping:
+            item = await q.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    item = q.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    item = await self._get(q, remaining)
+                    if item is _TIMEOUT:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    @staticmethod
+    async def _get(q: asyncio.Queue, timeout: float):
+        """
+        q.get() with a timeout; _TIMEOUT if nothing came. Not wait_for: on
+        3.11 it can swallow a cancellation that races the timeout, which left
+        the writer running and hung event-loop shutdown. asyncio.wait never
+        cancels for us, so a cancellation always reaches the caller.
+        """
+        getter = asyncio.ensure_future(q.get())
+        try:
+            done, _ = await asyncio.wait((getter,), timeout=timeout)
+        except BaseException:
+            getter.cancel()
+            raise
+        if not done:
+            getter.cancel()  # an item it didn't get yet stays in the queue
+            return _TIMEOUT
+        return getter.result()
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception:
+            self._stats["write_errors"] += 1
+        took = time.perf_counter() - started
+        s = self._stats
+        s["records"] += len(batch)
+        s["batches"] += 1
+        s["flush_seconds_total"] += took
+        s["last_flush_seconds"] = took
+        s["flush_seconds_max"] = max(s["flush_seconds_max"], took)
+        metrics.observe("log_flush_seconds", took, backend=LOG_BACKEND)
+
+    def _write(self, batch):
+        if self._backend is None:
+            self._backend = _make_backend()
+        self._backend.write_batch(batch)
+
+
+_writer = _LogWriter()
+
+async def start_log_writer():
+    _writer.start()
+
+async def stop_log_writer():
+    """Call on shutdown so queued events reach disk."""
+    await _writer.stop()
+
+def log_writer_stats() -> dict:
+    """queue_depth, records/batches written and flush latency."""
+    return _writer.stats()
+
+async def log_event(user_name: str, session_id: str, kind: str, payload: dict, trace_id: str | None = None):
     """
     kind: "login" | "chat_user" | "chat_assistant" | "sql"
     payload: arbitrary fields, we’ll add timestamp/ids.
+    trace_id: defaults to the current request's (metrics.current_trace_id()).
+    Returns once the record is queued; the writer task persists it.
     """
     record = {
         "ts": _utc_now(),
@@ -40,4 +241,10 @@ async def log_event(user_name: str, session_id: str, kind: str, payload: dict):
         "kind": kind,
         **payload,
     }
-    await _append_jsonl(_user_log_path(user_name), record)
+    trace_id = trace_id or metrics.current_trace_id()
+    if trace_id:
+        record["trace_id"] = trace_id
+    _writer.start()
+    started = time.perf_counter()
+    await _writer.put(record, json.dumps(record, ensure_ascii=False))
+    metrics.observe("log_enqueue_seconds", time.perf_counter() - started)
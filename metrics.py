@@ -0,0 +1,176 @@
+"""
+Latency histograms for the hot paths, a Prometheus text rendering of them
+(GET /metrics in server.py) and per-request trace IDs for log records.
+
+    metrics.observe("sql_execute_seconds", elapsed, path="async")
+    with metrics.timed("prompt_build_seconds"):
+        ...
+
+Every histogram is declared in HISTOGRAMS, so a typo fails loudly instead
+of exporting a new series. The *_stats() dicts the modules already keep
+(pools, caches, admission, log writer) are exported as gauges through
+register_stats(). Everything is per process: with SERVER_WORKERS > 1 a
+scrape sees whichever worker answered it.
+
+Trace IDs: server.py gives every HTTP request one (X-Trace-Id, taken from
+the request header if present) and log_event() copies the current one into
+its record; Gradio handlers start one per UI action. TRACE_IDS=0 turns
+them off, METRICS=0 turns observation off.
+"""
+import bisect
+import contextvars
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS", "1").lower() not in {"0", "false", "no"}
+TRACE_IDS = os.getenv("TRACE_IDS", "1").lower() not in {"0", "false", "no"}
+
+# seconds; 0.5ms .. 30s
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HISTOGRAMS = {
+    "http_request_seconds": "FastAPI request latency until the last body byte, by route and status.",
+    "db_pool_wait_seconds": "Time to get a connection from the pool, by pool (sync/async).",
+    "sql_explain_seconds": "Cost-guard EXPLAIN round trips, by path.",
+    "sql_execute_seconds": "cursor.execute for user queries, by path (sync/async).",
+    "sql_fetch_seconds": "Fetching the rows of user queries, by path.",
+    "dataframe_build_seconds": "QueryResult.to_df: building the pandas DataFrame.",
+    "serialize_seconds": "Turning SQL results into JSON-ready rows, by function.",
+    "prompt_build_seconds": "Building the model input, truncation included, by source (history/store).",
+    "prompt_truncate_seconds": "truncate_history alone.",
+    "llm_first_token_seconds": "Upstream streaming call until the first text delta.",
+    "llm_stream_seconds": "Upstream streaming call until the final response.",
+    "llm_request_seconds": "Non-streaming upstream call.",
+    "log_enqueue_seconds": "log_event waiting for room in the writer queue.",
+    "log_flush_seconds": "One log writer batch reaching the backend.",
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label set. Thread-safe."""
+
+    def __init__(self, name: str, help: str, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # sorted label items -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, s in sorted(self.snapshot().items()):
+            base = [f'{k}="{_escape(v)}"' for k, v in key]
+            running = 0
+            for le, n in zip(self.buckets + (math.inf,), s[:-1]):
+                running += n
+                bound = '"+Inf"' if le == math.inf else f'"{le!r}"'
+                lines.append(f"{self.name}_bucket{{{','.join(base + ['le=' + bound])}}} {running}")
+            labels = "{" + ",".join(base) + "}" if base else ""
+            lines.append(f"{self.name}_sum{labels} {s[-1]}")
+            lines.append(f"{self.name}_count{labels} {running}")
+        return lines
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_histograms = {name: Histogram(name, help) for name, help in HISTOGRAMS.items()}
+
+
+def observe(name: str, seconds: float, **labels):
+    if METRICS_ENABLED:
+        _histograms[name].observe(seconds, **labels)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Observes the block's duration, also when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def histogram(name: str) -> Histogram:
+    return _histograms[name]
+
+
+# --- existing stats dicts, exported as gauges ---
+
+_stats_sources = {}  # prefix -> callable returning a (nested) dict of numbers
+_name_re = re.compile(r"[^a-zA-Z0-9_]+")
+
+
+def register_stats(prefix: str, fn):
+    """Exports fn()'s numeric leaves as gauges named app_<prefix>_<key>[_<subkey>...]."""
+    _stats_sources[prefix] = fn
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}_{k}", v, out)
+    elif isinstance(value, (int, float)):  # bools too; strings (modes, names) are skipped
+        out.append((_name_re.sub("_", prefix).lower(), float(value)))
+
+
+def render() -> str:
+    """Everything in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for h in _histograms.values():
+        if h.snapshot():
+            lines += h.render()
+    for prefix, fn in _stats_sources.items():
+        gauges = []
+        try:
+            _flatten(f"app_{prefix}", fn(), gauges)
+        except Exception:
+            continue
+        for name, value in gauges:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value!r}")
+    return "\n".join(lines) + "\n"
+
+
+# --- trace IDs ---
+
+_trace_id: contextvars.ContextVar = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_trace_id() -> str | None:
+    """A fresh ID, or None when TRACE_IDS is off."""
+    return uuid.uuid4().hex[:16] if TRACE_IDS else None
+
+
+def current_trace_id() -> str | None:
+    return _trace_id.get()
+
+
+def set_trace_id(trace_id: str | None):
+    """Sets the current trace ID; returns a token for reset_trace_id."""
+    return _trace_id.set(trace_id)
+
+
+def reset_trace_id(token):
+    _trace_id.reset(token)
@@ -0,0 +1,192 @@
+"""
+Local stand-in for the OpenAI Responses API, for load tests without network
+access or token spend.
+
+In-process (MOCK_OPENAI=1): app.py builds its AsyncOpenAI client with
+make_client(), whose httpx transport answers /v1/responses locally, so
+respond() (streaming) and respond_once() run unchanged.
+
+Out-of-process: `python mock_openai.py --port 8001`, then point the app at it
+with OPENAI_BASE_URL=http://127.0.0.1:8001/v1.
+
+Knobs (env or MockConfig): MOCK_OPENAI_TTFT (s before the first token),
+MOCK_OPENAI_TPS (tokens/s), MOCK_OPENAI_TOKENS (answer length),
+MOCK_OPENAI_ERROR_RATE (fraction of requests answered with HTTP 500),
+MOCK_OPENAI_SEED.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+
+_WORDS = (
+    "SELECT genre , SUM ( worldwide_box_office ) FROM sales GROUP BY genre ORDER BY 2 DESC ; "
+    "You can join metadata and sales on url , but titles are not unique . "
+    "Remember that numeric columns may be stored as text and need a cast ."
+).split()
+
+
+@dataclass
+class MockConfig:
+    ttft: float = field(default_factory=lambda: float(os.getenv("MOCK_OPENAI_TTFT", "0.3")))
+    tokens_per_second: float = field(default_factory=lambda: float(os.getenv("MOCK_OPENAI_TPS", "60")))
+    tokens: int = field(default_factory=lambda: int(os.getenv("MOCK_OPENAI_TOKENS", "200")))
+    error_rate: float = field(default_factory=lambda: float(os.getenv("MOCK_OPENAI_ERROR_RATE", "0")))
+    seed: int | None = field(default_factory=lambda: int(os.environ["MOCK_OPENAI_SEED"]) if os.getenv("MOCK_OPENAI_SEED") else None)
+
+
+class MockResponses:
+    """Builds Responses API payloads and SSE event streams with the configured pacing."""
+
+    def __init__(self, config: MockConfig | None = None):
+        self.config = config or MockConfig()
+        self._rnd = random.Random(self.config.seed)
+
+    def should_fail(self) -> bool:
+        return self._rnd.random() < self.config.error_rate
+
+    def _deltas(self):
+        n = max(1, self.config.tokens)
+        return [("" if i == 0 else " ") + _WORDS[i % len(_WORDS)] for i in range(n)]
+
+    def _response(self, body, text, status):
+        rid = f"resp_mock_{uuid.uuid4().hex[:16]}"
+        output = []
+        if text is not None:
+            output.append(self._message(text, "completed"))
+        return {
+            "id": rid, "object": "response", "created_at": int(time.time()), "status": status,
+            "model": body.get("model", "gpt-4.1"), "output": output,
+            "instructions": body.get("instructions"), "temperature": body.get("temperature"),
+            "tools": body.get("tools", []), "tool_choice": body.get("tool_choice", "auto"),
+            "parallel_tool_calls": body.get("parallel_tool_calls", True),
+            "usage": {"input_tokens": 0, "output_tokens": self.config.tokens, "total_tokens": self.config.tokens},
+        }
+
+    @staticmethod
+    def _message(text, status):
+        return {
+            "id": "msg_mock", "type": "message", "role": "assistant", "status": status,
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }
+
+    async def create(self, body: dict) -> dict:
+        deltas = self._deltas()
+        await asyncio.sleep(self.config.ttft + len(deltas) / max(self.config.tokens_per_second, 1e-9))
+        return self._response(body, "".join(deltas), "completed")
+
+    async def sse(self, body: dict):
+        """Yields encoded SSE frames: created ... output_text.delta* ... completed."""
+        seq = 0
+
+        def frame(event_type, **data):
+            nonlocal seq
+            data = {"type": event_type, "sequence_number": seq, **data}
+            seq += 1
+            return f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode()
+
+        deltas = self._deltas()
+        started = self._response(body, None, "in_progress")
+        yield frame("response.created", response=started)
+        yield frame("response.in_progress", response=started)
+        await asyncio.sleep(self.config.ttft)
+
+        item = self._message("", "in_progress")
+        item["content"] = []
+        yield frame("response.output_item.added", output_index=0, item=item)
+        yield frame("response.content_part.added", output_index=0, content_index=0, item_id="msg_mock",
+                    part={"type": "output_text", "text": "", "annotations": []})
+        gap = 1.0 / max(self.config.tokens_per_second, 1e-9)
+        t0 = time.monotonic()
+        for i, d in enumerate(deltas):
+            yield frame("response.output_text.delta", output_index=0, content_index=0,
+                        item_id="msg_mock", delta=d, logprobs=[])
+            # pace against the wall clock so per-token sleeps don't drift
+            delay = t0 + (i + 1) * gap - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        text = "".join(deltas)
+        yield frame("response.output_text.done", output_index=0, content_index=0,
+                    item_id="msg_mock", text=text, logprobs=[])
+        yield frame("response.content_part.done", output_index=0, content_index=0, item_id="msg_mock",
+                    part={"type": "output_text", "text": text, "annotations": []})
+        yield frame("response.output_item.done", output_index=0, item=self._message(text, "completed"))
+        yield frame("response.completed", response=self._response(body, text, "completed"))
+
+    @staticmethod
+    def error_body():
+        return {"error": {"message": "mock upstream error", "type": "server_error", "code": None}}
+
+
+class _SSEStream(httpx.AsyncByteStream):
+    def __init__(self, agen):
+        self._agen = agen
+
+    async def __aiter__(self):
+        async for chunk in self._agen:
+            yield chunk
+
+    async def aclose(self):
+        await self._agen.aclose()
+
+
+class MockTransport(httpx.AsyncBaseTransport):
+    """httpx transport answering POST .../responses in-process; no sockets involved."""
+
+    def __init__(self, config: MockConfig | None = None):
+        self.mock = MockResponses(config)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "POST" or not request.url.path.endswith("/responses"):
+            return httpx.Response(404, json={"error": {"message": f"mock: no route {request.url.path}"}})
+        body = json.loads(await request.aread() or b"{}")
+        if self.mock.should_fail():
+            return httpx.Response(500, json=self.mock.error_body())
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=_SSEStream(self.mock.sse(body)))
+        return httpx.Response(200, json=await self.mock.create(body))
+
+
+def make_client(config: MockConfig | None = None):
+    """AsyncOpenAI wired to the in-process mock (retries off so error_rate is what you get)."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
+        api_key="mock", base_url="http://mock-openai.local/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=MockTransport(config), timeout=60),
+    )
+
+
+def make_app(config: MockConfig | None = None):
+    """Same mock as a standalone HTTP server (FastAPI), for out-of-process tests."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    mock = MockResponses(config)
+    app = FastAPI()
+
+    @app.post("/v1/responses")
+    async def responses(request: Request):
+        body = await request.json()
+        if mock.should_fail():
+            return JSONResponse(mock.error_body(), status_code=500)
+        if body.get("stream"):
+            return StreamingResponse(mock.sse(body), media_type="text/event-stream")
+        return JSONResponse(await mock.create(body))
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8001)
+    args = ap.parse_args()
+    uvicorn.run(make_app(), host=args.host, port=args.port)
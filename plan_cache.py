@@ -0,0 +1,275 @@
+"""
+Per-connection prepared statements for repeated read queries.
+
+Student traffic is a handful of query shapes over four static tables, sent
+as raw SQL that Postgres parses and plans every time. parameterize() turns
+the literals that are safe to lift out (string literals and integers right
+after a comparison operator, LIKE/ILIKE, LIMIT or OFFSET) into $n
+parameters, so "... WHERE runtime > 150 LIMIT 100" and "... > 120 LIMIT 100"
+share one shape. Once a shape has been seen SQL_PREPARE_THRESHOLD times it
+is PREPAREd on each pooled connection that runs it and EXECUTEd afterwards;
+every connection keeps at most SQL_PLAN_CACHE_SIZE statements (LRU, evicted
+ones are DEALLOCATEd).
+
+Parameters are left untyped, so Postgres infers them from context much as
+it resolves the literals (and generic plans keep comparing numeric columns
+against numeric constants). Two gaps, both checked against the types
+PREPARE inferred: an integer compared with a text column is an error as a
+literal but would quietly become a string comparison as a parameter (the
+shape runs as plain SQL from then on), and an integer too big for the
+inferred parameter type would fail to bind where the literal just compares
+(that call runs as plain SQL). Past those checks EXECUTE behaves like the
+plain query, so its errors (division by zero, a bad cast) are the user's
+and go back to them as they are. The exception is "cached plan must not
+change result type" after a table's columns changed under a SELECT *: the
+statement is dropped, the shape runs as plain SQL from then on, and that
+call runs once more as plain SQL.
+
+A schema change makes prepared statements stale on every connection, so
+invalidate_tables() (called with the result cache's, also for other
+workers' writes) marks the statements reading those tables for DEALLOCATE;
+they are prepared again on next use.
+
+Literals are found with sql_analysis.tokenize, so quoting and comments are
+handled the way Postgres does. Statements with dollar quotes, $n
+placeholders or several statements, and writes, run as plain SQL, and so
+does a shape whose PREPARE ever failed.
+
+Off by default (SQL_PLAN_CACHE=1 to enable): psycopg 3 already prepares
+query texts it sees repeatedly, and on the course tables execution time
+dwarfs planning, so benchmarks/bench_plan_cache.py shows no gain there. It
+pays off with bigger schemas and join-heavy queries, where planning is the
+larger share.
+"""
+import hashlib
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from sql_analysis import analyze, tokenize
+
+PLAN_CACHE_ENABLED = os.getenv("SQL_PLAN_CACHE", "0").lower() not in {"0", "false", "no"}
+PLAN_CACHE_SIZE = int(os.getenv("SQL_PLAN_CACHE_SIZE", "64"))          # statements per connection
+PREPARE_THRESHOLD = int(os.getenv("SQL_PREPARE_THRESHOLD", "2"))       # sightings before a shape is prepared
+
+_READ_FIRST = {"SELECT", "WITH", "VALUES", "TABLE"}
+_PARAM_AFTER = {"=", "<>", "!=", "<", ">", "<=", ">=", "LIKE", "ILIKE", "LIMIT", "OFFSET"}
+_INT8_MAX = 2**63 - 1
+# what an integer literal's parameter may be inferred as
+_NUMERIC_TYPES = {"smallint", "integer", "bigint", "numeric", "real", "double precision", "oid"}
+# largest integer literal each type binds; the others take any
+_INT_MAX = {"smallint": 2**15 - 1, "integer": 2**31 - 1, "bigint": _INT8_MAX, "oid": 2**32 - 1}
+
+_instances = itertools.count(1)
+
+# fetches the inferred types after PREPARE; takes the statement name
+PARAM_TYPES_SQL = "SELECT parameter_types::text[] FROM pg_prepared_statements WHERE name = %s"
+
+
+def parameterize(sql: str):
+    """
+    (shape, literals) for a single read statement, or None when it can't be
+    done safely. `literals` are the original literal texts, in $n order, so
+    EXECUTE gets exactly what the user wrote.
+    """
+    out, literals = [], []
+    last = None       # previous token: uppercased word, operator/punctuation, or kind
+    first = None
+    prev_end = None
+    for t in tokenize(sql):
+        kind, text = t.kind, t.text
+        if kind in ("param", "dollar", "error") or text == ";":
+            return None
+        if prev_end is not None and t.start != prev_end:
+            out.append(" ")  # whitespace and comments
+        prev_end = t.end
+        lift = last in _PARAM_AFTER and (
+            (kind == "string" and text.startswith("'"))   # not E'', B'', U&'' ...
+            or (kind == "number" and text.isdigit() and int(text) <= _INT8_MAX))
+        if lift:
+            literals.append(text)
+            out.append(f"${len(literals)}")
+        else:
+            out.append(text)
+        if kind == "word":
+            last = text.upper()
+            first = first or last
+        else:
+            last = text if kind in ("op", "punct") else kind
+    if first not in _READ_FIRST:
+        return None
+    return "".join(out), literals
+
+
+def _fits(literal: str, type_name: str) -> bool:
+    """Whether EXECUTE can bind `literal` as a `type_name` parameter."""
+    if literal.startswith("'"):
+        return True  # parsed as that type, exactly like the plain literal
+    return type_name in _NUMERIC_TYPES and int(literal) <= _INT_MAX.get(type_name, _INT8_MAX)
+
+
+def literals_fit(literals, param_types) -> bool:
+    return param_types is not None and all(_fits(lit, t) for lit, t in zip(literals, param_types))
+
+
+@dataclass
+class Plan:
+    """
+    What to send for one query. When `prepare` is set: run it, then
+    PARAM_TYPES_SQL with `name`, and go on only if PlanCache.prepared()
+    says so; then `execute`. `deallocate` lists statements evicted from this
+    connection or made stale by invalidate_tables(); send those first.
+    """
+    shape: str
+    name: str
+    execute: str
+    literals: list
+    prepare: str | None = None
+    deallocate: list = field(default_factory=list)
+
+    def types_ok(self, param_types) -> bool:
+        """Whether the shape can be parameterized: integer literals got numeric parameters."""
+        return all(t in _NUMERIC_TYPES for lit, t in zip(self.literals, param_types or ())
+                   if not lit.startswith("'"))
+
+
+class PlanCache:
+    """
+    Which shapes are prepared on which connection. Connections are weak keys,
+    so a connection closed by the pool takes its entries with it.
+    Thread-safe: the psycopg2 path calls in from worker threads.
+    """
+
+    def __init__(self, size: int = PLAN_CACHE_SIZE, threshold: int = PREPARE_THRESHOLD,
+                 enabled: bool = PLAN_CACHE_ENABLED):
+        self.size = max(1, size)
+        self.threshold = max(1, threshold)
+        self.enabled = enabled
+        # statement name prefix; another PlanCache on the same (pooled) connections can't collide
+        self._prefix = f"sqltab{next(_instances)}_"
+        self._lock = threading.Lock()
+        self._conns = weakref.WeakKeyDictionary()   # conn -> OrderedDict(shape -> [name, param types, tables])
+        self._stale = weakref.WeakKeyDictionary()   # conn -> statement names to DEALLOCATE
+        self._seen: OrderedDict = OrderedDict()      # shape -> sightings (bounded)
+        self._bad: OrderedDict = OrderedDict()       # shapes that failed once; run raw (bounded)
+        self._stats = dict(lookups=0, hits=0, prepares=0, cold=0, unparameterizable=0,
+                           unfit=0, evictions=0, failures=0, lost=0, invalidated=0)
+
+    def plan(self, conn, sql: str) -> Plan | None:
+        """A Plan for `sql` on `conn`, or None to run it as plain SQL."""
+        if not self.enabled:
+            return None
+        parsed = parameterize(sql)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if parsed is None:
+                self._stats["unparameterizable"] += 1
+                return None
+            shape, literals = parsed
+            if shape in self._bad:
+                self._stats["unparameterizable"] += 1
+                return None
+            name = self._prefix + hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+            execute = f"EXECUTE {name}" + (f" ({', '.join(literals)})" if literals else "")
+            stmts = self._conns.get(conn)
+            if stmts is not None and shape in stmts:
+                stmts.move_to_end(shape)
+                if not literals_fit(literals, stmts[shape][1]):
+                    self._stats["unfit"] += 1
+                    return None
+                self._stats["hits"] += 1
+                return Plan(shape, name, execute, literals, deallocate=self._stale.pop(conn, []))
+
+            seen = self._seen.get(shape, 0) + 1
+            self._seen[shape] = seen
+            self._seen.move_to_end(shape)
+            while len(self._seen) > 16 * self.size:
+                self._seen.popitem(last=False)
+            if seen < self.threshold:
+                self._stats["cold"] += 1
+                return None
+
+            if stmts is None:
+                stmts = self._conns[conn] = OrderedDict()
+            stmts[shape] = [name, None, analyze(sql).tables]  # types come with prepared()
+            evicted = []
+            while len(stmts) > self.size:
+                _, (old, _, _) = stmts.popitem(last=False)
+                evicted.append(old)
+            self._stats["prepares"] += 1
+            self._stats["evictions"] += len(evicted)
+            return Plan(shape, name, execute, literals, prepare=f"PREPARE {name} AS {shape}",
+                        deallocate=self._stale.pop(conn, []) + evicted)
+
+    def prepared(self, conn, plan: Plan, param_types) -> bool:
+        """
+        Records the parameter types PREPARE inferred for `plan`. False when
+        this call has to run as plain SQL: the shape can't be parameterized
+        (it is marked failed) or one of its literals doesn't fit.
+        """
+        if not plan.types_ok(param_types):
+            self.failed(conn, plan)
+            return False
+        with self._lock:
+            stmts = self._conns.get(conn)
+            if stmts is not None and plan.shape in stmts:
+                stmts[plan.shape][1] = tuple(param_types or ())
+            if literals_fit(plan.literals, param_types or ()):
+                return True
+            self._stats["unfit"] += 1
+            return False
+
+    def lost(self, conn, plan: Plan):
+        """The statement is gone from the session (DEALLOCATE ALL, ...): prepare it again next time."""
+        with self._lock:
+            self._stats["lost"] += 1
+            stmts = self._conns.get(conn)
+            if stmts is not None:
+                stmts.pop(plan.shape, None)
+
+    def invalidate_tables(self, tables):
+        """
+        A write changed `tables` (all of them if empty): statements reading
+        them are DEALLOCATEd on their connection's next plan and prepared
+        again. Plans on other connections go stale too, hence all of them.
+        """
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            for conn, stmts in list(self._conns.items()):
+                drop = [shape for shape, (_, _, read) in stmts.items()
+                        if not tables or not read or read & tables]
+                if drop:
+                    stale = self._stale.setdefault(conn, [])
+                    for shape in drop:
+                        stale.append(stmts.pop(shape)[0])
+                    self._stats["invalidated"] += len(drop)
+
+    def failed(self, conn, plan: Plan):
+        """
+        PREPARE or EXECUTE raised in a way the plain query wouldn't, or the
+        parameter types were off: stop parameterizing that shape. A statement
+        that did get prepared is DEALLOCATEd with the connection's next plan.
+        """
+        with self._lock:
+            self._stats["failures"] += 1
+            self._bad[plan.shape] = True
+            while len(self._bad) > 16 * self.size:
+                self._bad.popitem(last=False)
+            stmts = self._conns.get(conn)
+            if stmts is not None and stmts.pop(plan.shape, None) is not None:
+                self._stale.setdefault(conn, []).append(plan.name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["connections"] = len(self._conns)
+            out["statements"] = sum(len(s) for s in self._conns.values())
+        executed = out["hits"] + out["prepares"]
+        out["hit_rate"] = out["hits"] / executed if executed else 0.0
+        return out
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,285 @@
+"""
+Trace-replay load generator: plays the recorded student sessions from the
+log_event records back against a running server, with their real
+inter-arrival times and query mix (locustfile.py is the synthetic one).
+
+    python replay.py --logs ./user_data --host http://127.0.0.1:7860 --speedup 20
+    python replay.py --store ./user_data/store --since 2025-03-01T08:00:00Z --anonymize --out replay.json
+    python replay.py --logs ./user_data --dry-run          # just describe the trace
+
+Events are grouped by session_id. Each session starts at its recorded
+offset from the first session, divided by --speedup, and sends its events
+in order, waiting for each answer before the next. Gaps are replayed
+scaled too, after capping them at --max-gap seconds so a student who left
+for lunch doesn't stall the run.
+  sql        -> POST /e2e/sql with the logged query and row_limit
+  chat_user  -> POST /e2e/chat (or /e2e/chat/stream with --stream) with the
+                session's logged turns as history. --chat-history store
+                leaves the history server-side (conversation_store), which
+                only works against a single-worker server
+  login etc. -> not sent (no HTTP endpoint), they only mark the session
+
+--anonymize replaces user names and session ids with salted hashes; queries
+and chat text are sent as recorded. The report gives latency percentiles
+per event kind, HTTP errors and 429s (admission control) separately, and
+how far behind schedule the generator ran ("lag"). A big lag means the
+server, or this client, couldn't keep up at that speed-up. For raw capacity
+runs, start the server with ADMIT_CHAT_RATE=0 ADMIT_SQL_RATE=0 and, unless
+you mean to spend tokens, MOCK_OPENAI=1.
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+import pathlib
+import secrets
+import sys
+import time
+from collections import defaultdict
+
+REPLAYED = {"sql", "chat_user"}
+
+
+def _parse_ts(ts: str) -> float:
+    return datetime.datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def read_jsonl_dir(path) -> list[dict]:
+    """Every record in the logger's per-user files (LOG_BACKEND=jsonl)."""
+    out = []
+    for f in sorted(pathlib.Path(path).glob("*.jsonl")):
+        with f.open(encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    out.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # a line cut short by a crash
+    return out
+
+
+def read_store(path, since=None, until=None) -> list[dict]:
+    """Records from a log_store.SegmentedLogStore root (LOG_BACKEND=segmented)."""
+    from log_store import SegmentedLogStore
+    store = SegmentedLogStore(path)
+    try:
+        return list(store.query(since=since, until=until))
+    finally:
+        store.close()
+
+
+class Session:
+    __slots__ = ("user", "session_id", "events")
+
+    def __init__(self, user, session_id):
+        self.user = user
+        self.session_id = session_id
+        self.events = []  # (ts seconds, record)
+
+
+def build_sessions(records, since=None, until=None, kinds=REPLAYED, max_sessions=None) -> list[Session]:
+    sessions = {}
+    for r in records:
+        ts, sid = r.get("ts"), r.get("session_id")
+        if not ts or not sid or (since and ts < since) or (until and ts >= until):
+            continue
+        s = sessions.get(sid)
+        if s is None:
+            s = sessions[sid] = Session(r.get("user"), sid)
+        s.events.append((_parse_ts(ts), r))
+    out = []
+    for s in sessions.values():
+        s.events.sort(key=lambda e: e[0])  # stable: same-second records keep file order
+        if any(r.get("kind") in kinds for _, r in s.events):
+            out.append(s)
+    out.sort(key=lambda s: s.events[0][0])
+    return out[:max_sessions] if max_sessions else out
+
+
+def anonymizer(salt: str):
+    def anon(prefix, value):
+        if value is None:
+            return None
+        return f"{prefix}-{hashlib.sha256((salt + ':' + str(value)).encode()).hexdigest()[:12]}"
+    return anon
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p * len(sorted_values) / 100) - 1))
+    return sorted_values[k]
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)   # kind -> seconds
+        self.ttfb = defaultdict(list)      # streamed kinds -> seconds to the first chunk
+        self.lag = []                      # seconds behind schedule when sending
+        self.status = defaultdict(lambda: defaultdict(int))  # kind -> status -> count
+
+    def report(self, wall: float) -> dict:
+        def pct(values):
+            v = sorted(values)
+            return {f"p{p}": round(1000 * percentile(v, p), 1) for p in (50, 90, 95, 99)} | {
+                "max": round(1000 * v[-1], 1), "mean": round(1000 * sum(v) / len(v), 1)} if v else {}
+        out = {"wall_seconds": round(wall, 1), "kinds": {}, "lag_ms": pct(self.lag)}
+        for kind in sorted(self.status):
+            ok = self.latency.get(kind, [])
+            statuses = dict(self.status[kind])
+            sent = sum(statuses.values())
+            out["kinds"][kind] = {
+                "sent": sent,
+                "ok": statuses.get(200, 0),
+                "rejected_429": statuses.get(429, 0),
+                "errors": sent - statuses.get(200, 0) - statuses.get(429, 0),
+                "rate_per_s": round(sent / wall, 2) if wall else None,
+                "latency_ms": pct(ok),
+            }
+            if self.ttfb.get(kind):
+                out["kinds"][kind]["ttfb_ms"] = pct(self.ttfb[kind])
+        return out
+
+
+async def replay_session(client, s: Session, t0: float, started: float, args, anon, rec: Recorder, sem):
+    user = anon("user", s.user) if anon else s.user
+    sid = anon("session", s.session_id) if anon else s.session_id
+    history = []           # for --chat-history replay
+    last_ts = None
+    due = started + (s.events[0][0] - t0) / args.speedup
+    for ts, r in s.events:
+        kind = r.get("kind")
+        if last_ts is not None:
+            due += min(ts - last_ts, args.max_gap) / args.speedup
+        last_ts = ts
+        if kind == "chat_assistant":
+            history.append({"role": "assistant", "content": r.get("text", "")})
+            continue
+        if kind not in args.kinds:
+            continue
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        rec.lag.append(max(0.0, -delay))
+
+        if kind == "sql":
+            path, name = "/e2e/sql", "sql"
+            body = {"query": r.get("query", ""), "limit": int(r.get("row_limit") or 200),
+                    "user_name": user, "session_id": sid}
+        else:
+            text = r.get("text", "")
+            path, name = ("/e2e/chat/stream", "chat_stream") if args.stream else ("/e2e/chat", "chat")
+            body = {"message": text, "user_name": user, "session_id": sid}
+            if args.chat_history == "replay":
+                body["history"] = list(history)
+            history.append({"role": "user", "content": text})
+
+        async with sem:
+            t = time.perf_counter()
+            try:
+                if args.stream and name == "chat_stream":
+                    async with client.stream("POST", path, json=body) as resp:
+                        first = None
+                        async for _ in resp.aiter_raw():
+                            if first is None:
+                                first = time.perf_counter() - t
+                        status = resp.status_code
+                    if status == 200 and first is not None:
+                        rec.ttfb[name].append(first)
+                else:
+                    resp = await client.post(path, json=body)
+                    status = resp.status_code
+            except Exception as e:
+                status = type(e).__name__
+            took = time.perf_counter() - t
+        rec.status[name][status] += 1
+        if status == 200:
+            rec.latency[name].append(took)
+
+
+async def run(sessions, args):
+    import httpx
+    anon = anonymizer(args.salt or secrets.token_hex(8)) if args.anonymize else None
+    rec = Recorder()
+    sem = asyncio.Semaphore(args.max_concurrency)
+    t0 = sessions[0].events[0][0]
+    limits = httpx.Limits(max_connections=args.max_concurrency, max_keepalive_connections=args.max_concurrency)
+    async with httpx.AsyncClient(base_url=args.host, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(replay_session(client, s, t0, started, args, anon, rec, sem) for s in sessions))
+        wall = time.perf_counter() - started
+    return rec.report(wall)
+
+
+def describe(sessions, args) -> dict:
+    counts = defaultdict(int)
+    for s in sessions:
+        for _, r in s.events:
+            counts[r.get("kind")] += 1
+    span = sessions[-1].events[0][0] - sessions[0].events[0][0] if sessions else 0
+    longest = max((s.events[-1][0] - s.events[0][0] for s in sessions), default=0)
+    return {"sessions": len(sessions), "users": len({s.user for s in sessions}), "events": dict(counts),
+            "trace_seconds": span + longest, "replay_seconds_at_most": round((span + longest) / args.speedup, 1)}
+
+
+def print_report(report):
+    print(f"\nwall {report['wall_seconds']}s, lag p95 {report['lag_ms'].get('p95')}ms max {report['lag_ms'].get('max')}ms")
+    print(f"{'kind':12} {'sent':>6} {'ok':>6} {'429':>5} {'err':>5} {'req/s':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for kind, k in report["kinds"].items():
+        lat = k["latency_ms"]
+        print(f"{kind:12} {k['sent']:6} {k['ok']:6} {k['rejected_429']:5} {k['errors']:5} {k['rate_per_s'] or 0:7.2f} "
+              + " ".join(f"{lat.get(p, float('nan')):8.1f}" for p in ("p50", "p90", "p95", "p99", "max")))
+        if "ttfb_ms" in k:
+            t = k["ttfb_ms"]
+            print(f"{'  ttfb':12} {'':6} {'':6} {'':5} {'':5} {'':7} "
+                  + " ".join(f"{t.get(p, float('nan')):8.1f}" for p in ("p50", "p90", "p95", "p99", "max")))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--logs", help="directory of per-user .jsonl files (LOG_BACKEND=jsonl)")
+    src.add_argument("--store", help="log_store root (LOG_BACKEND=segmented)")
+    ap.add_argument("--host", default="http://127.0.0.1:7860")
+    ap.add_argument("--speedup", type=float, default=1.0, help="replay this many times faster than recorded")
+    ap.add_argument("--max-gap", type=float, default=300.0, help="cap on a recorded gap, in seconds, before the speed-up")
+    ap.add_argument("--since", help="first record to use, e.g. 2025-03-01T08:00:00Z")
+    ap.add_argument("--until")
+    ap.add_argument("--kinds", default="sql,chat_user", help="event kinds to send (sql, chat_user)")
+    ap.add_argument("--max-sessions", type=int)
+    ap.add_argument("--stream", action="store_true", help="chat over /e2e/chat/stream, also reports time to first byte")
+    ap.add_argument("--chat-history", choices=("store", "replay"), default="replay",
+                    help="replay: resend the logged turns; store: server keeps the history (single worker only)")
+    ap.add_argument("--anonymize", action="store_true", help="hash user names and session ids")
+    ap.add_argument("--salt", help="fixed salt for --anonymize (random per run by default)")
+    ap.add_argument("--max-concurrency", type=int, default=256, help="requests in flight at once")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", help="write the report as JSON here")
+    ap.add_argument("--dry-run", action="store_true", help="describe the trace without sending anything")
+    args = ap.parse_args(argv)
+    args.kinds = {k.strip() for k in args.kinds.split(",") if k.strip()}
+    if args.speedup <= 0:
+        ap.error("--speedup must be positive")
+
+    records = read_jsonl_dir(args.logs) if args.logs else read_store(args.store, args.since, args.until)
+    sessions = build_sessions(records, args.since, args.until, args.kinds, args.max_sessions)
+    info = describe(sessions, args)
+    print(json.dumps(info), file=sys.stderr)
+    if args.dry_run or not sessions:
+        return 0
+
+    report = dict(trace=info, speedup=args.speedup, **asyncio.run(run(sessions, args)))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
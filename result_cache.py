@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Thread-safe LRU with a TTL and a byte budget. Entries remember the tables
+    they were read from so a write can drop just the affected results.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0, max_bytes: int = 64 << 20):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data: OrderedDict = OrderedDict()  # key -> (expires, nbytes, tables, value)
+        self._bytes = 0
+        self._stats = dict(hits=0, misses=0, stores=0, evictions=0, expirations=0, invalidations=0)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            if item[0] < time.monotonic():
+                self._drop(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return item[3]
+
+    def put(self, key, value, nbytes: int, tables=()):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, nbytes, frozenset(tables), value)
+            self._bytes += nbytes
+            self._stats["stores"] += 1
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._data)))
+                self._stats["evictions"] += 1
+
+    def invalidate_tables(self, tables) -> int:
+        """Drops every entry that read from any of `tables`; an empty set clears everything."""
+        tables = {t.lower() for t in tables}
+        with self._lock:
+            if not tables:
+                keys = list(self._data)
+            else:
+                keys = [k for k, item in self._data.items() if item[2] & tables or not item[2]]
+            for k in keys:
+                self._drop(k)
+            self._stats["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        self.invalidate_tables(())
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out.update(entries=len(self._data), bytes=self._bytes)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+    def _drop(self, key):
+        item = self._data.pop(key)
+        self._bytes -= item[1]
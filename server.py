@@ -1,20 +1,163 @@
-from fastapi import FastAPI
+import startup
+from fastapi import FastAPI, Request
 from pydantic import BaseModel
-import gradio as gr
+from typing import Literal
 import uvicorn
+startup.mark("fastapi")
+import gradio as gr
+startup.mark("gradio")
 
-from gradio_app import demo, respond_once
-from sql_tab import run_sql
+from gradio_app import demo, respond_once, chat_turn, get_client
+startup.mark("ui")
+from sql_tab import (run_sql, execute_async, stream_sql_async, close_async_pool, start_cache_listener,
+                    stop_cache_listener, warm_pools, pool_stats, cache_stats, plan_cache_stats, cost_guard_stats)
+from chat_helpers import preload as preload_tokenizer
+from logger import start_log_writer, stop_log_writer, log_writer_stats
+from sql_json import rows_to_records, rows_to_columnar
+from admission import admit, Rejected, admission_stats
+from llm_cache import response_cache
+from conversation_store import conversations, CHAT_STORE, CHAT_STORE_REQUESTED
+import metrics
+from diagnostics import diagnostics, Preview
+from deployment import WORKERS
+import orjson
 
-import math, uuid, decimal, datetime as dt
+import math, os, re, uuid, decimal, time, datetime as dt
 import numpy as np
 import pandas as pd
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.routing import APIRoute
 
 import traceback, sys, logging
+import asyncio
+from contextlib import asynccontextmanager
 log = logging.getLogger("uvicorn.error")
+startup.mark("app modules")
+
+async def _prime_queries():
+    for q in startup.read_queries(startup.WARMUP_QUERIES):
+        _, meta, _ = await execute_async(q, startup.WARMUP_ROW_LIMIT, False)
+        if meta.startswith("Error"):
+            log.warning("warm-up query %r: %s", q[:80], meta)
+
+def _warmup_steps():
+    steps = [
+        ("db_pool", lambda: warm_pools(sync=startup.WARMUP_SYNC_POOL)),
+        ("openai_client", lambda: asyncio.to_thread(get_client)),
+        ("tokenizer", lambda: asyncio.to_thread(preload_tokenizer)),
+    ]
+    if startup.WARMUP_QUERIES:
+        steps.append(("hot_queries", _prime_queries))
+    return steps
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await start_log_writer()
+    await start_cache_listener()
+    # in the background: the worker takes traffic meanwhile, /healthz says when it's warm
+    warming = asyncio.create_task(startup.warmup.run(_warmup_steps()), name="warm-up")
+    yield
+    warming.cancel()
+    await conversations.close()
+    await stop_cache_listener()
+    await stop_log_writer()
+    await close_async_pool()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+_trace_header_re = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+class TraceMiddleware:
+    """
+    Gives each HTTP request a trace ID (the client's X-Trace-Id if it looks
+    sane), visible to log_event for the whole request, stream included, and
+    echoed back in the response. Also times the request into
+    http_request_seconds, by API route ("other" for Gradio and unknown paths).
+    Plain ASGI rather than BaseHTTPMiddleware so streaming bodies aren't buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, path: str) -> str:
+        if self._routes is None:
+            self._routes = {r.path for r in app.routes if isinstance(r, APIRoute)}
+        return path if path in self._routes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-trace-id":
+                value = value.decode("latin-1")
+                trace_id = value if _trace_header_re.fullmatch(value) else None
+                break
+        trace_id = trace_id or metrics.new_trace_id()
+        token = metrics.set_trace_id(trace_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace_id:
+                    message["headers"] = [*message.get("headers", ()), (b"x-trace-id", trace_id.encode())]
+            await send(message)
 
-app = FastAPI(default_response_class=ORJSONResponse)
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            metrics.observe("http_request_seconds", time.perf_counter() - started,
+                            route=self._route(scope["path"]), status=str(status))
+            metrics.reset_trace_id(token)
+
+app.add_middleware(TraceMiddleware)
+
+metrics.register_stats("admission", admission_stats)
+metrics.register_stats("sql_pool", pool_stats)
+metrics.register_stats("sql_cache", cache_stats)
+metrics.register_stats("sql_plan_cache", plan_cache_stats)
+metrics.register_stats("sql_cost_guard", cost_guard_stats)
+metrics.register_stats("log_writer", log_writer_stats)
+metrics.register_stats("llm_cache", response_cache.stats)
+metrics.register_stats("diagnostics", lambda: diagnostics.stats)
+metrics.register_stats("chat_store", conversations.stats)
+
+@app.exception_handler(Rejected)
+async def rejected_handler(_request: Request, exc: Rejected):
+    return ORJSONResponse(
+        {"error": str(exc), "reason": exc.reason},
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+async def _admitted_stream(kind, user_name, session_id, body):
+    """
+    Runs the async iterator from `body()` under admit() and pulls its first
+    chunk before the response starts, so a rejection is still a plain 429.
+    """
+    async def guarded():
+        async with admit(kind, user_name, session_id):
+            async for chunk in body():
+                yield chunk
+
+    gen = guarded()
+    try:
+        first = await gen.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def chunks():
+        if first is not None:
+            yield first
+            async for chunk in gen:
+                yield chunk
+
+    return chunks()
 
 def df_json_safe(df: pd.DataFrame) -> list[dict]:
     # 1) kill Infs -> NaN
@@ -72,55 +215,205 @@ def df_json_safe(df: pd.DataFrame) -> list[dict]:
 
 class ChatReq(BaseModel):
     message: str
-    history: list[dict] = []
+    # None (left out) together with a session_id: the server keeps the history (conversation_store).
+    # Single worker only; with SERVER_WORKERS > 1 the client has to send it every turn.
+    history: list[dict] | None = None
+    # admission control keys (per-user rate limits)
+    user_name: str | None = None
+    session_id: str | None = None
 
 class SqlReq(BaseModel):
     query: str
     limit: int = 200
     allow_writes: bool = False
+    shape: Literal["records", "columns"] = "records"
+    user_name: str | None = None
+    session_id: str | None = None
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True}
+    """Readiness: 503 until the warm-up has run (see startup.py), then 200; the body has the timings."""
+    return ORJSONResponse({"ok": startup.warmup.ready, **startup.warmup.report()},
+                          status_code=200 if startup.warmup.ready else 503)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text format; this worker's numbers only (see metrics.py)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def _conversation(req: ChatReq):
+    """The session's server-side conversation if the client sent a session_id and no history."""
+    if CHAT_STORE and req.history is None and req.session_id and "session_id" in req.model_fields_set:
+        return await conversations.get(req.session_id)
+    return None
 
 @app.post("/e2e/chat")
 async def e2e_chat(req: ChatReq):
-    text = await respond_once(req.message, req.history)
+    conversation = await _conversation(req)
+    async with admit("chat", req.user_name, req.session_id):
+        text = await respond_once(req.message, req.history or [], conversation)
+    if conversation is not None:
+        conversation.add_turn(req.message, text)
     return {"output": text}
 
-@app.post("/e2e/sql")
-def e2e_sql(req: SqlReq):
-    try:
-        df, meta, elapsed = run_sql(req.query, req.limit, req.allow_writes)
+class ChatStreamReq(ChatReq):
+    # defaults for the log records; admission only sees what the client sent
+    user_name: str = "e2e"
+    session_id: str = "e2e"
+
+@app.post("/e2e/chat/stream")
+async def e2e_chat_stream(req: ChatStreamReq):
+    """
+    Drives the same streaming path as the Gradio chat tab (chat_turn ->
+    respond -> responses.stream) and forwards the new text of each chunk.
+    """
+    conversation = await _conversation(req)
+
+    async def chunks():
+        sent = 0
+        async for history, _ in chat_turn(req.message, req.history, req.user_name, req.session_id, conversation):
+            text = history[-1]["content"]
+            if len(text) > sent:
+                yield text[sent:]
+                sent = len(text)
 
+    sent = req.model_fields_set
+    body = await _admitted_stream("chat", req.user_name if "user_name" in sent else None,
+                                  req.session_id if "session_id" in sent else None, chunks)
+    return StreamingResponse(body, media_type="text/plain; charset=utf-8")
+
+def _elapsed_json(elapsed):
+    return float(elapsed) if elapsed == elapsed and not math.isinf(elapsed) else None
+
+def _sql_response(df, meta, elapsed):
+    head = None
+    try:
         # Take only head for safety
         head = df.head(min(len(df), 200))
 
-        # Log raw DF preview (before cleaning)
-        log.error("DEBUG DF (raw):\n%s", head.to_string())
-
-        rows = df_json_safe(head)
+        with metrics.timed("serialize_seconds", fn="df_json_safe"):
+            rows = df_json_safe(head)
         payload = {
             "meta": str(meta),
-            "elapsed": float(elapsed) if elapsed == elapsed and not math.isinf(elapsed) else None,
+            "elapsed": _elapsed_json(elapsed),
             "n": int(len(df)),
             "rows": rows,
         }
 
+        # raw rows, before cleaning; only formatted if this request is sampled or slow
+        diagnostics.result("/e2e/sql/sync", elapsed, Preview(df=head))
         return ORJSONResponse(payload, headers={"X-Serializer": "orjson"})
     except Exception as e:
         # Log script name + stack + dataframe if available
-        log.error("Exception in %s", __file__)
+        log.error("Exception in %s: %r", __file__, e)
+        traceback.print_exc(file=sys.stderr)
+        try:
+            diagnostics.error("/e2e/sql/sync", Preview(df=head if head is not None else df))
+        except Exception:
+            pass
+        raise
+
+@app.post("/e2e/sql")
+async def e2e_sql(req: SqlReq):
+    """
+    Tuple rows from the cursor go straight to JSON (no DataFrame). shape="columns"
+    returns {"columns": [...], "data": [[...]]} instead of a list of records.
+    """
+    async with admit("sql", req.user_name, req.session_id):
+        result, meta, elapsed = await execute_async(req.query, req.limit, req.allow_writes)
+    head = None
+    try:
+        # Take only head for safety
+        head = result.rows[:200]
+        payload = {"meta": str(meta), "elapsed": _elapsed_json(elapsed), "n": len(result)}
+        if req.shape == "columns":
+            with metrics.timed("serialize_seconds", fn="rows_to_columnar"):
+                payload.update(rows_to_columnar(result.columns, result.type_oids, head))
+        else:
+            with metrics.timed("serialize_seconds", fn="rows_to_records"):
+                payload["rows"] = rows_to_records(result.columns, result.type_oids, head)
+        diagnostics.result("/e2e/sql", elapsed, Preview(columns=result.columns, rows=head))
+        return ORJSONResponse(payload, headers={"X-Serializer": "orjson"})
+    except Exception as e:
+        # Log script name + stack + rows if available
+        log.error("Exception in %s: %r", __file__, e)
         traceback.print_exc(file=sys.stderr)
         try:
-            log.error("Last DF snapshot:\n%s", head.to_string())
+            diagnostics.error("/e2e/sql", Preview(columns=result.columns, rows=head if head is not None else result.rows))
         except Exception:
             pass
         raise
 
-# Mount Gradio UI on "/"
-mounted = gr.mount_gradio_app(app, demo, path="/")
+class SqlStreamReq(BaseModel):
+    query: str
+    max_rows: int | None = None
+    batch_size: int = 500
+    shape: Literal["records", "columns"] = "columns"
+    user_name: str | None = None
+    session_id: str | None = None
+
+@app.post("/e2e/sql/stream")
+async def e2e_sql_stream(req: SqlStreamReq):
+    """
+    Chunked NDJSON from a server-side cursor: a {"columns": [...]} header, one
+    line per row (array, or object for shape="records"), then a {"meta": ...}
+    trailer or an {"error": ...} line. Memory per request is one batch.
+    """
+    async def lines():
+        n = 0
+        started = time.perf_counter()
+        header_sent = False
+        try:
+            async for batch in stream_sql_async(req.query, max(1, req.batch_size), req.max_rows):
+                if not header_sent:
+                    yield orjson.dumps({"columns": batch.columns}) + b"\n"
+                    header_sent = True
+                    cols = batch.columns
+                if req.shape == "records":
+                    chunk = rows_to_records(cols, batch.type_oids, batch.rows)
+                else:
+                    chunk = rows_to_columnar(cols, batch.type_oids, batch.rows)["data"]
+                n += len(chunk)
+                yield b"".join(orjson.dumps(r) + b"\n" for r in chunk)
+        except Exception as e:
+            yield orjson.dumps({"error": str(e)}) + b"\n"
+            return
+        if not header_sent:
+            yield orjson.dumps({"columns": []}) + b"\n"
+        elapsed = time.perf_counter() - started
+        yield orjson.dumps({"meta": f"Rows: {n} | Time: {elapsed:.3f}s", "n": n}) + b"\n"
+
+    body = await _admitted_stream("sql", req.user_name, req.session_id, lines)
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+@app.post("/e2e/sql/sync")
+def e2e_sql_sync(req: SqlReq):
+    """Thread-offloaded psycopg2 + pandas path, kept to benchmark against /e2e/sql."""
+    df, meta, elapsed = run_sql(req.query, req.limit, req.allow_writes)
+    return _sql_response(df, meta, elapsed)
+
+# Mount Gradio UI on "/". Its queue join and the SSE data stream of a
+# session must reach the same process, and with several uvicorn workers on
+# one shared socket nothing can pin a browser to a worker. So multi-worker
+# mode serves the /e2e API only; run a single-worker instance for the UI.
+if WORKERS > 1:
+    log.warning("SERVER_WORKERS=%d: Gradio UI not mounted, serving the /e2e API only", WORKERS)
+    if CHAT_STORE_REQUESTED:
+        log.warning("SERVER_WORKERS=%d: server-side chat history (CHAT_STORE) is off, clients must send history", WORKERS)
+    mounted = app
+else:
+    mounted = gr.mount_gradio_app(app, demo, path="/")
+startup.mark("mount")
 
 if __name__ == "__main__":
-    # Run with multiple workers for concurrency in real tests (see section D)
-    uvicorn.run(mounted, host="0.0.0.0", port=7860)
+    host = os.getenv("SERVER_HOST", "0.0.0.0")
+    port = int(os.getenv("SERVER_PORT", "7860"))
+    if WORKERS > 1:
+        # Each worker imports this module and builds its own app, pools and
+        # caches (see deployment.py); the Gradio UI is left out (see above).
+        # Importing gradio is slow, so give workers longer than uvicorn's
+        # default before they count as hung.
+        uvicorn.run("server:mounted", host=host, port=port, workers=WORKERS,
+                    timeout_worker_healthcheck=int(os.getenv("SERVER_WORKER_HEALTHCHECK", "60")))
+    else:
+        uvicorn.run(mounted, host=host, port=port)
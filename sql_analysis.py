@@ -0,0 +1,431 @@
+"""
+One tokenizer pass per query text, shared by everything in sql_tab that
+needs to know what a statement is: the write guard, the multi-statement
+check, the row cap, the result cache key and the tables a write invalidates.
+
+    pq = analyze(query)
+    pq.statement_count, pq.is_write, pq.tables, pq.with_limit(200)
+
+is_write is the read-only guard for student SQL, so it errs on the side of
+refusing: besides data writes it covers everything that changes session or
+transaction state (SET, RESET, BEGIN, PREPARE, LISTEN, ...) and calls to
+functions with side effects outside the query (set_config(), nextval(),
+advisory locks, pg_terminate_backend(), server file access, ...).
+session_only tells those apart from writes that change table data.
+
+The tokenizer knows PostgreSQL's lexical rules (quoted identifiers, '' and
+E'' strings, dollar quotes, nested /* */ and -- comments), so a ';' or
+LIMIT inside a literal, comment or subquery no longer fools the checks.
+It is not a parser: statements are classified from their keywords and
+paren depth, which covers what students send. analyze() is memoized on the
+query text (SQL_ANALYSIS_CACHE entries).
+"""
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("SQL_ANALYSIS_CACHE", "1024"))
+
+WRITE_FIRST_KEYWORDS = {
+    "INSERT","UPDATE","DELETE","DROP","ALTER","CREATE","TRUNCATE",
+    "VACUUM","REINDEX","GRANT","REVOKE","MERGE","CALL","DO",
+    "ATTACH","DETACH","COPY","COMMENT","REFRESH","CLUSTER","LOCK",
+    "ANALYZE","ANALYSE","CHECKPOINT","SECURITY","IMPORT","REASSIGN",
+    "EXECUTE",  # a prepared statement may be DML; its tables are unknown
+}
+# statements that change session or transaction state, not table data
+SESSION_FIRST_KEYWORDS = {
+    "SET","RESET","DISCARD","PREPARE","DEALLOCATE","LISTEN","UNLISTEN","NOTIFY",
+    "BEGIN","START","COMMIT","END","ROLLBACK","ABORT","SAVEPOINT","RELEASE",
+    "DECLARE","FETCH","MOVE","CLOSE","LOAD",
+}
+# functions whose effects outlive the query or reach outside it
+_SIDE_EFFECT_FUNCS = {
+    "set_config","nextval","setval","pg_notify","pg_terminate_backend","pg_cancel_backend",
+    "pg_reload_conf","pg_rotate_logfile","pg_promote","pg_switch_wal","pg_create_restore_point",
+    "pg_log_backend_memory_contexts","pg_import_system_collations","pg_backup_start","pg_backup_stop",
+    "pg_start_backup","pg_stop_backup","pg_wal_replay_pause","pg_wal_replay_resume",
+    "lo_import","lo_export","lo_unlink","lo_create","lo_creat","lo_from_bytea","lo_put","lo_truncate",
+}
+_SIDE_EFFECT_PREFIXES = (
+    "pg_advisory_","pg_try_advisory_","pg_stat_reset","pg_read_","pg_ls_","pg_file_",
+    "pg_create_","pg_drop_","pg_replication_","pg_logical_","pg_copy_","dblink",
+)
+READ_FIRST_KEYWORDS = {"SELECT", "WITH", "VALUES", "TABLE"}
+# data-modifying statements that can also sit inside a WITH
+_DML = {"INSERT", "UPDATE", "DELETE", "MERGE"}
+# statements whose affected tables can't be read off their keywords (target
+# lists, CASCADE, views, procedure bodies): tables is left empty, i.e. all
+_TABLES_UNKNOWN = {
+    "CREATE","ALTER","DROP","TRUNCATE","REFRESH","IMPORT","CALL","DO","EXECUTE",
+}
+# keywords followed by a table name
+_TABLE_BEFORE = {"FROM", "JOIN", "INTO", "UPDATE", "TABLE", "TRUNCATE", "USING"}
+_TABLE_SKIP = {"ONLY", "TABLE", "LATERAL", "IF", "NOT", "EXISTS"}
+# functions whose arguments use FROM (EXTRACT(year FROM d), ...)
+_FROM_ARG_FUNCS = {"EXTRACT", "SUBSTRING", "TRIM", "OVERLAY", "POSITION"}
+# keywords that end a FROM list
+_CLAUSE_END = {
+    "WHERE","GROUP","HAVING","WINDOW","ORDER","LIMIT","OFFSET","FETCH","FOR",
+    "UNION","INTERSECT","EXCEPT","RETURNING","SET","SELECT","VALUES",
+}
+_VOLATILE = {
+    "random","now","clock_timestamp","statement_timestamp","timeofday","nextval","setval",
+    "current_date","current_time","current_timestamp","localtime","localtimestamp",
+    "gen_random_uuid","pg_sleep",
+}
+
+# Whitespace and comments are skipped in front of every token; nested /* */
+# comments don't fit a regex and go through _block_end. The last two
+# alternatives always match, so the skip prefix never backtracks.
+_TOKEN_RE = re.compile(r"""
+    (?:\s|--[^\n]*|/\*(?:[^*/]|\*(?!/)|/(?!\*))*\*/)*
+    (?:
+        (?P<block>/\*)
+      | (?P<string>[Ee]'(?:[^'\\]|\\.|'')*'
+                  | (?:[BbXxNn]|[Uu]&)?'(?:[^']|'')*')
+      | (?P<qident>(?:[Uu]&)?"(?:[^"]|"")*")
+      | (?P<dollar>\$(?P<tag>(?:[^\W\d]\w*)?)\$.*?\$(?P=tag)\$)
+      | (?P<param>\$\d+)
+      | (?P<number>(?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[Ee][+-]?\d+)?\w*)
+      | (?P<word>[^\W\d][\w$]*)
+      | (?P<op>(?:(?!--|/\*)[-+*/<>=~!@\#%^&|`?])+)
+      | (?P<punct>::|[(),;.\[\]:])
+      | (?P<error>.+)
+      | \Z
+    )
+""", re.VERBOSE | re.DOTALL)
+
+
+class Token(NamedTuple):
+    kind: str    # string qident dollar param number word op punct error
+    text: str
+    start: int
+    end: int
+
+
+def tokenize(sql: str) -> list[Token]:
+    """
+    The significant tokens of `sql`: whitespace and comments are dropped
+    (they show up as gaps between one token's end and the next one's
+    start). An unterminated string/comment/quote ends in one "error" token.
+    """
+    out = []
+    pos, n = 0, len(sql)
+    while pos < n:
+        for m in _TOKEN_RE.finditer(sql, pos):
+            kind = m.lastgroup
+            if kind is None:
+                return out  # only whitespace/comments left
+            if kind == "block":
+                start = m.start(kind)
+                pos = _block_end(sql, start)
+                if not pos:
+                    out.append(Token("error", sql[start:], start, n))
+                    return out
+                break  # resume after the nested comment
+            start = m.start(kind)
+            out.append(Token(kind, sql[start:m.end()], start, m.end()))
+        else:
+            return out
+    return out
+
+
+def _block_end(sql: str, pos: int) -> int:
+    """End of the (possibly nested) /* */ comment at pos, 0 if unterminated."""
+    depth, i = 0, pos
+    while True:
+        a, b = sql.find("/*", i), sql.find("*/", i)
+        if b < 0:
+            return 0
+        if 0 <= a < b:
+            depth += 1
+            i = a + 2
+        else:
+            depth -= 1
+            i = b + 2
+            if depth == 0:
+                return i
+
+
+@dataclass(frozen=True, slots=True)
+class ParsedQuery:
+    """
+    What sql_tab needs to know about one query text. Everything except
+    statement_count and tables describes the first statement.
+    """
+    text: str               # first statement, trimmed, without ';' or trailing comments
+    normalized: str         # cache key: whitespace collapsed, comments dropped, words lowercased
+    first_keyword: str
+    statement_count: int
+    is_write: bool          # anything read-only mode refuses, see the module docstring
+    session_only: bool      # is_write, but only session/transaction state or side-effect functions
+    tables: frozenset       # lowercase, schema dropped; over-matches rather than misses; empty: unknown
+    volatile: bool          # calls random(), now(), ...
+    limit_kind: str         # outer LIMIT: "none", "literal", "all" or "other" (expression, FETCH)
+    limit_value: int | None
+    limit_span: tuple | None  # (start, end) of the count / ALL in `text`
+
+    @property
+    def returns_rows(self) -> bool:
+        """SELECT/WITH/VALUES/TABLE that writes nothing: can be capped, paged or streamed."""
+        return self.first_keyword in READ_FIRST_KEYWORDS and not self.is_write
+
+    @property
+    def writes_data(self) -> bool:
+        """May change table data: cached results of `tables` (all, if unknown) are stale after it."""
+        return self.is_write and not self.session_only
+
+    @property
+    def cacheable(self) -> bool:
+        return self.returns_rows and not self.volatile
+
+    def with_limit(self, limit: int) -> str:
+        """
+        `text` with its outer row count capped at `limit`: a LIMIT is added,
+        a larger literal one (or LIMIT ALL) is lowered, and anything else
+        (expressions, FETCH FIRST) is wrapped in a subquery. Other
+        statements come back unchanged.
+        """
+        limit = int(limit)
+        if not self.returns_rows:
+            return self.text
+        if self.limit_kind == "none":
+            return f"{self.text} LIMIT {limit}"
+        if self.limit_kind == "literal" and self.limit_value <= limit:
+            return self.text
+        if self.limit_kind in ("literal", "all"):
+            a, b = self.limit_span
+            return f"{self.text[:a]}{limit}{self.text[b:]}"
+        return f"SELECT * FROM (\n{self.text}\n) AS _limited LIMIT {limit}"
+
+
+def _split_statements(tokens):
+    stmts, cur = [], []
+    for t in tokens:
+        if t.kind == "punct" and t.text == ";":
+            stmts.append(cur)
+            cur = []
+        else:
+            cur.append(t)
+    stmts.append(cur)
+    return [s for s in stmts if s]
+
+
+def _first_word(toks):
+    for t in toks:
+        if t.kind == "word":
+            return t.text.upper()
+        if t.text != "(":
+            return ""
+    return ""
+
+
+def _changes_session(toks, first: str) -> bool:
+    if first in SESSION_FIRST_KEYWORDS:
+        return True
+    for i, t in enumerate(toks[:-1]):
+        if t.kind == "word":
+            name = t.text.lower()
+        elif t.kind == "qident":
+            name = t.text[1:-1]  # "set_config"(...) is the same function; "Set_Config" isn't
+        else:
+            continue
+        if (toks[i + 1].text == "("
+                and (name in _SIDE_EFFECT_FUNCS or name.startswith(_SIDE_EFFECT_PREFIXES))):
+            return True
+    return False
+
+
+def _explained(toks):
+    """(runs it, statement tokens) for EXPLAIN [ANALYZE] [VERBOSE] stmt / EXPLAIN (options) stmt."""
+    i = next(i for i, t in enumerate(toks) if t.kind == "word") + 1
+    runs = False
+    if i < len(toks) and toks[i].text == "(":
+        depth = 0
+        while i < len(toks):
+            t = toks[i]
+            i += 1
+            if t.text == "(":
+                depth += 1
+            elif t.text == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+            elif t.kind == "word" and t.text.upper() in ("ANALYZE", "ANALYSE"):
+                runs = True  # also ANALYZE false: refusing that costs nothing
+    else:
+        while i < len(toks) and toks[i].kind == "word" and toks[i].text.upper() in ("ANALYZE", "ANALYSE", "VERBOSE"):
+            runs = runs or toks[i].text.upper() != "VERBOSE"
+            i += 1
+    return runs, toks[i:]
+
+
+def _is_write(toks, first: str) -> bool:
+    if first in WRITE_FIRST_KEYWORDS:
+        return True
+    if first == "EXPLAIN":
+        # only EXPLAIN ANALYZE actually runs the statement: judge that one
+        runs, stmt = _explained(toks)
+        return runs and _is_write(stmt, _first_word(stmt))
+    depth, prev = 0, None
+    for t in toks:
+        if t.kind == "punct" and t.text in "([":
+            depth += 1
+        elif t.kind == "punct" and t.text in ")]":
+            depth -= 1
+        elif t.kind == "word":
+            w = t.text.upper()
+            # WITH d AS (DELETE ...) / WITH ... ) INSERT ...
+            if w in _DML and prev is not None and prev.text in "()":
+                return True
+            # SELECT ... INTO new_table
+            if w == "INTO" and depth == 0 and first in READ_FIRST_KEYWORDS:
+                return True
+        prev = t
+    return False
+
+
+def _name_at(toks, i):
+    """(name, next index) for a possibly qualified name at toks[i], or (None, i)."""
+    parts = []
+    while i < len(toks) and toks[i].kind in ("word", "qident"):
+        t = toks[i]
+        parts.append(t.text[1:-1].replace('""', '"') if t.kind == "qident" else t.text)
+        if i + 2 < len(toks) and toks[i + 1].text == "." and toks[i + 2].kind in ("word", "qident"):
+            i += 2
+            continue
+        i += 1
+        break
+    if not parts or (i < len(toks) and toks[i].text == "("):
+        return None, i  # nothing, or a function call
+    # case folded even when quoted: invalidation may over-match, never under-match
+    return parts[-1].lower(), i
+
+
+def _tables(toks) -> set:
+    tables = set()
+    # per paren depth: opened by EXTRACT(...) and friends / inside a FROM list
+    from_args, from_list = [False], [False]
+    prev_word = None
+    i = 0
+    while i < len(toks):
+        t = toks[i]
+        if t.kind == "punct" and t.text == "(":
+            from_args.append(prev_word in _FROM_ARG_FUNCS)
+            from_list.append(False)
+        elif t.kind == "punct" and t.text == ")":
+            if len(from_args) > 1:
+                from_args.pop()
+                from_list.pop()
+        elif t.kind == "punct" and t.text == "," and from_list[-1]:
+            name, _ = _name_at(toks, _skip(toks, i + 1))
+            if name:
+                tables.add(name)
+        elif t.kind == "word":
+            w = t.text.upper()
+            if w in _CLAUSE_END:
+                from_list[-1] = False
+            if w == "FROM" and not from_args[-1]:
+                from_list[-1] = True
+            if (w in _TABLE_BEFORE and not (w == "FROM" and from_args[-1])
+                    and not (w == "UPDATE" and prev_word in ("FOR", "KEY", "DO"))):
+                name, _ = _name_at(toks, _skip(toks, i + 1))
+                if name:
+                    tables.add(name)
+            prev_word = w
+            i += 1
+            continue
+        prev_word = None
+        i += 1
+    return tables
+
+
+def _skip(toks, i):
+    while i < len(toks) and toks[i].kind == "word" and toks[i].text.upper() in _TABLE_SKIP:
+        i += 1
+    return i
+
+
+def _outer_limit(toks, base: int):
+    """(kind, value, span relative to base) of the depth-0 LIMIT/FETCH in a read statement."""
+    depth = 0
+    for i, t in enumerate(toks):
+        if t.kind == "punct" and t.text in "([":
+            depth += 1
+        elif t.kind == "punct" and t.text in ")]":
+            depth -= 1
+        elif depth == 0 and t.kind == "word":
+            w = t.text.upper()
+            if w == "FETCH":
+                return "other", None, None
+            if w != "LIMIT":
+                continue
+            arg = toks[i + 1] if i + 1 < len(toks) else None
+            after = toks[i + 2] if i + 2 < len(toks) else None
+            simple_end = after is None or (after.kind == "word" and after.text.upper() in ("OFFSET", "FOR"))
+            if arg is not None and arg.kind == "word" and arg.text.upper() == "ALL" and simple_end:
+                return "all", None, (arg.start - base, arg.end - base)
+            if arg is not None and arg.kind == "number" and arg.text.isdigit() and simple_end:
+                return "literal", int(arg.text), (arg.start - base, arg.end - base)
+            return "other", None, None
+    return "none", None, None
+
+
+def _normalize(toks) -> str:
+    out, prev_end = [], None
+    for t in toks:
+        if prev_end is not None and t.start != prev_end:
+            out.append(" ")
+        out.append(t.text.lower() if t.kind == "word" else t.text)
+        prev_end = t.end
+    return "".join(out)
+
+
+def _analyze(sql: str) -> ParsedQuery:
+    statements = _split_statements(tokenize(sql))
+    if not statements:
+        return ParsedQuery("", "", "", 0, False, False, frozenset(), False, "none", None, None)
+
+    toks = statements[0]
+    first = _first_word(toks)
+    base = toks[0].start
+    tables = set()
+    for s in statements:
+        kw = _first_word(s)
+        if kw == "EXPLAIN":
+            kw = _first_word(_explained(s)[1])
+        if kw in _TABLES_UNKNOWN:
+            tables = set()
+            break
+        tables |= _tables(s)
+    limit = ("none", None, None)
+    if first in READ_FIRST_KEYWORDS:
+        limit = _outer_limit(toks, base)
+    writes = any(_is_write(s, _first_word(s)) for s in statements)
+    session = any(_changes_session(s, _first_word(s)) for s in statements)
+    return ParsedQuery(
+        text=sql[base:toks[-1].end],
+        normalized=_normalize(toks),
+        first_keyword=first,
+        statement_count=len(statements),
+        is_write=writes or session,
+        session_only=session and not writes,
+        tables=frozenset(tables),
+        volatile=any(t.kind == "word" and t.text.lower() in _VOLATILE for s in statements for t in s),
+        limit_kind=limit[0],
+        limit_value=limit[1],
+        limit_span=limit[2],
+    )
+
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def analyze(sql: str) -> ParsedQuery:
+    """ParsedQuery for `sql`, memoized on the exact text (the UI resends queries verbatim)."""
+    return _analyze(sql)
+
+
+def normalize_sql(sql: str) -> str:
+    return analyze(sql).normalized
@@ -0,0 +1,124 @@
+"""
+JSON-ready rows straight from a DB cursor, without going through pandas.
+
+Converters are picked once per column from the Postgres type OID in
+cursor.description. Most columns need none: orjson already serializes
+str/int/bool/float (NaN/Inf -> null), dict/list, datetime, naive time and
+UUID, so only the leftovers (numeric, interval, bytea, date, ...) pay a
+per-cell Python call.
+
+The output matches server.df_json_safe on the pandas path, including dates
+as midnight timestamps ("2024-05-01T00:00:00", what pd.to_datetime gives),
+which is what /e2e/sql returned before this module existed.
+"""
+import datetime as dt
+import decimal
+import math
+import uuid
+
+
+# OIDs orjson can take as-is
+_PASSTHROUGH_OIDS = {
+    16,                  # bool
+    18, 19, 25, 1042, 1043,   # char, name, text, bpchar, varchar
+    20, 21, 23, 26,      # int8, int2, int4, oid
+    700, 701,            # float4, float8
+    114, 3802,           # json, jsonb
+    1083, 1114, 1184,    # time, timestamp, timestamptz
+    2950,                # uuid
+}
+
+def _finite(v):
+    try:
+        f = float(v)
+    except Exception:
+        return None
+    return f if math.isfinite(f) else None
+
+def _text(v):
+    return str(v)
+
+def _bytes(v):
+    try:
+        return bytes(v).decode("utf-8", "replace")
+    except Exception:
+        return str(v)
+
+def _isoformat(v):
+    try:
+        return v.isoformat()
+    except Exception:
+        return str(v)
+
+def _date(v):
+    # df_json_safe's pd.to_datetime(v).isoformat(); orjson alone would give "YYYY-MM-DD"
+    try:
+        return dt.datetime.combine(v, dt.time()).isoformat()
+    except Exception:
+        return str(v)
+
+def to_json_value(v):
+    """Fallback for unknown types (arrays, ranges, money, ...); mirrors server.df_json_safe."""
+    if v is None or isinstance(v, (str, bool, int, dict)):
+        return v
+    if isinstance(v, float):
+        return v if math.isfinite(v) else None
+    if isinstance(v, decimal.Decimal):
+        return _finite(v)
+    if isinstance(v, (list, tuple)):
+        # df_json_safe leaves list items to orjson, so dates in arrays stay "YYYY-MM-DD"
+        return [x if isinstance(x, dt.date) else to_json_value(x) for x in v]
+    if isinstance(v, dt.datetime):
+        return v
+    if isinstance(v, dt.date):
+        return _date(v)
+    if isinstance(v, dt.time):
+        return v if v.tzinfo is None else v.isoformat()
+    if isinstance(v, dt.timedelta):
+        return str(v)
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return _bytes(v)
+    if isinstance(v, uuid.UUID):
+        return str(v)
+    return str(v)
+
+_OID_CONVERTERS = {
+    1700: _finite,       # numeric -> Decimal
+    1186: _text,         # interval -> timedelta
+    17: _bytes,          # bytea
+    1266: _isoformat,    # timetz (orjson rejects tz-aware time)
+    1082: _date,         # date
+}
+
+def converters_for(type_oids) -> list:
+    """One callable per column, or None where the value can go to orjson untouched."""
+    out = []
+    for oid in type_oids:
+        if oid in _PASSTHROUGH_OIDS:
+            out.append(None)
+        else:
+            out.append(_OID_CONVERTERS.get(oid, to_json_value))
+    return out
+
+def _convert(rows, convs):
+    active = [(i, f) for i, f in enumerate(convs) if f is not None]
+    if not active:
+        return rows
+    out = []
+    for row in rows:
+        row = list(row)
+        for i, f in active:
+            v = row[i]
+            if v is not None:
+                row[i] = f(v)
+        out.append(row)
+    return out
+
+def rows_to_records(columns, type_oids, rows) -> list[dict]:
+    """[{col: value}, ...]; later duplicate column names win, like RealDictCursor."""
+    rows = _convert(rows, converters_for(type_oids))
+    return [dict(zip(columns, row)) for row in rows]
+
+def rows_to_columnar(columns, type_oids, rows) -> dict:
+    """{"columns": [...], "data": [[...], ...]}; tuples serialize as JSON arrays."""
+    return {"columns": list(columns), "data": _convert(rows, converters_for(type_oids))}
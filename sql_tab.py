@@ -1,10 +1,25 @@
 import os
-import re
 import time
 import pandas as pd
 import numpy as np
-import psycopg2.extras as extras
-from psycopg2.pool import SimpleConnectionPool
+import asyncio
+import threading
+import sys
+import json
+import base64
+import hashlib
+import itertools
+import psycopg
+import psycopg2
+import metrics
+from psycopg_pool import AsyncConnectionPool, PoolTimeout as PoolTimeoutAsync
+
+from db_pool import BoundedPool, PoolTimeout, SESSION_RESET_SQL
+from plan_cache import plan_cache, PARAM_TYPES_SQL
+from cost_guard import cost_guard, explain_sql
+from result_cache import ResultCache
+from sql_analysis import analyze, ParsedQuery
+from deployment import CACHE_BROADCAST, pg_pool_sizes
 
 
 DB_NAME = os.getenv("PGDATABASE", "mert")
@@ -12,29 +27,53 @@ DB_USER = os.getenv("PGUSER", "mert")
 DB_PASS = os.getenv("POSTGRES_PASSWORD")
 DB_HOST = os.getenv("PGHOST", "127.0.0.1")
 DB_PORT = int(os.getenv("PGPORT", "5432"))
-POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+# per process, together at most PG_POOL_MAX or this worker's share of PG_CONN_BUDGET (see deployment.py)
+POOL_MAX, SYNC_POOL_MAX = pg_pool_sizes()
+POOL_MIN = min(POOL_MIN, POOL_MAX)
+POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "5"))            # max wait for a free conn
+POOL_CHECK_IDLE = float(os.getenv("PG_POOL_CHECK_IDLE", "30"))     # ping conns idle longer than this
+POOL_MAX_LIFETIME = float(os.getenv("PG_POOL_MAX_LIFETIME", "1800"))
+STATEMENT_TIMEOUT_MS = 10000  # 10s
+STREAM_BATCH = int(os.getenv("SQL_STREAM_BATCH", "500"))  # rows per fetchmany on server-side cursors
+
+# Applied by the server at connect time: once per physical connection, no extra RTT per query.
+# Both pools run SESSION_RESET_SQL when a connection comes back, which restores these
+# (a student's SET statement_timeout = 0 must not outlive their query).
+SESSION_OPTIONS = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+
+# Read-only results, keyed on the normalized SQL actually sent (so the injected LIMIT is part of the key)
+CACHE_ENABLED = os.getenv("SQL_CACHE", "1").lower() not in {"0", "false", "no"}
+result_cache = ResultCache(
+    max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("SQL_CACHE_TTL", "300")),
+    max_bytes=int(float(os.getenv("SQL_CACHE_MAX_MB", "64")) * (1 << 20)),
+)
+# Other worker processes hear about writes through NOTIFY when CACHE_BROADCAST is on (see start_cache_listener)
+CACHE_CHANNEL = "sql_result_cache"
 
-_pool: SimpleConnectionPool | None = None
+_pool: BoundedPool | None = None
+_pool_lock = threading.Lock()
+_apool: AsyncConnectionPool | None = None
+_apool_lock: asyncio.Lock | None = None
 
-def _get_pool():
+def _get_pool() -> BoundedPool:
     global _pool
     if _pool is None:
-        _pool = SimpleConnectionPool(
-            minconn=1, maxconn=POOL_MAX,
-            database=DB_NAME, user=DB_USER, password=DB_PASS,
-            host=DB_HOST, port=DB_PORT
-        )
+        with _pool_lock:
+            if _pool is None:
+                _pool = BoundedPool(
+                    minconn=POOL_MIN, maxconn=SYNC_POOL_MAX, timeout=POOL_TIMEOUT,
+                    check_idle=POOL_CHECK_IDLE, max_lifetime=POOL_MAX_LIFETIME,
+                    database=DB_NAME, user=DB_USER, password=DB_PASS,
+                    host=DB_HOST, port=DB_PORT, options=SESSION_OPTIONS,
+                )
     return _pool
 
 def _borrow_conn():
-    pool = _get_pool()
-    conn = pool.getconn()
-    conn.autocommit = True
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SET statement_timeout = 10000;")  # 10s
-    except Exception:
-        pass
+    started = time.perf_counter()
+    conn = _get_pool().getconn()
+    metrics.observe("db_pool_wait_seconds", time.perf_counter() - started, pool="sync")
     return conn
 
 def _return_conn(conn):
@@ -44,69 +83,536 @@ def _return_conn(conn):
         try: conn.close()
         except Exception: pass
 
+async def _reset_session(conn):
+    """psycopg_pool reset= callback; if it raises, the pool drops the connection."""
+    await conn.execute(SESSION_RESET_SQL)
 
-WRITE_FIRST_KEYWORDS = {
-    "INSERT","UPDATE","DELETE","DROP","ALTER","CREATE","TRUNCATE",
-    "VACUUM","REINDEX","GRANT","REVOKE","MERGE","CALL","DO",
-    "ATTACH","DETACH" 
-}
+async def _get_async_pool() -> AsyncConnectionPool:
+    """
+    Lazily opens the asyncio pool. Connections are borrowed by awaiting, so a
+    full pool parks the coroutine instead of a threadpool worker.
+    """
+    global _apool, _apool_lock
+    if _apool is not None:
+        return _apool
+    if _apool_lock is None:
+        _apool_lock = asyncio.Lock()
+    async with _apool_lock:
+        if _apool is None:
+            pool = AsyncConnectionPool(
+                min_size=POOL_MIN, max_size=POOL_MAX, open=False,
+                timeout=POOL_TIMEOUT, max_lifetime=POOL_MAX_LIFETIME,
+                check=AsyncConnectionPool.check_connection,
+                reset=_reset_session,
+                kwargs=dict(
+                    dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+                    host=DB_HOST, port=DB_PORT, autocommit=True,
+                    options=SESSION_OPTIONS,
+                ),
+            )
+            await pool.open()
+            _apool = pool
+    return _apool
 
-def is_write_query(sql: str) -> bool:
+async def warm_pools(sync: bool = False):
     """
-    Returns True if the first *statement* is a write. Ignores function names like REPLACE().
-    Handles WITH ... (SELECT ...) vs WITH ... INSERT/UPDATE/DELETE/MERGE ...
+    Opens the asyncio pool and waits for its min_size connections, and with
+    `sync` the psycopg2 pool too, so the first queries don't pay for connecting.
     """
-    first_stmt = re.split(r";\s*", sql.strip(), maxsplit=1)[0]
+    pool = await _get_async_pool()
+    await pool.wait(timeout=POOL_TIMEOUT)
+    if sync:
+        await asyncio.to_thread(_get_pool)
+
+async def close_async_pool():
+    global _apool
+    if _apool is not None:
+        pool, _apool = _apool, None
+        await pool.close()
+
+def pool_stats() -> dict:
+    """Counters for both pools: wait time, in-use count, borrow failures, ..."""
+    out = {}
+    if _pool is not None:
+        out["sync"] = _pool.stats()
+    if _apool is not None:
+        s = _apool.get_stats()
+        out["async"] = dict(
+            borrows=s.get("requests_num", 0),
+            borrow_failures=s.get("requests_errors", 0) + s.get("connections_errors", 0),
+            timeouts=s.get("requests_errors", 0),
+            wait_seconds_total=s.get("requests_wait_ms", 0) / 1000,
+            size=s.get("pool_size", 0),
+            idle=s.get("pool_available", 0),
+            in_use=s.get("pool_size", 0) - s.get("pool_available", 0),
+            waiting=s.get("requests_waiting", 0),
+            max=s.get("pool_max", POOL_MAX),
+        )
+    return out
 
-    # If it starts with WITH, decide based on the main statement following the CTEs
-    if re.match(r"^\s*WITH\b", first_stmt, flags=re.IGNORECASE):
-        # Heuristic: if an INSERT/UPDATE/DELETE/MERGE appears after the CTE block, treat as write
-        return bool(re.search(r"\)\s*(INSERT|UPDATE|DELETE|MERGE)\b", first_stmt, flags=re.IGNORECASE))
 
-    # Otherwise, just check the very first keyword
-    m = re.match(r"^\s*([A-Za-z]+)", first_stmt)
-    first_kw = m.group(1).upper() if m else ""
-    return first_kw in WRITE_FIRST_KEYWORDS
+def is_write_query(sql: str) -> bool:
+    """
+    True if any statement writes (including WITH ... DELETE and SELECT ... INTO)
+    or changes session state (SET, BEGIN, set_config(), ...; see sql_analysis).
+    """
+    return analyze(sql).is_write
 
 def enforce_limit(sql: str, limit: int) -> str:
+    """The first statement with its outer row count capped at `limit` (see ParsedQuery.with_limit)."""
+    return analyze(sql).with_limit(limit)
+
+def _check_query(pq: ParsedQuery, allow_writes: bool) -> str | None:
+    """Returns a user-facing message if the query must not run, else None."""
+    if pq.statement_count == 0:
+        return "Provide a SQL query."
+
+    if pq.statement_count > 1:
+        return "Multiple statements detected; please run one at a time."
+
+    if not allow_writes and pq.is_write:
+        if pq.session_only:
+            return ("Session and transaction commands (SET, BEGIN, set_config(), ...) are disabled. "
+                    "Enable the toggle to allow writes.")
+        return "Write operations are disabled. Enable the toggle to allow writes."
+    return None
+
+class QueryResult:
     """
-    Adds LIMIT if:
-      - query starts with SELECT or WITH
-      - and no existing LIMIT present (naive but practical)
+    Raw cursor output: column names, type OIDs and tuple rows. The DataFrame
+    is only built when a caller asks for it, and then kept, so cached results
+    and the JSON API (see sql_json) never pay for pandas twice or at all.
     """
-    first = sql.strip().strip(";")
-    if re.match(r"^(SELECT|WITH)\b", first, flags=re.IGNORECASE) and not re.search(r"\bLIMIT\b", first, flags=re.IGNORECASE):
-        return f"{first} LIMIT {int(limit)}"
-    return first
+    __slots__ = ("columns", "type_oids", "rows", "_df")
 
-def run_sql(query: str, max_rows: int, allow_writes: bool):
-    
-    if not query or not query.strip():
-        return pd.DataFrame(), "Provide a SQL query.", 0.0
+    def __init__(self, columns=(), type_oids=(), rows=()):
+        self.columns = list(columns)
+        self.type_oids = list(type_oids)
+        self.rows = rows
+        self._df = None
+
+    @classmethod
+    def from_cursor(cls, cur, rows):
+        desc = cur.description or ()
+        return cls([d.name for d in desc], [d.type_code for d in desc], rows)
+
+    def __len__(self):
+        return len(self.rows)
 
-    if ";" in query.strip().rstrip(";"):
-        return pd.DataFrame(), "Multiple statements detected; please run one at a time.", 0.0
+    def to_df(self) -> pd.DataFrame:
+        if self._df is None:
+            started = time.perf_counter()
+            if not self.columns:
+                df = pd.DataFrame()
+            else:
+                df = pd.DataFrame.from_records(self.rows, columns=self.columns, coerce_float=False)
+            df.replace([np.inf, -np.inf], pd.NA, inplace=True)
+            self._df = df.where(pd.notnull(df), None)
+            metrics.observe("dataframe_build_seconds", time.perf_counter() - started)
+        return self._df
 
-    if not allow_writes and is_write_query(query):
-        return pd.DataFrame(), "Write operations are disabled. Enable the toggle to allow writes.", 0.0
+    def approx_bytes(self) -> int:
+        """Rough size from a sample of rows; good enough for the cache budget."""
+        n = len(self.rows)
+        if not n:
+            return 64
+        sample = self.rows[: min(n, 32)]
+        per_row = sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r) for r in sample) / len(sample)
+        return int(per_row * n)
+
+def _meta(result: QueryResult, elapsed: float, cached: bool = False) -> str:
+    return f"Rows: {len(result)} | Time: {elapsed:.3f}s" + (" (cached)" if cached else "")
+
+def invalidate_tables(tables) -> int:
+    """Drops cached results, cost estimates and prepared plans that read any of `tables` (all of them if empty)."""
+    cost_guard.invalidate_tables(tables)
+    plan_cache.invalidate_tables(tables)
+    return result_cache.invalidate_tables(tables)
+
+def cache_stats() -> dict:
+    return result_cache.stats()
+
+def _invalidation_notice(pq: ParsedQuery):
+    """(sql, params) telling the other workers which tables `pq` wrote to."""
+    payload = f"{os.getpid()}:" + ",".join(sorted(pq.tables))
+    return "SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, payload)
+
+_listener_task: asyncio.Task | None = None
+
+async def start_cache_listener():
+    """
+    Multi-worker mode: LISTENs on CACHE_CHANNEL and drops cached results for
+    tables another worker wrote to. Costs one connection per worker.
+    """
+    global _listener_task
+    if CACHE_ENABLED and CACHE_BROADCAST and _listener_task is None:
+        _listener_task = asyncio.get_running_loop().create_task(_listen_invalidations(), name="sql-cache-listener")
+
+async def stop_cache_listener():
+    global _listener_task
+    if _listener_task is not None:
+        task, _listener_task = _listener_task, None
+        task.cancel()
+        await asyncio.wait((task,))
+
+async def _listen_invalidations():
+    own = f"{os.getpid()}:"
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(
+                dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+                host=DB_HOST, port=DB_PORT, autocommit=True,
+            )
+            async with conn:
+                await conn.execute(f"LISTEN {CACHE_CHANNEL}")
+                # writes made while we weren't listening went unheard
+                result_cache.clear()
+                async for note in conn.notifies():
+                    if note.payload.startswith(own):
+                        continue  # already invalidated locally by _after_run
+                    _, _, tables = note.payload.partition(":")
+                    invalidate_tables([t for t in tables.split(",") if t])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(1.0)
+
+def _from_cache(pq: ParsedQuery, key):
+    if not CACHE_ENABLED or pq.is_write:
+        return None
+    started = time.perf_counter()
+    result = result_cache.get(key)
+    if result is None:
+        return None
+    # Shared with other callers: treat as read-only
+    elapsed = time.perf_counter() - started
+    return result, _meta(result, elapsed, cached=True), elapsed
+
+def _after_run(pq: ParsedQuery, key, result: QueryResult, elapsed: float, warning: str = ""):
+    if pq.writes_data:
+        invalidate_tables(pq.tables)
+    elif CACHE_ENABLED and pq.cacheable:
+        result_cache.put(key, result, result.approx_bytes(), pq.tables)
+    meta = _meta(result, elapsed)
+    return result, (f"{meta} | {warning}" if warning else meta), elapsed
+
+# --- cost guard: EXPLAIN before running reads ---
+
+def cost_guard_stats() -> dict:
+    return cost_guard.stats()
+
+def _guard_key(pq: ParsedQuery, limit):
+    return pq.normalized, None if limit is None else int(limit)
+
+def _explain_target(pq: ParsedQuery, limit):
+    return pq.text if limit is None else pq.with_limit(limit)
+
+def _preflight(cur, pq: ParsedQuery, limit) -> tuple[str, str]:
+    """
+    cost_guard's verdict on `pq` capped at `limit` (None: uncapped), running
+    EXPLAIN on `cur` unless the estimate is cached. If EXPLAIN itself
+    fails the query goes ahead and reports its own error.
+    """
+    if not cost_guard.enabled or not pq.returns_rows:
+        return "ok", ""
+    key = _guard_key(pq, limit)
+    est = cost_guard.lookup(key)
+    if est is None:
+        try:
+            with metrics.timed("sql_explain_seconds", path="sync"):
+                cur.execute(explain_sql(_explain_target(pq, limit)))
+                doc = cur.fetchone()[0]
+            est = cost_guard.store(key, doc, pq.tables)
+        except Exception:
+            cost_guard.explain_failed()
+    return cost_guard.verdict(est)
+
+async def _preflight_async(cur, pq: ParsedQuery, limit) -> tuple[str, str]:
+    """_preflight for psycopg 3."""
+    if not cost_guard.enabled or not pq.returns_rows:
+        return "ok", ""
+    key = _guard_key(pq, limit)
+    est = cost_guard.lookup(key)
+    if est is None:
+        try:
+            with metrics.timed("sql_explain_seconds", path="async"):
+                await cur.execute(explain_sql(_explain_target(pq, limit)))
+                doc = (await cur.fetchone())[0]
+            est = cost_guard.store(key, doc, pq.tables)
+        except Exception:
+            cost_guard.explain_failed()
+    return cost_guard.verdict(est)
+
+def query_plan_markdown(query: str, limit: int | None) -> str:
+    """Compact plan summary for the last EXPLAIN of `query` at this row cap, "" if none."""
+    est = cost_guard.lookup(_guard_key(analyze(query), limit))
+    return est.summary_markdown() if est else ""
+
+def plan_cache_stats() -> dict:
+    """Prepared-statement reuse: hits, prepares, fallbacks, hit_rate."""
+    return plan_cache.stats()
+
+def _execute_planned(conn, cur, pq: ParsedQuery, sql_to_run: str):
+    """
+    cur.execute(sql_to_run), via PREPARE/EXECUTE when plan_cache has a plan.
+    If PREPARE fails, or plan_cache turns down the inferred parameter
+    types, the plain SQL runs instead. Errors from EXECUTE are the query's
+    own and propagate as they would without the cache (no second run); only
+    a statement that has gone missing from the session, or whose plan no
+    longer fits the table after a schema change, is re-run plainly.
+    """
+    plan = None if pq.is_write else plan_cache.plan(conn, sql_to_run)
+    if plan is None:
+        cur.execute(sql_to_run)
+        return
+    for name in plan.deallocate:
+        try:
+            cur.execute(f"DEALLOCATE {name}")
+        except Exception:
+            pass
+    if plan.prepare:
+        try:
+            cur.execute(plan.prepare)
+            cur.execute(PARAM_TYPES_SQL, (plan.name,))
+            usable = plan_cache.prepared(conn, plan, cur.fetchone()[0])
+        except Exception as e:
+            plan_cache.failed(conn, plan)
+            if isinstance(e, psycopg2.errors.QueryCanceled):
+                raise
+            usable = False
+        if not usable:
+            cur.execute(sql_to_run)
+            return
+    try:
+        cur.execute(plan.execute)
+    except psycopg2.errors.InvalidSqlStatementName:
+        plan_cache.lost(conn, plan)
+        cur.execute(sql_to_run)
+    except psycopg2.errors.FeatureNotSupported:
+        # "cached plan must not change result type": the table changed under
+        # it. failed() has the statement DEALLOCATEd with this connection's next plan
+        plan_cache.failed(conn, plan)
+        cur.execute(sql_to_run)
+
+async def _execute_planned_async(conn, cur, pq: ParsedQuery, sql_to_run: str):
+    """_execute_planned for psycopg 3."""
+    plan = None if pq.is_write else plan_cache.plan(conn, sql_to_run)
+    if plan is None:
+        await cur.execute(sql_to_run)
+        return
+    for name in plan.deallocate:
+        try:
+            await cur.execute(f"DEALLOCATE {name}")
+        except Exception:
+            pass
+    if plan.prepare:
+        try:
+            await cur.execute(plan.prepare)
+            await cur.execute(PARAM_TYPES_SQL, (plan.name,))
+            usable = plan_cache.prepared(conn, plan, (await cur.fetchone())[0])
+        except Exception as e:
+            plan_cache.failed(conn, plan)
+            if isinstance(e, psycopg.errors.QueryCanceled):
+                raise
+            usable = False
+        if not usable:
+            await cur.execute(sql_to_run)
+            return
+    try:
+        await cur.execute(plan.execute)
+    except psycopg.errors.InvalidSqlStatementName:
+        plan_cache.lost(conn, plan)
+        await cur.execute(sql_to_run)
+    except psycopg.errors.FeatureNotSupported:
+        # "cached plan must not change result type": the table changed under
+        # it. failed() has the statement DEALLOCATEd with this connection's next plan
+        plan_cache.failed(conn, plan)
+        await cur.execute(sql_to_run)
+
+def execute(query: str, max_rows: int, allow_writes: bool):
+    """Blocking psycopg2 execution; returns (QueryResult, meta, elapsed)."""
+    pq = analyze(query)
+    msg = _check_query(pq, allow_writes)
+    if msg:
+        return QueryResult(), msg, 0.0
+
+    sql_to_run = pq.with_limit(max_rows)
+    key = (pq.normalized, int(max_rows))
+    cached = _from_cache(pq, key)
+    if cached:
+        return cached
 
-    sql_to_run = enforce_limit(query, max_rows)
     started = time.perf_counter()
     conn = None
     try:
         conn = _borrow_conn()
-        with conn.cursor(cursor_factory=extras.RealDictCursor) as cur:
-            cur.execute("SET LOCAL statement_timeout = 10000;")
-            cur.execute(sql_to_run)
-            rows = cur.fetchall() if cur.description else []
-            df = pd.DataFrame(rows)
+        with conn.cursor() as cur:
+            verdict, warning = _preflight(cur, pq, max_rows)
+            if verdict == "reject":
+                return QueryResult(), warning, 0.0
+            with metrics.timed("sql_execute_seconds", path="sync"):
+                _execute_planned(conn, cur, pq, sql_to_run)
+            with metrics.timed("sql_fetch_seconds", path="sync"):
+                rows = cur.fetchall() if cur.description else []
+            result = QueryResult.from_cursor(cur, rows)
+            if CACHE_BROADCAST and pq.writes_data:
+                cur.execute(*_invalidation_notice(pq))
+    except PoolTimeout:
+        return QueryResult(), "Error: the database is busy, please try again.", 0.0
     except Exception as e:
-        return pd.DataFrame(), f"Error: {e}", 0.0
+        return QueryResult(), f"Error: {e}", 0.0
     finally:
         if conn: _return_conn(conn)
 
-    elapsed = time.perf_counter() - started
-    meta = f"Rows: {len(df)} | Time: {elapsed:.3f}s"
-    df.replace([np.inf, -np.inf], pd.NA, inplace=True)
-    df = df.where(pd.notnull(df), None) 
-    return df, meta, elapsed
\ No newline at end of file
+    return _after_run(pq, key, result, time.perf_counter() - started, warning)
+
+async def execute_async(query: str, max_rows: int, allow_writes: bool):
+    """
+    Same as execute but on the event loop with psycopg 3, so no threadpool
+    worker is held for the query.
+    """
+    pq = analyze(query)
+    msg = _check_query(pq, allow_writes)
+    if msg:
+        return QueryResult(), msg, 0.0
+    return await _execute_sql_async(pq, pq.with_limit(max_rows), (pq.normalized, int(max_rows)), max_rows)
+
+async def _execute_sql_async(pq: ParsedQuery, sql_to_run: str, key, limit):
+    """
+    Runs `sql_to_run` on behalf of `pq`; `key` is its result-cache key and
+    `limit` the row cap the cost guard judges it at.
+    """
+    cached = _from_cache(pq, key)
+    if cached:
+        return cached
+
+    started = time.perf_counter()
+    try:
+        pool = await _get_async_pool()
+        waited = time.perf_counter()
+        async with pool.connection() as conn:
+            metrics.observe("db_pool_wait_seconds", time.perf_counter() - waited, pool="async")
+            async with conn.cursor() as cur:
+                verdict, warning = await _preflight_async(cur, pq, limit)
+                if verdict == "reject":
+                    return QueryResult(), warning, 0.0
+                with metrics.timed("sql_execute_seconds", path="async"):
+                    await _execute_planned_async(conn, cur, pq, sql_to_run)
+                with metrics.timed("sql_fetch_seconds", path="async"):
+                    rows = await cur.fetchall() if cur.description else []
+                result = QueryResult.from_cursor(cur, rows)
+                if CACHE_BROADCAST and pq.writes_data:
+                    await cur.execute(*_invalidation_notice(pq))
+    except PoolTimeoutAsync:
+        return QueryResult(), "Error: the database is busy, please try again.", 0.0
+    except Exception as e:
+        return QueryResult(), f"Error: {e}", 0.0
+
+    return _after_run(pq, key, result, time.perf_counter() - started, warning)
+
+
+# --- large results: server-side cursors and pagination ---
+
+_cursor_ids = itertools.count()
+
+async def stream_sql_async(query: str, batch_size: int = STREAM_BATCH, max_rows: int | None = None):
+    """
+    Yields QueryResult batches of at most `batch_size` rows from a named
+    (server-side) cursor, so memory stays bounded however large the result is.
+    No LIMIT is injected; `max_rows` optionally stops the stream early.
+    Raises ValueError for queries that can't be streamed or that the cost
+    guard rejects.
+    """
+    pq = analyze(query)
+    msg = _check_query(pq, allow_writes=False)
+    if msg:
+        raise ValueError(msg)
+    if not pq.returns_rows:
+        raise ValueError("Only SELECT/WITH/VALUES/TABLE queries can be streamed.")
+
+    sent = 0
+    pool = await _get_async_pool()
+    waited = time.perf_counter()
+    async with pool.connection() as conn:
+        metrics.observe("db_pool_wait_seconds", time.perf_counter() - waited, pool="async")
+        async with conn.cursor() as cur:
+            verdict, message = await _preflight_async(cur, pq, max_rows)
+        if verdict == "reject":
+            raise ValueError(message)
+        # Named cursors only live inside a transaction
+        async with conn.transaction():
+            async with conn.cursor(name=f"stream_{next(_cursor_ids)}") as cur:
+                with metrics.timed("sql_execute_seconds", path="stream"):
+                    await cur.execute(pq.text)
+                while max_rows is None or sent < max_rows:
+                    n = batch_size if max_rows is None else min(batch_size, max_rows - sent)
+                    with metrics.timed("sql_fetch_seconds", path="stream"):
+                        rows = await cur.fetchmany(n)
+                    if not rows:
+                        break
+                    sent += len(rows)
+                    yield QueryResult.from_cursor(cur, rows)
+
+def _query_digest(query: str) -> str:
+    return hashlib.sha1(analyze(query).normalized.encode()).hexdigest()[:16]
+
+def encode_page_token(query: str, offset: int, page_size: int) -> str:
+    raw = json.dumps({"q": _query_digest(query), "o": offset, "n": page_size}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_page_token(query: str, token: str | None, page_size: int) -> int:
+    """Offset the token points at; 0 for no token or a token from another query/page size."""
+    if not token:
+        return 0
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        return 0
+    if data.get("q") != _query_digest(query) or data.get("n") != page_size:
+        return 0
+    return max(0, int(data.get("o", 0)))
+
+async def fetch_page_async(query: str, page_size: int, page_token: str | None = None,
+                           allow_writes: bool = False):
+    """
+    One page of a read query via LIMIT/OFFSET around the original statement.
+    Returns (QueryResult, meta, elapsed, prev_token, next_token); tokens are
+    None at either end. Anything that can't be wrapped runs as a single page.
+    """
+    pq = analyze(query)
+    msg = _check_query(pq, allow_writes)
+    if msg:
+        return QueryResult(), msg, 0.0, None, None
+    if not pq.returns_rows:
+        result, meta, elapsed = await _execute_sql_async(pq, pq.with_limit(page_size), (pq.normalized, int(page_size)), page_size)
+        return result, meta, elapsed, None, None
+
+    offset = decode_page_token(query, page_token, page_size)
+    # One extra row tells us whether there is a next page
+    paged = f"SELECT * FROM ({pq.text}\n) AS _page LIMIT {int(page_size) + 1} OFFSET {offset}"
+    # judged as its first page; later pages cost a little more for the OFFSET
+    result, meta, elapsed = await _execute_sql_async(pq, paged, (pq.normalized, int(page_size) + 1, offset), page_size)
+    if meta.startswith("Error"):
+        return result, meta, elapsed, None, None
+
+    has_next = len(result) > page_size
+    if has_next:
+        result = QueryResult(result.columns, result.type_oids, result.rows[:page_size])
+    prev_token = encode_page_token(query, max(0, offset - page_size), page_size) if offset else None
+    next_token = encode_page_token(query, offset + page_size, page_size) if has_next else None
+    first = offset + 1 if len(result) else offset
+    meta = f"Rows {first}-{offset + len(result)}{'+' if has_next else ''} | " + meta.split(" | ", 1)[-1]
+    return result, meta, elapsed, prev_token, next_token
+
+def run_sql(query: str, max_rows: int, allow_writes: bool):
+    """
+    Blocking psycopg2 path, kept for callers that are not on an event loop.
+    New code should await run_sql_async instead.
+    """
+    result, meta, elapsed = execute(query, max_rows, allow_writes)
+    return result.to_df(), meta, elapsed
+
+async def run_sql_async(query: str, max_rows: int, allow_writes: bool):
+    """Same contract as run_sql (df, meta, elapsed), awaited on the event loop."""
+    result, meta, elapsed = await execute_async(query, max_rows, allow_writes)
+    return result.to_df(), meta, elapsed
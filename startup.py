@@ -0,0 +1,90 @@
+"""
+Import timing and warm-up for server.py.
+
+server.py imports this first and calls mark() after each group of imports,
+so the log shows where a cold start goes (gradio and building the Blocks UI
+dominate). The lifespan hook then runs the warm-up steps in the background:
+the pool connections, the OpenAI client, the tokenizer and system prompt,
+and optionally the queries listed in WARMUP_QUERIES (a file, one query per
+line, `--` comments allowed), which primes the result cache, cost-guard
+estimates and Postgres' buffers. /healthz answers 503 until every step has
+run; a step that fails is logged and reported but doesn't hold readiness
+back, since the first real request would hit the same error anyway.
+WARMUP=0 skips the steps (the worker is ready as soon as it starts).
+"""
+import asyncio
+import logging
+import os
+import time
+
+WARMUP = os.getenv("WARMUP", "1").lower() not in {"0", "false", "no"}
+WARMUP_QUERIES = os.getenv("WARMUP_QUERIES", "")
+WARMUP_SYNC_POOL = os.getenv("WARMUP_SYNC_POOL", "0").lower() in {"1", "true", "yes"}  # only /e2e/sql/sync uses it
+WARMUP_ROW_LIMIT = int(os.getenv("WARMUP_ROW_LIMIT", "200"))   # the /e2e/sql default
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))      # per step
+
+log = logging.getLogger("uvicorn.error")
+
+_started = time.perf_counter()
+_last = _started
+_phases: list[tuple[str, float]] = []
+
+
+def mark(phase: str):
+    """Ends an import phase that started at the previous mark (or at this module's import)."""
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+
+def import_report() -> str:
+    total = _last - _started
+    parts = ", ".join(f"{name} {secs:.2f}s" for name, secs in _phases)
+    return f"imports {total:.2f}s ({parts})"
+
+
+def read_queries(path: str) -> list[str]:
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("--"):
+                queries.append(line)
+    return queries
+
+
+class WarmUp:
+    """Runs (name, async fn) steps in order and remembers how each went."""
+
+    def __init__(self):
+        self.state = "pending"    # pending | warming | ready
+        self.steps = {}           # name -> seconds, or "error: ..."
+        self.seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def run(self, steps):
+        self.state = "warming"
+        started = time.perf_counter()
+        for name, fn in steps if WARMUP else ():
+            t0 = time.perf_counter()
+            try:
+                await asyncio.wait_for(fn(), WARMUP_TIMEOUT)
+                self.steps[name] = round(time.perf_counter() - t0, 3)
+            except Exception as e:
+                self.steps[name] = f"error: {type(e).__name__}: {e}"
+                log.warning("warm-up step %s failed: %s", name, self.steps[name])
+        self.seconds = time.perf_counter() - started
+        self.state = "ready"
+        done = ", ".join(f"{k} {v:.2f}s" if isinstance(v, float) else f"{k} failed" for k, v in self.steps.items())
+        log.info("warm-up %.2fs (%s); %s", self.seconds, done or "skipped", import_report())
+
+    def report(self) -> dict:
+        return dict(state=self.state, seconds=round(self.seconds, 3), steps=dict(self.steps),
+                    imports={name: round(secs, 3) for name, secs in _phases})
+
+
+warmup = WarmUp()
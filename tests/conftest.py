@@ -0,0 +1,11 @@
+"""
+Unit tests for the pure-Python parts: no Postgres, OpenAI or server needed.
+
+    python -m pytest -q tests
+
+The app modules live at the repository root, not in a package.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
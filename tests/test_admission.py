@@ -0,0 +1,131 @@
+import asyncio
+import types
+
+import pytest
+
+import admission
+from admission import Gate, RateLimiter, Rejected
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+# --- RateLimiter ---
+
+def test_burst_then_wait(clock):
+    rl = RateLimiter(rate=2, burst=3)
+    assert [rl.take("u") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert rl.take("u") == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_the_burst(clock):
+    rl = RateLimiter(rate=1, burst=2)
+    rl.take("u"), rl.take("u")
+    clock[0] += 1
+    assert rl.take("u") == 0.0 and rl.take("u") > 0
+    clock[0] += 100
+    assert rl.take("u") == 0.0 and rl.take("u") == 0.0 and rl.take("u") > 0
+
+
+def test_keys_have_separate_buckets(clock):
+    rl = RateLimiter(rate=1, burst=1)
+    assert rl.take("a") == 0.0 and rl.take("a") > 0
+    assert rl.take("b") == 0.0
+
+
+def test_zero_rate_disables(clock):
+    rl = RateLimiter(rate=0, burst=1)
+    assert all(rl.take("u") == 0.0 for _ in range(100))
+
+
+def test_least_recently_seen_keys_are_forgotten(clock):
+    rl = RateLimiter(rate=1, burst=1, max_keys=2)
+    rl.take("a"), rl.take("b"), rl.take("c")     # a is forgotten: a fresh bucket
+    assert rl.take("a") == 0.0
+    assert rl.take("c") > 0
+
+
+# --- Gate ---
+
+def test_gate_queues_then_hands_over_in_order():
+    async def run():
+        gate, order = Gate("db", 1, queue_max=5, timeout=5), []
+
+        async def job(i):
+            await gate.acquire()
+            order.append(i)
+            await asyncio.sleep(0)
+            gate.release()
+
+        await asyncio.gather(*(job(i) for i in range(4)))
+        return gate.stats(), order
+    stats, order = asyncio.run(run())
+    assert order == [0, 1, 2, 3]
+    assert (stats["admitted"], stats["in_use"], stats["waiting"]) == (4, 0, 0)
+
+
+def test_gate_rejects_when_the_queue_is_full():
+    async def run():
+        gate = Gate("db", 1, queue_max=1, timeout=5)
+        await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as e:
+            await gate.acquire()
+        gate.release()
+        await waiter
+        gate.release()
+        return gate.stats(), e.value
+    stats, err = asyncio.run(run())
+    assert err.reason == "busy" and stats["shed_queue_full"] == 1 and stats["in_use"] == 0
+
+
+def test_gate_times_out_a_waiter():
+    async def run():
+        gate = Gate("db", 1, queue_max=5, timeout=0.01)
+        await gate.acquire()
+        with pytest.raises(Rejected):
+            await gate.acquire()
+        gate.release()
+        return gate.stats()
+    stats = asyncio.run(run())
+    assert (stats["shed_timeout"], stats["in_use"], stats["waiting"]) == (1, 0, 0)
+
+
+def test_cancelled_waiter_gives_back_nothing():
+    async def run():
+        gate = Gate("db", 1, queue_max=5, timeout=5)
+        await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        gate.release()
+        return gate.stats()
+    stats = asyncio.run(run())
+    assert (stats["in_use"], stats["waiting"]) == (0, 0)
+
+
+# --- admit ---
+
+def test_admit_rate_limits_per_identity_only(monkeypatch, clock):
+    monkeypatch.setitem(admission._kinds, "sql", (RateLimiter(1, 1), Gate("db", 10)))
+
+    async def run():
+        for _ in range(5):               # no identity: nobody to charge
+            async with admission.admit("sql"):
+                pass
+        async with admission.admit("sql", "alice"):
+            pass
+        async with admission.admit("sql", None, "session-b"):
+            pass
+        with pytest.raises(Rejected) as e:
+            async with admission.admit("sql", "alice"):
+                pass
+        return e.value
+    err = asyncio.run(run())
+    assert err.reason == "rate" and err.retry_after == pytest.approx(1.0)
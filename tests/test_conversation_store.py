@@ -0,0 +1,98 @@
+import asyncio
+import random
+
+import pytest
+
+import chat_helpers
+import conversation_store
+from chat_helpers import truncate_history
+from conversation_store import Conversation, ConversationStore
+
+SYSTEM = "you answer questions about the games database"
+WORDS = "select sales from where genre drama top ten titles by revenue and year please show me".split()
+
+
+class WhitespaceEncoding:
+    """One token per word, so the tests need neither tiktoken nor its downloaded tables."""
+
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def offline_tokens(monkeypatch):
+    monkeypatch.setattr(chat_helpers, "get_encoding", lambda model="gpt-4.1": WhitespaceEncoding())
+    monkeypatch.setattr(chat_helpers, "get_db_sys_prompt", lambda: SYSTEM)
+    monkeypatch.setattr(conversation_store, "get_db_sys_prompt", lambda: SYSTEM)
+    chat_helpers._token_cache.clear()
+    chat_helpers._summary_cache.clear()
+    yield
+    chat_helpers._token_cache.clear()
+    chat_helpers._summary_cache.clear()
+
+
+def text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 40)))
+
+
+def expected(history, message, max_tokens, policy):
+    parts = [{"role": "system", "content": SYSTEM}, *history, {"role": "user", "content": message}]
+    return truncate_history([dict(m) for m in parts], max_tokens, policy=policy)
+
+
+@pytest.mark.parametrize("policy", ["drop_oldest", "pairs", "summarize"])
+@pytest.mark.parametrize("seed", range(40))
+def test_build_input_matches_truncate_history(policy, seed):
+    rng = random.Random(seed)
+    conv, history = Conversation("s"), []
+    for _ in range(rng.randint(1, 30)):
+        message = text(rng)
+        # budgets go up and down between turns, so the window moves both ways
+        max_tokens = rng.choice([20, 60, 150, 320, 400, 700, 5000])
+        assert conv.build_input(message, max_tokens, policy) == expected(history, message, max_tokens, policy)
+        if rng.random() < 0.8:
+            answer = text(rng)
+            conv.add_turn(message, answer)
+            history += [{"role": "user", "content": message}, {"role": "assistant", "content": answer}]
+        else:
+            # unpaired messages too, e.g. a turn whose answer failed
+            role = rng.choice(["user", "assistant"])
+            conv.add(role, message)
+            history.append({"role": role, "content": message})
+
+
+def test_window_only_counts_new_messages():
+    conv = Conversation("s", [{"role": "user", "content": "a b"}, {"role": "assistant", "content": "c"}])
+    assert conv.tokens == [2, 1] and conv.window_tokens == 3
+    conv.add("user", "d e f")
+    assert conv.tokens == [2, 1, 3] and conv.window_tokens == 6
+
+
+def test_max_messages_drops_the_oldest(monkeypatch):
+    monkeypatch.setattr(conversation_store, "CHAT_STORE_MAX_MESSAGES", 3)
+    conv = Conversation("s")
+    for i in range(5):
+        conv.add("user", f"m{i}")
+    assert [m["content"] for m in conv.messages] == ["m2", "m3", "m4"] and len(conv.tokens) == 3
+
+
+def test_store_evicts_and_reloads_from_the_spill_dir(tmp_path):
+    async def run():
+        store = ConversationStore(max_sessions=1, idle=3600, spill_dir=str(tmp_path))
+        a = await store.get("a")
+        a.add_turn("hello there", "hi")
+        await store.get("b")                   # evicts a to disk
+        again = await store.get("a")
+        return store.stats(), again
+    stats, again = asyncio.run(run())
+    assert [m["content"] for m in again.messages] == ["hello there", "hi"]
+    assert (stats["evicted"], stats["spilled"], stats["loaded"]) == (2, 1, 1)
+
+
+def test_store_without_spill_dir_starts_over():
+    async def run():
+        store = ConversationStore(max_sessions=1, idle=3600, spill_dir="")
+        (await store.get("a")).add_turn("hello", "hi")
+        await store.get("b")
+        return await store.get("a")
+    assert len(asyncio.run(run())) == 0
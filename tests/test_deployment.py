@@ -0,0 +1,47 @@
+import pytest
+
+import deployment
+from deployment import pg_pool_sizes
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    def set_(workers=1, budget=0, pool_max=10, broadcast=False, sync_share=0.25):
+        for name, value in dict(WORKERS=workers, PG_CONN_BUDGET=budget, PG_POOL_MAX=pool_max,
+                                CACHE_BROADCAST=broadcast, PG_SYNC_POOL_SHARE=sync_share).items():
+            monkeypatch.setattr(deployment, name, value)
+    return set_
+
+
+def test_pool_max_is_the_total_for_both_pools(settings):
+    settings(pool_max=10)
+    assert pg_pool_sizes() == (8, 2)
+
+
+@pytest.mark.parametrize("workers, budget, broadcast", [(1, 20, False), (4, 100, True), (3, 40, False), (8, 50, True)])
+def test_budget_is_never_exceeded(settings, workers, budget, broadcast):
+    settings(workers=workers, budget=budget, broadcast=broadcast)
+    async_max, sync_max = pg_pool_sizes()
+    assert workers * (async_max + sync_max + broadcast) <= budget
+    assert async_max >= 1 and sync_max >= 1
+
+
+def test_listener_is_reserved_only_with_broadcast(settings):
+    settings(workers=4, budget=40, broadcast=True)
+    assert sum(pg_pool_sizes()) == 9
+    settings(workers=4, budget=40, broadcast=False)
+    assert sum(pg_pool_sizes()) == 10
+
+
+def test_too_small(settings):
+    settings(workers=4, budget=8, broadcast=True)
+    with pytest.raises(ValueError, match="PG_CONN_BUDGET"):
+        pg_pool_sizes()
+    settings(pool_max=1)
+    with pytest.raises(ValueError, match="PG_POOL_MAX"):
+        pg_pool_sizes()
+
+
+def test_per_worker(settings):
+    settings(workers=4)
+    assert deployment.per_worker(64) == 16 and deployment.per_worker(2) == 1
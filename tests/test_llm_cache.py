@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from llm_cache import ResponseCache, fold
+
+
+class Upstream:
+    """A slow LLM call that counts how often it was made and whether it was cancelled."""
+
+    def __init__(self, text="answer", delay=0.05):
+        self.text, self.delay = text, delay
+        self.calls = self.cancelled = 0
+
+    async def once(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.text
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for word in self.text.split():
+                await asyncio.sleep(self.delay / 4)
+                yield False, word + " "
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_once_caches_and_coalesces():
+    async def main():
+        cache, up = ResponseCache(enabled=True), Upstream()
+        texts = await asyncio.gather(*(cache.once("k", up.once) for _ in range(5)))
+        return texts, await cache.once("k", up.once), up.calls, cache.stats()
+    texts, again, calls, stats = run(main())
+    assert texts == ["answer"] * 5 and again == "answer" and calls == 1
+    assert (stats["misses"], stats["coalesced"], stats["hits"], stats["in_flight"]) == (1, 4, 1, 0)
+
+
+def test_once_leader_disconnect_doesnt_cancel_the_others():
+    async def main():
+        cache, up = ResponseCache(enabled=True), Upstream()
+        leader = asyncio.ensure_future(cache.once("k", up.once))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.once("k", up.once))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower, leader.cancelled(), up.cancelled
+    assert run(main()) == ("answer", True, 0)
+
+
+def test_once_cancels_the_call_when_nobody_waits():
+    async def main():
+        cache, up = ResponseCache(enabled=True), Upstream()
+        waiters = [asyncio.ensure_future(cache.once("k", up.once)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        # a new request starts over instead of joining the cancelled call
+        text = await cache.once("k", up.once)
+        return up.cancelled, up.calls, text
+    assert run(main()) == (1, 2, "answer")
+
+
+def test_once_errors_reach_every_waiter_and_arent_cached():
+    async def main():
+        cache = ResponseCache(enabled=True)
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+        results = await asyncio.gather(*(cache.once("k", boom) for _ in range(3)), return_exceptions=True)
+        return results, cache.get("k"), cache.stats()["errors"]
+    results, cached, errors = run(main())
+    assert all(isinstance(r, ValueError) for r in results) and cached is None and errors == 1
+
+
+def test_stream_follower_survives_the_leader_leaving():
+    async def main():
+        cache, up = ResponseCache(enabled=True), Upstream("a b c d")
+        leader = cache.stream("k", up.stream)
+        await leader.__anext__()
+        follower = asyncio.ensure_future(_collect(cache.stream("k", up.stream)))
+        await asyncio.sleep(0)
+        await leader.aclose()
+        return fold(await follower), up.cancelled, fold(cache.get("k"))
+    assert run(main()) == ("a b c d ", 0, "a b c d ")
+
+
+def test_stream_cancels_upstream_when_the_last_follower_leaves():
+    async def main():
+        cache, up = ResponseCache(enabled=True), Upstream("a b c d")
+        gen = cache.stream("k", up.stream)
+        await gen.__anext__()
+        await gen.aclose()
+        await asyncio.sleep(0.05)
+        return up.cancelled, cache.get("k"), cache.stats()["in_flight"]
+    assert run(main()) == (1, None, 0)
+
+
+def test_drive_stays_cancelled_on_shutdown():
+    async def main():
+        cache, up = ResponseCache(enabled=True), Upstream("a b c d", delay=1)
+        follower = asyncio.ensure_future(_collect(cache.stream("k", up.stream)))
+        await asyncio.sleep(0.01)
+        (task,) = cache._tasks
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return task.cancelled()
+    assert run(main())
+
+
+async def _collect(gen):
+    return [item async for item in gen]
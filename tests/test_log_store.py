@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from log_store import SegmentedLogStore
+
+
+def records():
+    out = []
+    for i in range(30):
+        out.append({"ts": f"2025-03-01T10:{i:02d}:00Z", "user": f"u{i % 3}", "session_id": f"s{i % 5}",
+                    "kind": "sql" if i % 2 else "chat_user", "i": i, "text": "héllo\nworld"})
+    return out
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = SegmentedLogStore(tmp_path / "store")
+    yield s
+    s.close()
+
+
+def write(store, recs, batch=7):
+    for k in range(0, len(recs), batch):
+        store.write_batch([(r, json.dumps(r, ensure_ascii=False)) for r in recs[k:k + batch]])
+
+
+def test_round_trip_in_timestamp_order(store):
+    recs = records()
+    write(store, recs[::-1])
+    assert list(store.query()) == recs
+
+
+def test_filters(store):
+    recs = records()
+    write(store, recs)
+    assert [r["i"] for r in store.query(session_id="s1")] == [1, 6, 11, 16, 21, 26]
+    assert [r["i"] for r in store.query(user="u0", kind="sql")] == [3, 9, 15, 21, 27]
+    assert [r["i"] for r in store.query(since="2025-03-01T10:05:00Z", until="2025-03-01T10:08:00Z")] == [5, 6, 7]
+    assert [r["i"] for r in store.query(limit=2)] == [0, 1]
+
+
+def test_compressed_segments_read_back_the_same(store):
+    recs = records()
+    write(store, recs)
+    store.seal()
+    assert store.compress_sealed() == 1
+    assert not list(store.seg_dir.glob("*.jsonl")) and list(store.seg_dir.glob("*.jsonl.gz"))
+    assert list(store.query()) == recs
+    assert store.compress_sealed() == 0
+
+
+def test_compress_on_seal(tmp_path):
+    s = SegmentedLogStore(tmp_path / "store", compress=True)
+    recs = records()
+    write(s, recs)
+    s.close()
+    reopened = SegmentedLogStore(tmp_path / "store")
+    try:
+        assert list(reopened.query(kind="chat_user")) == [r for r in recs if r["kind"] == "chat_user"]
+    finally:
+        reopened.close()
+
+
+def test_export_and_migrate(store, tmp_path):
+    recs = records()
+    write(store, recs)
+    src = tmp_path / "jsonl"
+    src.mkdir()
+    assert store.export(src / "all.jsonl") == 30
+    (src / "all.jsonl").open("a").write("\n{cut short\n")
+    other = SegmentedLogStore(tmp_path / "other")
+    try:
+        assert other.migrate_jsonl(src, batch_size=4) == 30
+        assert list(other.query()) == recs
+    finally:
+        other.close()
@@ -0,0 +1,194 @@
+import gc
+
+import pytest
+
+from plan_cache import PlanCache, parameterize, literals_fit
+
+
+class Conn:
+    """Stands in for a pooled connection; PlanCache only uses it as a weak key."""
+
+
+# --- parameterize ---
+
+def test_lifts_comparison_limit_and_like_literals():
+    shape, lits = parameterize("SELECT * FROM sales WHERE genre = 'Drama' AND runtime > 150 LIMIT 20 OFFSET 40")
+    assert shape == "SELECT * FROM sales WHERE genre = $1 AND runtime > $2 LIMIT $3 OFFSET $4"
+    assert lits == ["'Drama'", "150", "20", "40"]
+    shape, lits = parameterize("SELECT title FROM metadata WHERE title ILIKE '%star%'")
+    assert shape == "SELECT title FROM metadata WHERE title ILIKE $1" and lits == ["'%star%'"]
+
+
+def test_queries_differing_in_literals_share_a_shape():
+    a = parameterize("SELECT * FROM sales WHERE runtime > 150 LIMIT 100")
+    b = parameterize("SELECT * FROM sales WHERE runtime > 120 LIMIT 100")
+    assert a[0] == b[0] and a[1] != b[1]
+
+
+def test_leaves_other_literals_alone():
+    # select-list constants, decimals, IN lists, E'' strings and oversized ints stay literal
+    sql = "SELECT 1, 2.5 FROM t WHERE a IN (1, 2) AND b = E'x\\'y' AND c = 99999999999999999999"
+    shape, lits = parameterize(sql)
+    assert shape == sql and lits == []
+
+
+def test_keeps_quoting_and_comments_intact():
+    shape, lits = parameterize("SELECT \"a;b\" FROM t /* x = 1 */ WHERE s = 'it''s' -- LIMIT 5\n")
+    assert lits == ["'it''s'"]
+    assert shape.startswith('SELECT "a;b" FROM t WHERE s = $1')
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM t WHERE id = 1",
+    "UPDATE t SET a = 'x' WHERE id = 2",
+    "SELECT 1; SELECT 2",
+    "SELECT $1",
+    "SELECT $$x$$ WHERE a = 1",
+    "SELECT 'unterminated",
+])
+def test_refuses_writes_placeholders_dollar_quotes_and_multi_statements(sql):
+    assert parameterize(sql) is None
+
+
+# --- PlanCache ---
+
+SQL = "SELECT * FROM sales WHERE runtime > 150"
+SQL2 = "SELECT * FROM sales WHERE runtime > 90"
+
+
+def test_disabled_cache_never_plans():
+    assert PlanCache(enabled=False).plan(Conn(), SQL) is None
+
+
+def test_prepares_at_threshold_then_hits():
+    pc, conn = PlanCache(threshold=2, enabled=True), Conn()
+    assert pc.plan(conn, SQL) is None                      # first sighting: cold
+    plan = pc.plan(conn, SQL2)                             # same shape, second sighting
+    assert plan.prepare == f"PREPARE {plan.name} AS SELECT * FROM sales WHERE runtime > $1"
+    assert plan.execute == f"EXECUTE {plan.name} (90)"
+    assert pc.prepared(conn, plan, ["integer"])
+    hit = pc.plan(conn, SQL)
+    assert hit.prepare is None and hit.execute == f"EXECUTE {plan.name} (150)"
+    s = pc.stats()
+    assert (s["cold"], s["prepares"], s["hits"]) == (1, 1, 1)
+
+
+def test_statements_are_per_connection():
+    pc = PlanCache(threshold=1, enabled=True)
+    a, b = Conn(), Conn()
+    pc.prepared(a, pc.plan(a, SQL), ["integer"])
+    assert pc.plan(b, SQL).prepare is not None
+
+
+def test_lru_eviction_deallocates_the_oldest_statement():
+    pc, conn = PlanCache(size=2, threshold=1, enabled=True), Conn()
+    names = []
+    for col in ("a", "b"):
+        p = pc.plan(conn, f"SELECT * FROM t WHERE {col} = 1")
+        pc.prepared(conn, p, ["integer"])
+        names.append(p.name)
+    pc.plan(conn, "SELECT * FROM t WHERE a = 2")          # touch a: b is now the oldest
+    p = pc.plan(conn, "SELECT * FROM t WHERE c = 1")
+    assert p.deallocate == [names[1]]
+    assert pc.stats()["evictions"] == 1 and pc.stats()["statements"] == 2
+    assert pc.plan(conn, "SELECT * FROM t WHERE b = 1").prepare is not None
+
+
+def test_integer_literal_against_text_marks_the_shape_bad():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    plan = pc.plan(conn, "SELECT * FROM t WHERE title = 5")
+    assert not plan.types_ok(["text"])
+    assert not pc.prepared(conn, plan, ["text"])
+    assert pc.plan(conn, "SELECT * FROM t WHERE title = 6") is None
+    assert pc.stats()["failures"] == 1
+
+
+def test_string_literals_take_any_type():
+    plan = PlanCache(threshold=1, enabled=True).plan(Conn(), "SELECT * FROM t WHERE d = '2024-01-01' AND n > 3")
+    assert plan.types_ok(["date", "numeric"])
+    assert not plan.types_ok(["date", "text"])
+
+
+def test_literal_too_big_for_its_parameter_runs_plain_without_failing_the_shape():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    plan = pc.plan(conn, "SELECT * FROM t WHERE n > 5")
+    assert pc.prepared(conn, plan, ["integer"])
+    assert pc.plan(conn, "SELECT * FROM t WHERE n > 99999999999") is None
+    assert pc.plan(conn, "SELECT * FROM t WHERE n > 6").execute.endswith("(6)")
+    s = pc.stats()
+    assert (s["unfit"], s["failures"]) == (1, 0)
+
+
+def test_literals_fit_ranges():
+    assert literals_fit(["32767"], ["smallint"]) and not literals_fit(["32768"], ["smallint"])
+    assert literals_fit(["2147483647"], ["integer"]) and not literals_fit(["2147483648"], ["integer"])
+    assert literals_fit(["99999999999"], ["numeric"]) and literals_fit(["'x'"], ["text"])
+    assert not literals_fit(["1"], None)
+
+
+def test_failed_prepare_stops_preparing_the_shape():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    plan = pc.plan(conn, SQL)
+    pc.failed(conn, plan)
+    assert pc.plan(conn, SQL2) is None
+    assert pc.stats()["statements"] == 0
+
+
+def test_lost_statement_is_prepared_again():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    plan = pc.plan(conn, SQL)
+    pc.prepared(conn, plan, ["integer"])
+    pc.lost(conn, plan)
+    again = pc.plan(conn, SQL)
+    assert again.prepare is not None and again.name == plan.name
+    assert pc.stats()["failures"] == 0
+
+
+def test_closed_connections_drop_their_entries():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    pc.plan(conn, SQL)
+    assert pc.stats()["connections"] == 1
+    del conn
+    gc.collect()
+    assert pc.stats()["connections"] == 0
+
+
+def test_statement_names_differ_between_caches():
+    a = PlanCache(threshold=1, enabled=True).plan(Conn(), SQL)
+    b = PlanCache(threshold=1, enabled=True).plan(Conn(), SQL)
+    assert a.name != b.name
+
+
+def test_invalidated_tables_are_deallocated_and_prepared_again():
+    pc, a, b = PlanCache(threshold=1, enabled=True), Conn(), Conn()
+    plans = {}
+    for conn in (a, b):
+        for sql in (SQL, "SELECT * FROM metadata WHERE title = 'x'"):
+            p = pc.plan(conn, sql)
+            pc.prepared(conn, p, ["integer"] if "sales" in sql else ["text"])
+            plans[conn, "sales" in sql] = p
+    pc.invalidate_tables({"Sales"})
+    assert pc.stats()["invalidated"] == 2
+    for conn in (a, b):
+        again = pc.plan(conn, SQL)
+        assert again.prepare is not None and again.deallocate == [plans[conn, True].name]
+        assert pc.plan(conn, "SELECT * FROM metadata WHERE title = 'y'").prepare is None
+
+
+def test_invalidating_unknown_tables_drops_everything():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    p = pc.plan(conn, SQL)
+    pc.prepared(conn, p, ["integer"])
+    pc.invalidate_tables(())
+    assert pc.stats()["statements"] == 0
+    assert pc.plan(conn, SQL).deallocate == [p.name]
+
+
+def test_failed_statement_is_deallocated_with_the_next_plan():
+    pc, conn = PlanCache(threshold=1, enabled=True), Conn()
+    bad = pc.plan(conn, SQL)
+    pc.prepared(conn, bad, ["integer"])
+    pc.failed(conn, bad)                                   # e.g. EXECUTE: cached plan must not change result type
+    assert pc.plan(conn, SQL) is None
+    other = pc.plan(conn, "SELECT * FROM t WHERE a = 1")
+    assert other.deallocate == [bad.name]
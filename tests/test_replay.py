@@ -0,0 +1,50 @@
+from replay import anonymizer, build_sessions, percentile
+
+
+def rec(ts, sid, kind="sql", user="u"):
+    return {"ts": ts, "session_id": sid, "kind": kind, "user": user}
+
+
+RECORDS = [
+    rec("2025-03-01T10:00:05Z", "b", "login"),
+    rec("2025-03-01T10:00:09Z", "b"),
+    rec("2025-03-01T10:00:01Z", "a", "chat_user"),
+    rec("2025-03-01T10:00:00Z", "a", "login"),
+    rec("2025-03-01T10:00:03Z", "c", "login"),        # nothing replayable
+    rec("2025-03-01T10:00:07Z", "d"),
+    {"ts": "2025-03-01T10:00:02Z", "kind": "sql"},    # no session
+]
+
+
+def test_groups_by_session_and_sorts():
+    sessions = build_sessions(RECORDS)
+    assert [s.session_id for s in sessions] == ["a", "b", "d"]
+    assert [r["kind"] for _, r in sessions[0].events] == ["login", "chat_user"]
+    assert sessions[1].events[0][0] < sessions[1].events[1][0]
+
+
+def test_same_second_records_keep_their_order():
+    recs = [rec("2025-03-01T10:00:00Z", "a", k) for k in ("login", "sql", "chat_user", "chat_assistant")]
+    assert [r["kind"] for _, r in build_sessions(recs)[0].events] == ["login", "sql", "chat_user", "chat_assistant"]
+
+
+def test_time_window_kinds_and_max_sessions():
+    since, until = "2025-03-01T10:00:05Z", "2025-03-01T10:00:09Z"
+    assert [s.session_id for s in build_sessions(RECORDS, since, until)] == ["d"]
+    assert [s.session_id for s in build_sessions(RECORDS, kinds={"chat_user"})] == ["a"]
+    assert [s.session_id for s in build_sessions(RECORDS, max_sessions=2)] == ["a", "b"]
+
+
+def test_percentile_is_nearest_rank():
+    v = list(range(1, 101))
+    assert [percentile(v, p) for p in (50, 90, 99, 100)] == [50, 90, 99, 100]
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2
+
+
+def test_anonymizer_is_stable_per_salt():
+    a, b = anonymizer("salt"), anonymizer("other")
+    assert a("user", "alice") == a("user", "alice") != b("user", "alice")
+    assert a("user", "alice").startswith("user-") and "alice" not in a("user", "alice")
+    assert a("user", None) is None
@@ -0,0 +1,79 @@
+import types
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_hit_and_miss():
+    c = ResultCache()
+    assert c.get("q") is None
+    c.put("q", [1], 10)
+    assert c.get("q") == [1]
+    s = c.stats()
+    assert (s["hits"], s["misses"], s["entries"], s["bytes"]) == (1, 1, 1, 10)
+    assert s["hit_rate"] == 0.5
+
+
+def test_lru_evicts_the_least_recently_used():
+    c = ResultCache(max_entries=2)
+    c.put("a", 1, 1)
+    c.put("b", 2, 1)
+    c.get("a")                  # b is now the oldest
+    c.put("c", 3, 1)
+    assert c.get("b") is None and c.get("a") == 1 and c.get("c") == 3
+    assert c.stats()["evictions"] == 1
+
+
+def test_byte_budget():
+    c = ResultCache(max_bytes=100)
+    c.put("big", 1, 101)        # larger than the whole budget: not stored
+    assert c.get("big") is None
+    c.put("a", 1, 60)
+    c.put("b", 2, 60)           # over budget: a goes
+    assert c.get("a") is None and c.get("b") == 2
+    assert c.stats()["bytes"] == 60
+
+
+def test_replacing_a_key_keeps_the_byte_count_right():
+    c = ResultCache()
+    c.put("a", 1, 40)
+    c.put("a", 2, 10)
+    assert c.get("a") == 2 and c.stats()["bytes"] == 10 and c.stats()["entries"] == 1
+
+
+def test_ttl(clock):
+    c = ResultCache(ttl=5)
+    c.put("a", 1, 1)
+    clock[0] += 5
+    assert c.get("a") == 1
+    clock[0] += 0.1
+    assert c.get("a") is None
+    s = c.stats()
+    assert (s["expirations"], s["entries"], s["bytes"]) == (1, 0, 0)
+
+
+def test_invalidate_tables():
+    c = ResultCache()
+    c.put("sales", 1, 1, tables={"sales"})
+    c.put("join", 2, 1, tables={"sales", "metadata"})
+    c.put("meta", 3, 1, tables={"metadata"})
+    c.put("unknown", 4, 1)      # tables unknown: dropped by any write
+    assert c.invalidate_tables({"SALES"}) == 3
+    assert c.get("meta") == 3
+    assert [c.get(k) for k in ("sales", "join", "unknown")] == [None, None, None]
+
+
+def test_clear():
+    c = ResultCache()
+    c.put("a", 1, 1, tables={"t"})
+    c.clear()
+    assert c.stats()["entries"] == 0 and c.stats()["invalidations"] == 1
@@ -0,0 +1,227 @@
+import pytest
+
+from sql_analysis import analyze, tokenize
+
+
+def kinds(sql):
+    return [(t.kind, t.text) for t in tokenize(sql)]
+
+
+# --- tokenizer ---
+
+def test_tokenizer_drops_comments_and_whitespace():
+    assert kinds("SELECT /* a /* nested */ b */ 1 -- tail\n") == [("word", "SELECT"), ("number", "1")]
+
+
+def test_tokenizer_quoting():
+    assert kinds("'it''s'") == [("string", "'it''s'")]
+    assert kinds("E'a\\'b'") == [("string", "E'a\\'b'")]
+    assert kinds('"we""ird"') == [("qident", '"we""ird"')]
+    assert kinds("$tag$ a ; b $tag$") == [("dollar", "$tag$ a ; b $tag$")]
+    assert kinds("$1") == [("param", "$1")]
+
+
+def test_tokenizer_unterminated_input_ends_in_error():
+    assert tokenize("SELECT 'open")[-1].kind == "error"
+    assert tokenize("SELECT /* open")[-1].kind == "error"
+
+
+# --- statements ---
+
+@pytest.mark.parametrize("sql", [
+    "SELECT ';' AS semi",
+    "SELECT 1 -- ; DROP TABLE sales",
+    "SELECT 1 /* ; DROP TABLE sales */",
+    'SELECT 1 AS ";"',
+    "SELECT $$;$$",
+    "SELECT $x$ ; DELETE FROM t $x$",
+    "SELECT 1;",
+    "SELECT 1;  -- trailing comment",
+])
+def test_one_statement_despite_semicolons_in_literals(sql):
+    pq = analyze(sql)
+    assert pq.statement_count == 1 and not pq.is_write
+
+
+def test_multi_statement_counts_and_any_write_counts():
+    pq = analyze("SELECT 1; DELETE FROM sales")
+    assert pq.statement_count == 2 and pq.is_write
+    assert pq.text == "SELECT 1"
+
+
+def test_empty_and_comment_only_input():
+    for sql in ("", "   ", "-- nothing", "/* nothing */"):
+        assert analyze(sql).statement_count == 0
+
+
+# --- write guard ---
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO t VALUES (1)",
+    "update t set a = 1",
+    "DELETE FROM t",
+    "DROP TABLE t",
+    "TRUNCATE t",
+    "COPY t TO STDOUT",
+    "CALL p()",
+    "DO $$ BEGIN END $$",
+    "ANALYZE sales",
+    "EXECUTE p (1)",
+    "WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d",
+    "WITH x AS (SELECT 1) INSERT INTO t SELECT * FROM x",
+    "WITH x AS (SELECT 1) UPDATE t SET a = 1",
+    "SELECT * INTO new_t FROM sales",
+    "EXPLAIN ANALYZE DELETE FROM t",
+    "EXPLAIN ANALYZE CREATE TABLE x AS SELECT 1",
+    "EXPLAIN ANALYZE SELECT 1 INTO x",
+    "EXPLAIN (ANALYZE) EXECUTE s",
+    "EXPLAIN (FORMAT JSON, ANALYSE true) UPDATE t SET a = 1",
+    "/* hi */ (DELETE FROM t)",
+])
+def test_writes(sql):
+    pq = analyze(sql)
+    assert pq.is_write and pq.writes_data and not pq.session_only
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM sales",
+    "WITH x AS (SELECT 1) SELECT * FROM x",
+    "SELECT 'DELETE FROM t'",
+    'SELECT "delete" FROM t',
+    "SELECT * FROM t -- ; DELETE FROM t",
+    "SELECT replace(title, 'a', 'b') FROM sales",
+    "SELECT (SELECT 1 INTO x)",  # INTO below depth 0 isn't SELECT ... INTO new_table
+    "EXPLAIN DELETE FROM t",
+    "EXPLAIN VERBOSE CREATE TABLE x AS SELECT 1",
+    "EXPLAIN (FORMAT JSON) SELECT 1 INTO x",
+    "EXPLAIN ANALYZE SELECT * FROM sales",
+    "VALUES (1), (2)",
+    "TABLE sales",
+    "SHOW statement_timeout",
+    "SELECT pg_typeof(1), pg_size_pretty(10), current_setting('statement_timeout')",
+    "SELECT setval FROM t",
+    "SELECT 'set_config(1)'",
+])
+def test_reads(sql):
+    assert not analyze(sql).is_write
+
+
+@pytest.mark.parametrize("sql", [
+    "SET statement_timeout = 0",
+    "set statement_timeout to 0",
+    "SET LOCAL statement_timeout = 0",
+    "SET ROLE postgres",
+    "SET search_path = evil, public",
+    "SET SESSION AUTHORIZATION postgres",
+    "RESET ALL",
+    "DISCARD ALL",
+    "PREPARE p AS SELECT 1",
+    "DEALLOCATE ALL",
+    "LISTEN chan",
+    "NOTIFY chan",
+    "BEGIN",
+    "START TRANSACTION",
+    "COMMIT",
+    "ROLLBACK",
+    "DECLARE c CURSOR WITH HOLD FOR SELECT 1",
+    "LOAD 'x'",
+    "SELECT set_config('statement_timeout', '0', false)",
+    "SELECT pg_catalog.set_config('statement_timeout', '0', false)",
+    "SELECT \"set_config\"('statement_timeout', '0', false)",
+    "SELECT SET_CONFIG('statement_timeout', '0', false)",
+    "SELECT * FROM set_config('a', 'b', false)",
+    "SELECT set_config ('a', 'b', false)",
+    "SELECT 1 FROM sales WHERE set_config('a', 'b', false) IS NOT NULL",
+    "WITH s AS (SELECT set_config('a', 'b', false)) SELECT * FROM s",
+    "EXPLAIN ANALYZE SELECT set_config('a', 'b', false)",
+    "SELECT nextval('seq')",
+    "SELECT pg_advisory_lock(1)",
+    "SELECT pg_try_advisory_lock(1)",
+    "SELECT pg_terminate_backend(123)",
+    "SELECT pg_cancel_backend(123)",
+    "SELECT pg_reload_conf()",
+    "SELECT pg_read_file('/etc/passwd')",
+    "SELECT pg_ls_dir('.')",
+    "SELECT pg_stat_reset()",
+    "SELECT lo_import('/etc/passwd')",
+    "SELECT pg_notify('chan', 'x')",
+    "SELECT 1; SET statement_timeout = 0",
+])
+def test_session_changes_count_as_writes(sql):
+    pq = analyze(sql)
+    assert pq.is_write and pq.session_only and not pq.writes_data
+
+
+def test_quoted_function_name_is_case_sensitive():
+    # "Set_Config" is a different (user) function than set_config
+    assert not analyze('SELECT "Set_Config"(1)').is_write
+
+
+def test_data_write_and_session_change_is_a_data_write():
+    pq = analyze("WITH d AS (DELETE FROM t RETURNING 1) SELECT set_config('a', 'b', false)")
+    assert pq.is_write and pq.writes_data and not pq.session_only
+
+
+def test_update_set_is_not_a_session_command():
+    pq = analyze("UPDATE t SET a = 1")
+    assert pq.writes_data and not pq.session_only
+
+
+# --- tables, limits, normalization ---
+
+def test_tables():
+    pq = analyze("SELECT * FROM public.sales s JOIN \"Metadata\" m ON s.title = m.title, user_reviews "
+                 "WHERE EXTRACT(year FROM s.release_date) > 2000")
+    assert pq.tables == {"sales", "metadata", "user_reviews"}
+    assert analyze("WITH d AS (DELETE FROM expert_reviews RETURNING *) INSERT INTO sales SELECT 1").tables \
+        == {"expert_reviews", "sales"}
+    assert analyze("SELECT * FROM sales FOR UPDATE").tables == {"sales"}
+
+
+@pytest.mark.parametrize("sql", [
+    "TRUNCATE sales, metadata",
+    "DROP TABLE sales, metadata",
+    "DROP TABLE sales CASCADE",
+    "ALTER TABLE sales RENAME TO old_sales",
+    "CREATE OR REPLACE VIEW v AS SELECT * FROM sales",
+    "CALL refresh_sales()",
+    "EXPLAIN ANALYZE CREATE TABLE x AS SELECT * FROM sales",
+    "DELETE FROM sales; TRUNCATE metadata, user_reviews",
+])
+def test_writes_with_unknown_targets_invalidate_everything(sql):
+    # an empty set drops every cached result
+    pq = analyze(sql)
+    assert pq.writes_data and pq.tables == frozenset()
+
+
+@pytest.mark.parametrize("sql, limit, expected", [
+    ("SELECT * FROM sales", 50, "SELECT * FROM sales LIMIT 50"),
+    ("SELECT * FROM sales;", 50, "SELECT * FROM sales LIMIT 50"),
+    ("SELECT * FROM sales LIMIT 10", 50, "SELECT * FROM sales LIMIT 10"),
+    ("SELECT * FROM sales LIMIT 500", 50, "SELECT * FROM sales LIMIT 50"),
+    ("SELECT * FROM sales LIMIT ALL", 50, "SELECT * FROM sales LIMIT 50"),
+    ("SELECT * FROM sales LIMIT 500 OFFSET 5", 50, "SELECT * FROM sales LIMIT 50 OFFSET 5"),
+    ("SELECT * FROM (SELECT * FROM sales LIMIT 5) s", 50, "SELECT * FROM (SELECT * FROM sales LIMIT 5) s LIMIT 50"),
+    ("SELECT 'LIMIT 5'", 50, "SELECT 'LIMIT 5' LIMIT 50"),
+    ("SELECT * FROM sales -- LIMIT 5", 50, "SELECT * FROM sales LIMIT 50"),
+    ("SELECT * FROM sales LIMIT 2 + 3", 50, "SELECT * FROM (\nSELECT * FROM sales LIMIT 2 + 3\n) AS _limited LIMIT 50"),
+    ("DELETE FROM sales", 50, "DELETE FROM sales"),
+    ("SET statement_timeout = 0", 50, "SET statement_timeout = 0"),
+    ("SELECT set_config('a', 'b', false)", 50, "SELECT set_config('a', 'b', false)"),
+])
+def test_with_limit(sql, limit, expected):
+    assert analyze(sql).with_limit(limit) == expected
+
+
+def test_normalized_key_ignores_case_whitespace_and_comments_but_not_literals():
+    a = analyze("select *\n  FROM Sales /* c */ WHERE genre = 'Drama'")
+    b = analyze("SELECT * from sales where GENRE = 'Drama' -- x")
+    assert a.normalized == b.normalized
+    assert analyze("SELECT * FROM sales WHERE genre = 'drama'").normalized != a.normalized
+
+
+def test_volatile_queries_are_not_cacheable():
+    assert not analyze("SELECT random()").cacheable
+    assert not analyze("SELECT now()").cacheable
+    assert analyze("SELECT * FROM sales").cacheable
+    assert not analyze("SELECT set_config('a', 'b', false)").cacheable